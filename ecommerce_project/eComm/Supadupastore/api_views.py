@@ -1,18 +1,100 @@
+from decimal import Decimal, InvalidOperation
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.utils.dateparse import parse_datetime
 from django.shortcuts import get_object_or_404
-from .models import Store, Product, Review, Order
+from .models import ApiToken, Store, Product, Review, Order, OrderItem
 from .serializers import (
     StoreSerializer, ProductSerializer, ReviewSerializer, 
-    OrderSerializer, UserSerializer
+    OrderSerializer, UserSerializer, ApiTokenSerializer, ApiTokenRequestSerializer
 )
 from .permissions import IsVendor, IsStoreOwner, IsProductOwner
-from .twitter_utils import tweet_new_store, tweet_new_product
+from .search_utils import FullTextSearchFilter
+from .cache_utils import (
+    CATALOG_SCOPE, cached_read, compute_etag, get_versions, product_scope, store_scope
+)
+from .catalog_utils import (
+    CATALOG_COLUMNS, CATALOG_FORMATS, CatalogFormatError, check_encoding, guess_catalog_format,
+    import_catalog, open_text
+)
+from .metrics_utils import timed_serializer
+from .db_routers import ReplicaReadMixin
+from .async_utils import is_asgi
+from .token_utils import issue_token, revoke_token
+from .export_utils import (
+    EXPORT_FORMATS, ORDER_COLUMNS, ORDER_ITEM_COLUMNS, PRODUCT_COLUMNS, REVIEW_COLUMNS,
+    streaming_export_response
+)
+
+
+class SerializerMetricsMixin:
+    """Record the time spent serializing responses in the request metrics."""
+    def get_serializer(self, *args, **kwargs):
+        return timed_serializer(super().get_serializer(*args, **kwargs))
+
+
+class CachedObjectMixin:
+    """
+    Load the detail object once per request.
+    
+    Ownership checks in the views and the parent update/destroy methods all
+    call get_object(); the first call runs the query and permission checks,
+    later calls reuse the result.
+    """
+    def get_object(self):
+        if not hasattr(self, '_cached_object'):
+            self._cached_object = super().get_object()
+        return self._cached_object
+
+
+class CatalogCacheMixin:
+    """
+    Serve list and retrieve from the versioned catalog cache.
+    
+    Responses carry an ETag derived from the cache versions; a matching
+    If-None-Match gets a 304 without touching the database. Lists depend on
+    the whole catalog (or one store with ?store=), details on one product.
+    """
+    def _cached_response(self, request, name, scopes, build):
+        versions = get_versions(scopes, request)
+        etag = compute_etag(name, versions)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(cached_read(name, scopes, build, request=request))
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+    
+    def list(self, request, *args, **kwargs):
+        store_id = request.query_params.get('store', '')
+        scopes = [store_scope(store_id)] if store_id.isdigit() else [CATALOG_SCOPE]
+        # Paginated payloads contain absolute next/previous links
+        name = f'{self.basename}-list:{request.build_absolute_uri()}'
+        return self._cached_response(
+            request, name, scopes,
+            lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs).data
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self._cached_response(
+            request, f'{self.basename}-detail:{pk}', [product_scope(pk)],
+            lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs).data
+        )
 
 
-class StoreViewSet(viewsets.ModelViewSet):
+class StoreViewSet(SerializerMetricsMixin, ReplicaReadMixin, CachedObjectMixin, viewsets.ModelViewSet):
     """
     API endpoint for stores.
     
@@ -22,19 +104,20 @@ class StoreViewSet(viewsets.ModelViewSet):
     update: Update a store (owner only)
     destroy: Delete a store (owner only)
     """
-    queryset = Store.objects.all()
+    queryset = StoreSerializer.setup_eager_loading(Store.objects.all())
     serializer_class = StoreSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsVendor, IsStoreOwner]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'description']
+    search_fields = ['name']
     ordering_fields = ['created_at', 'name']
+    replica_actions = ('list', 'retrieve', 'products')
     
     def get_queryset(self):
         """
         Optionally restricts the returned stores to a given vendor,
         by filtering against a `vendor` query parameter in the URL.
         """
-        queryset = Store.objects.all()
+        queryset = StoreSerializer.setup_eager_loading(Store.objects.all())
         vendor_id = self.request.query_params.get('vendor', None)
         if vendor_id is not None:
             queryset = queryset.filter(owner__id=vendor_id)
@@ -44,19 +127,21 @@ class StoreViewSet(viewsets.ModelViewSet):
     def products(self, request, pk=None):
         """Get all products for a specific store"""
         store = self.get_object()
-        products = Product.objects.filter(store=store)
-        serializer = ProductSerializer(products, many=True, context={'request': request})
-        return Response(serializer.data)
+        products = ProductSerializer.setup_eager_loading(Product.objects.filter(store=store))
+        page = self.paginate_queryset(products)
+        serializer = timed_serializer(ProductSerializer(page, many=True, context={'request': request}))
+        return self.get_paginated_response(serializer.data)
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsVendor])
     def my_stores(self, request):
         """Get all stores owned by the authenticated vendor"""
-        stores = Store.objects.filter(owner=request.user)
-        serializer = self.get_serializer(stores, many=True)
-        return Response(serializer.data)
+        stores = StoreSerializer.setup_eager_loading(Store.objects.filter(owner=request.user))
+        page = self.paginate_queryset(stores)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(SerializerMetricsMixin, ReplicaReadMixin, CatalogCacheMixin, CachedObjectMixin, viewsets.ModelViewSet):
     """
     API endpoint for products.
     
@@ -66,26 +151,33 @@ class ProductViewSet(viewsets.ModelViewSet):
     update: Update a product (owner only)
     destroy: Delete a product (owner only)
     """
-    queryset = Product.objects.all()
+    queryset = ProductSerializer.setup_eager_loading(Product.objects.all())
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsVendor, IsProductOwner]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'description', 'store__name']
-    ordering_fields = ['created_at', 'price', 'name']
+    filter_backends = [FullTextSearchFilter, filters.OrderingFilter]
+    search_document = 'product'
+    ordering_fields = ['created_at', 'price', 'name', 'average_rating', 'review_count']
+    replica_actions = ('list', 'retrieve', 'export')
     
     def get_queryset(self):
         """
-        Optionally restricts the returned products by store or vendor.
-        Query parameters: ?store=<store_id> or ?vendor=<vendor_id>
+        Optionally restricts the returned products by store, vendor or rating.
+        Query parameters: ?store=<store_id>, ?vendor=<vendor_id> or ?min_rating=<rating>
         """
-        queryset = Product.objects.all()
+        queryset = ProductSerializer.setup_eager_loading(Product.objects.all())
         store_id = self.request.query_params.get('store', None)
         vendor_id = self.request.query_params.get('vendor', None)
+        min_rating = self.request.query_params.get('min_rating', None)
         
         if store_id is not None:
             queryset = queryset.filter(store__id=store_id)
         if vendor_id is not None:
             queryset = queryset.filter(store__owner__id=vendor_id)
+        if min_rating is not None:
+            try:
+                queryset = queryset.filter(average_rating__gte=Decimal(min_rating))
+            except InvalidOperation:
+                pass
         
         return queryset
     
@@ -93,19 +185,63 @@ class ProductViewSet(viewsets.ModelViewSet):
     def reviews(self, request, pk=None):
         """Get all reviews for a specific product"""
         product = self.get_object()
-        reviews = Review.objects.filter(product=product)
-        serializer = ReviewSerializer(reviews, many=True, context={'request': request})
-        return Response(serializer.data)
+        reviews = ReviewSerializer.setup_eager_loading(Review.objects.filter(product=product))
+        page = self.paginate_queryset(reviews)
+        serializer = timed_serializer(ReviewSerializer(page, many=True, context={'request': request}))
+        return self.get_paginated_response(serializer.data)
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsVendor])
     def my_products(self, request):
         """Get all products from stores owned by the authenticated vendor"""
+        products = ProductSerializer.setup_eager_loading(Product.objects.filter(store__owner=request.user))
+        page = self.paginate_queryset(products)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser],
+            permission_classes=[IsAuthenticated, IsVendor])
+    def bulk_import(self, request):
+        """
+        Create or update products in bulk from an uploaded CSV or NDJSON catalog.
+        Form fields: file=<catalog>, optional file_type=csv|ndjson, chunk_size=<rows>
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload the catalog as the "file" field.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('file_type') or guess_catalog_format(upload.name)
+        if fmt not in CATALOG_FORMATS:
+            return Response({'error': f'file_type must be one of {", ".join(CATALOG_FORMATS)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            chunk_size = max(1, min(int(request.data.get('chunk_size', 1000)), 5000))
+        except ValueError:
+            chunk_size = 1000
+        
+        # Reject undecodable files up front; rows are decoded as chunks are committed
+        try:
+            check_encoding(upload)
+        except CatalogFormatError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        result = import_catalog(open_text(upload), fmt, request.user, chunk_size=chunk_size)
+        return Response(result)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsVendor])
+    def export(self, request):
+        """
+        Stream the authenticated vendor's catalog in the import format.
+        Query parameter: ?file_type=csv|ndjson (default csv)
+        """
+        fmt = request.query_params.get('file_type', 'csv')
+        if fmt not in CATALOG_FORMATS:
+            return Response({'error': f'file_type must be one of {", ".join(CATALOG_FORMATS)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
         products = Product.objects.filter(store__owner=request.user)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return streaming_export_response(products, CATALOG_COLUMNS, fmt, 'catalog',
+                                         asynchronous=is_asgi(request))
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(SerializerMetricsMixin, ReplicaReadMixin, CachedObjectMixin, viewsets.ModelViewSet):
     """
     API endpoint for reviews.
     
@@ -115,11 +251,11 @@ class ReviewViewSet(viewsets.ModelViewSet):
     update: Update own review
     destroy: Delete own review
     """
-    queryset = Review.objects.all()
+    queryset = ReviewSerializer.setup_eager_loading(Review.objects.all())
     serializer_class = ReviewSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['comment', 'product__name']
+    filter_backends = [FullTextSearchFilter, filters.OrderingFilter]
+    search_document = 'review'
     ordering_fields = ['created_at', 'rating']
     
     def get_queryset(self):
@@ -127,7 +263,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
         Optionally restricts the returned reviews by product.
         Query parameter: ?product=<product_id>
         """
-        queryset = Review.objects.all()
+        queryset = ReviewSerializer.setup_eager_loading(Review.objects.all())
         product_id = self.request.query_params.get('product', None)
         
         if product_id is not None:
@@ -142,7 +278,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         """Only allow users to update their own reviews"""
         review = self.get_object()
-        if review.user != request.user:
+        if review.user_id != request.user.pk:
             return Response(
                 {"detail": "You can only update your own reviews."},
                 status=status.HTTP_403_FORBIDDEN
@@ -152,7 +288,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         """Only allow users to delete their own reviews"""
         review = self.get_object()
-        if review.user != request.user:
+        if review.user_id != request.user.pk:
             return Response(
                 {"detail": "You can only delete your own reviews."},
                 status=status.HTTP_403_FORBIDDEN
@@ -160,7 +296,130 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class VendorStoreListView(viewsets.ReadOnlyModelViewSet):
+class ExportViewSet(ReplicaReadMixin, viewsets.ViewSet):
+    """
+    Streaming CSV/NDJSON exports for bulk and scheduled pulls.
+    
+    orders, order_items: Own orders (staff get every order)
+    products, reviews: Any signed-in user
+    
+    Each export reads a whole table, so they are throttled per user with
+    the 'exports' rate in DEFAULT_THROTTLE_RATES.
+    
+    Query parameters: ?file_type=csv|ndjson (default csv),
+    ?since=<ISO datetime> to export only rows created after that time
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'exports'
+    replica_actions = ('orders', 'order_items', 'products', 'reviews')
+    
+    def _export(self, request, queryset, columns, filename, created_field='created_at'):
+        """Apply the shared query parameters and stream the queryset"""
+        fmt = request.query_params.get('file_type', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return Response({'error': f'file_type must be one of {", ".join(EXPORT_FORMATS)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        since = request.query_params.get('since')
+        if since:
+            since_value = parse_datetime(since)
+            if since_value is None:
+                return Response({'error': 'since must be an ISO 8601 datetime.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since_value):
+                since_value = timezone.make_aware(since_value)
+            queryset = queryset.filter(**{f'{created_field}__gte': since_value})
+        return streaming_export_response(queryset, columns, fmt, filename, asynchronous=is_asgi(request))
+    
+    @action(detail=False, methods=['get'])
+    def orders(self, request):
+        """Stream orders"""
+        orders = Order.objects.all()
+        if not request.user.is_staff:
+            orders = orders.filter(user=request.user)
+        return self._export(request, orders, ORDER_COLUMNS, 'orders')
+    
+    @action(detail=False, methods=['get'])
+    def order_items(self, request):
+        """Stream order lines"""
+        items = OrderItem.objects.all()
+        if not request.user.is_staff:
+            items = items.filter(order__user=request.user)
+        return self._export(request, items, ORDER_ITEM_COLUMNS, 'order_items', 'order__created_at')
+    
+    @action(detail=False, methods=['get'])
+    def products(self, request):
+        """Stream products, optionally for one ?store=<id> or ?vendor=<id>"""
+        products = Product.objects.all()
+        store_id = request.query_params.get('store', None)
+        vendor_id = request.query_params.get('vendor', None)
+        if store_id is not None:
+            products = products.filter(store__id=store_id)
+        if vendor_id is not None:
+            products = products.filter(store__owner__id=vendor_id)
+        return self._export(request, products, PRODUCT_COLUMNS, 'products')
+    
+    @action(detail=False, methods=['get'])
+    def reviews(self, request):
+        """Stream reviews, optionally for one ?product=<id>"""
+        reviews = Review.objects.all()
+        product_id = request.query_params.get('product', None)
+        if product_id is not None:
+            reviews = reviews.filter(product__id=product_id)
+        return self._export(request, reviews, REVIEW_COLUMNS, 'reviews')
+
+
+class ApiTokenViewSet(viewsets.GenericViewSet):
+    """
+    API endpoint for bearer tokens.
+    
+    list: Your tokens (key prefix, name, expiry, revocation)
+    create: Issue a token from username/password (or the current session)
+    destroy: Revoke one of your tokens
+    """
+    serializer_class = ApiTokenSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return ApiToken.objects.filter(user=self.request.user).order_by('-created_at')
+    
+    def get_permissions(self):
+        if self.action == 'create':
+            return [AllowAny()]
+        return super().get_permissions()
+    
+    def list(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    def create(self, request):
+        """Exchange credentials for a token; the key is only shown in this response"""
+        params = ApiTokenRequestSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        
+        user = request.user if request.user.is_authenticated else None
+        if data.get('username') or data.get('password'):
+            user = authenticate(request, username=data.get('username'), password=data.get('password'))
+            if user is None:
+                return Response({'error': 'Invalid credentials.'}, status=status.HTTP_401_UNAUTHORIZED)
+        if user is None:
+            return Response({'error': 'Provide username and password.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        max_days = getattr(settings, 'API_TOKEN_LIFETIME_DAYS', 30)
+        lifetime = timedelta(days=min(data.get('days', max_days), max_days))
+        raw_key, token = issue_token(user, name=data['name'], lifetime=lifetime)
+        response_data = dict(ApiTokenSerializer(token).data, key=raw_key)
+        return Response(response_data, status=status.HTTP_201_CREATED)
+    
+    def destroy(self, request, pk=None):
+        token = get_object_or_404(self.get_queryset(), pk=pk)
+        revoke_token(token)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class VendorStoreListView(SerializerMetricsMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint to list stores by vendor.
     GET /api/vendors/<vendor_id>/stores/
@@ -169,4 +428,4 @@ class VendorStoreListView(viewsets.ReadOnlyModelViewSet):
     
     def get_queryset(self):
         vendor_id = self.kwargs.get('vendor_id')
-        return Store.objects.filter(owner__id=vendor_id)
+        return StoreSerializer.setup_eager_loading(Store.objects.filter(owner__id=vendor_id))
@@ -0,0 +1,140 @@
+"""
+Async Utilities
+Helpers for the async views served through eComm.asgi and for awaiting
+blocking network calls concurrently.
+
+Django 4.2 has no async request.user, login_required or condition for
+coroutine views, so their async forms live here, with a render() that
+keeps template database access off the event loop. Blocking calls that do
+no database work (Twitter, HTTP) run on worker threads with
+thread_sensitive=False so they overlap; ORM calls must stay on the
+thread-sensitive executor, where Django keeps their connections.
+"""
+import asyncio
+from functools import wraps
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib import auth
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import render
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+
+def is_asgi(request):
+    """True when a (Django or DRF) request is being served through eComm.asgi."""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def aget_user(request):
+    """
+    Load request.user without blocking the event loop.
+
+    The lazy user from AuthenticationMiddleware reads the session and the
+    auth tables on first access, which is not allowed in async code. The
+    loaded user replaces it, so templates can use it afterwards.
+    """
+    user = getattr(request, '_async_user', None)
+    if user is None:
+        user = await sync_to_async(auth.get_user)(request)
+        request._async_user = request.user = user
+    return user
+
+
+async def arender(request, template_name, context=None):
+    """
+    render() for async views.
+
+    Context processors (user roles, messages) and lazy template variables
+    may query the database, so the template is rendered on the
+    thread-sensitive executor.
+    """
+    return await sync_to_async(render)(request, template_name, context)
+
+
+def async_login_required(view_func):
+    """login_required for async views."""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def async_etag(etag_func):
+    """
+    condition(etag_func=...) for async views.
+
+    Args:
+        etag_func: Coroutine function taking the view's arguments and
+            returning the response's ETag
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            etag = None
+            if request.method in ('GET', 'HEAD'):
+                etag = quote_etag(await etag_func(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+            if etag:
+                response.headers.setdefault('ETag', etag)
+            return response
+        return wrapper
+    return decorator
+
+
+async def gather_blocking(calls, limit=None):
+    """
+    Run blocking callables concurrently on worker threads.
+
+    Args:
+        calls: Zero-argument callables doing network I/O (no ORM access)
+        limit: Maximum number running at once (default: all)
+
+    Returns:
+        list: Each call's result, or the exception it raised, in order
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run(call):
+        if semaphore is None:
+            return await sync_to_async(call, thread_sensitive=False)()
+        async with semaphore:
+            return await sync_to_async(call, thread_sensitive=False)()
+
+    return await asyncio.gather(*(run(call) for call in calls), return_exceptions=True)
+
+
+def run_blocking_concurrently(calls, limit=None):
+    """gather_blocking for synchronous callers (workers, management commands)."""
+    return async_to_sync(gather_blocking)(calls, limit)
+
+
+async def aiter_sync(iterator, chunk_size=200):
+    """
+    Async iterator over a synchronous one, pulling chunk_size items per thread hop.
+
+    StreamingHttpResponse reads a synchronous iterator into memory in full
+    before sending it under ASGI; wrapping it keeps the response streaming.
+    The iterator runs on the thread-sensitive executor, so it may query.
+    """
+    iterator = iter(iterator)
+
+    def take():
+        chunk = []
+        for item in iterator:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                break
+        return chunk
+
+    while True:
+        chunk = await sync_to_async(take)()
+        if not chunk:
+            return
+        for item in chunk:
+            yield item
@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from rest_framework import authentication, exceptions
+from .token_utils import lookup_token
+
+
+class CachedTokenAuthentication(authentication.BaseAuthentication):
+    """
+    Bearer token authentication for API clients.
+
+    Clients send `Authorization: Bearer <key>`. The key is hashed and looked
+    up through token_utils' cache, so a request costs one SHA-256 and one
+    user lookup by primary key instead of a password hash.
+    """
+    keywords = (b'bearer', b'token')
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if not header or header[0].lower() not in self.keywords:
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+        try:
+            raw_key = header[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+
+        entry = lookup_token(raw_key)
+        if entry is None:
+            raise exceptions.AuthenticationFailed("Invalid, expired or revoked token.")
+
+        user = get_user_model().objects.filter(pk=entry['user_id'], is_active=True).first()
+        if user is None:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return user, entry
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -0,0 +1,384 @@
+"""
+Cache Utilities
+Versioned read-through cache for catalog pages and API responses.
+
+Every cached value is stored under a key built from the version numbers of
+the scopes it depends on (a product, a store, the whole catalog). Writes
+never delete entries; the model signals bump the versions of the affected
+scopes after commit, and stale entries are simply never read again.
+
+Lookups go through two tiers: a small LRU dict in each process, then the
+shared Django cache (CATALOG_CACHE_ALIAS). Versions are always read from
+the shared cache, so the in-process tier cannot serve data another process
+has invalidated.
+
+The a-prefixed functions are the same reads for async views; they use the
+cache's async API and await an async builder.
+"""
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from .models import Product
+
+CATALOG_SCOPE = 'catalog'
+# Bumped by bulk writes that bypass the signals; part of every key
+EPOCH_SCOPE = 'epoch'
+
+_MISSING = object()
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def store_scope(store_id):
+    return f'store:{store_id}'
+
+
+def _version_key(scope):
+    return f'catalog:version:{scope}'
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def is_shared_cache(cache):
+    """False if a cache only lives in this process (LocMemCache) or stores nothing."""
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def catalog_cache_is_shared():
+    """False if CATALOG_CACHE_ALIAS is not shared between processes (see is_shared_cache)."""
+    return is_shared_cache(_shared_cache())
+
+
+class LocalLRUCache:
+    """Thread-safe, size-bounded in-process cache with least-recently-used eviction."""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+local_cache = LocalLRUCache(getattr(settings, 'CATALOG_CACHE_LOCAL_ENTRIES', 512))
+
+
+def get_versions(scopes, request=None):
+    """
+    Return the current version of each scope, in order.
+
+    Args:
+        scopes: Scope names such as product_scope(3) or CATALOG_SCOPE
+        request: Optional request to memoize on, so the ETag check and the
+            cached read of one request share a single cache round trip
+
+    Returns:
+        tuple: Version numbers
+    """
+    scopes = (EPOCH_SCOPE,) + tuple(scopes)
+    versions = _memoized_versions(request, scopes)
+    if versions is None:
+        found = read_versions(_shared_cache(), [_version_key(scope) for scope in scopes])
+        versions = _remember_versions(request, scopes, found)
+    return versions
+
+
+async def aget_versions(scopes, request=None):
+    """Async form of get_versions."""
+    scopes = (EPOCH_SCOPE,) + tuple(scopes)
+    versions = _memoized_versions(request, scopes)
+    if versions is None:
+        found = await aread_versions(_shared_cache(), [_version_key(scope) for scope in scopes])
+        versions = _remember_versions(request, scopes, found)
+    return versions
+
+
+def new_version():
+    """
+    Starting value for a version counter that is missing or was evicted.
+
+    Random rather than 0 or 1: entries cached under the counter's earlier
+    values may still be in the shared cache or the in-process tier, so a
+    restarted counter must not reach any of those values again.
+    """
+    return secrets.randbits(62)
+
+
+def read_versions(shared, version_keys):
+    """get_many of version counters, starting missing ones at new_version()."""
+    found = shared.get_many(version_keys)
+    missing = [key for key in version_keys if key not in found]
+    if missing:
+        for key in missing:
+            shared.add(key, new_version(), None)
+        # Another process may have started the counter first
+        found.update(shared.get_many(missing))
+    return found
+
+
+async def aread_versions(shared, version_keys):
+    """Async form of read_versions."""
+    found = await shared.aget_many(version_keys)
+    missing = [key for key in version_keys if key not in found]
+    if missing:
+        for key in missing:
+            await shared.aadd(key, new_version(), None)
+        found.update(await shared.aget_many(missing))
+    return found
+
+
+def _memoized_versions(request, scopes):
+    memo = getattr(request, '_catalog_versions', None) if request is not None else None
+    return memo.get(scopes) if memo is not None else None
+
+
+def _remember_versions(request, scopes, found):
+    versions = tuple(found.get(_version_key(scope), 0) for scope in scopes)
+    if request is not None:
+        if not hasattr(request, '_catalog_versions'):
+            request._catalog_versions = {}
+        request._catalog_versions[scopes] = versions
+    return versions
+
+
+def incr_version(cache, key):
+    """Increment a version counter; a missing or evicted one restarts at new_version()."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = new_version()
+        cache.set(key, version, None)
+        return version
+
+
+def bump_version(scope):
+    """Bump one scope's version right away and return the new version."""
+    return incr_version(_shared_cache(), _version_key(scope))
+
+
+def _bump(scopes):
+    for scope in scopes:
+        bump_version(scope)
+
+
+def bump_versions(scopes):
+    """Invalidate every cached value that depends on the given scopes, once the transaction commits."""
+    scopes = set(scopes)
+    if scopes:
+        transaction.on_commit(lambda: _bump(scopes))
+
+
+def _key(name, versions):
+    # Names may carry raw query strings, so hash them into a backend-safe key
+    digest = hashlib.md5(name.encode()).hexdigest()
+    return f"catalog:{digest}:{'.'.join(str(version) for version in versions)}"
+
+
+def compute_etag(name, versions, *extra):
+    """Quoted ETag for a cached value and any per-client inputs (e.g. the user)."""
+    raw = '|'.join([_key(name, versions)] + [str(part) for part in extra])
+    return '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+
+
+def cached_read(name, scopes, builder, request=None, timeout=None):
+    """
+    Return a cached value, building and storing it on a miss.
+
+    Args:
+        name: Identifies the value within its scopes (e.g. 'product-detail:3')
+        scopes: Scopes whose versions the value depends on
+        builder: Zero-argument callable producing the value from the database
+        request: Optional request used to memoize the version lookup
+        timeout: Shared-cache timeout in seconds (default CATALOG_CACHE_TIMEOUT)
+    """
+    key = _key(name, get_versions(scopes, request))
+
+    value = local_cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    shared = _shared_cache()
+    value = shared.get(key, _MISSING)
+    if value is _MISSING:
+        value = builder()
+        shared.set(key, value, _timeout() if timeout is None else timeout)
+    local_cache.set(key, value)
+    return value
+
+
+async def acached_read(name, scopes, builder, request=None, timeout=None):
+    """Async form of cached_read; builder is a zero-argument coroutine function."""
+    key = _key(name, await aget_versions(scopes, request))
+
+    value = local_cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    shared = _shared_cache()
+    value = await shared.aget(key, _MISSING)
+    if value is _MISSING:
+        value = await builder()
+        await shared.aset(key, value, _timeout() if timeout is None else timeout)
+    local_cache.set(key, value)
+    return value
+
+
+def _item_keys(items, found_versions):
+    """Cache key of each (name, scopes) item, given the version lookup result."""
+    return [
+        _key(name, tuple(found_versions.get(_version_key(scope), 0) for scope in (EPOCH_SCOPE,) + tuple(scopes)))
+        for name, scopes in items
+    ]
+
+
+def _item_version_keys(items):
+    return list({_version_key(scope) for name, scopes in items for scope in (EPOCH_SCOPE,) + tuple(scopes)})
+
+
+def _local_values(keys):
+    values = [local_cache.get(key, _MISSING) for key in keys]
+    return values, [index for index, value in enumerate(values) if value is _MISSING]
+
+
+def _store_found(keys, values, missing, stored):
+    """Fill values from a shared-cache get_many; returns the indexes still missing."""
+    for index in missing:
+        if keys[index] in stored:
+            values[index] = stored[keys[index]]
+            local_cache.set(keys[index], values[index])
+    return [index for index in missing if values[index] is _MISSING]
+
+
+def _store_built(keys, values, unbuilt, built):
+    for index in unbuilt:
+        values[index] = built[index]
+        local_cache.set(keys[index], built[index])
+    return {keys[index]: built[index] for index in unbuilt}
+
+
+def cached_read_many(items, builder, timeout=None):
+    """
+    Batch form of cached_read: one version lookup and one shared-cache
+    get_many for all items, and a single builder call for every miss.
+
+    Args:
+        items: List of (name, scopes) pairs
+        builder: Callable taking the list of missing indexes into items and
+            returning {index: value} for them
+        timeout: Shared-cache timeout in seconds (default CATALOG_CACHE_TIMEOUT)
+
+    Returns:
+        list: Values in the same order as items
+    """
+    shared = _shared_cache()
+    keys = _item_keys(items, read_versions(shared, _item_version_keys(items)))
+    values, missing = _local_values(keys)
+    if missing:
+        unbuilt = _store_found(keys, values, missing, shared.get_many([keys[index] for index in missing]))
+        if unbuilt:
+            shared.set_many(_store_built(keys, values, unbuilt, builder(unbuilt)),
+                            _timeout() if timeout is None else timeout)
+    return values
+
+
+async def acached_read_many(items, builder, timeout=None):
+    """Async form of cached_read_many; builder stays synchronous (e.g. template rendering)."""
+    shared = _shared_cache()
+    keys = _item_keys(items, await aread_versions(shared, _item_version_keys(items)))
+    values, missing = _local_values(keys)
+    if missing:
+        stored = await shared.aget_many([keys[index] for index in missing])
+        unbuilt = _store_found(keys, values, missing, stored)
+        if unbuilt:
+            await shared.aset_many(_store_built(keys, values, unbuilt, builder(unbuilt)),
+                                   _timeout() if timeout is None else timeout)
+    return values
+
+
+def page_etag(request, name, scopes):
+    """
+    ETag for an HTML page built from cached catalog data.
+
+    Pages also render the user and a CSRF token, so the user id and the
+    CSRF secret are part of the tag.
+    """
+    versions = get_versions(scopes, request)
+    user_id = request.user.pk if request.user.is_authenticated else None
+    return compute_etag(name, versions, user_id, request.META.get('CSRF_COOKIE', ''))
+
+
+async def apage_etag(request, name, scopes):
+    """Async form of page_etag; request.user must already be loaded (async_utils.aget_user)."""
+    versions = await aget_versions(scopes, request)
+    user_id = request.user.pk if request.user.is_authenticated else None
+    return compute_etag(name, versions, user_id, request.META.get('CSRF_COOKIE', ''))
+
+
+def invalidate_products(product_ids, store_ids=None):
+    """
+    Invalidate cached data for products whose rows changed.
+
+    Bumps each product, the stores they belong to and the catalog listing.
+    Store ids are looked up when not given.
+    """
+    product_ids = set(product_ids)
+    if not product_ids and not store_ids:
+        return
+    if store_ids is None:
+        store_ids = Product.objects.filter(id__in=product_ids).values_list('store_id', flat=True)
+    scopes = {product_scope(product_id) for product_id in product_ids}
+    scopes.update(store_scope(store_id) for store_id in store_ids if store_id is not None)
+    scopes.add(CATALOG_SCOPE)
+    bump_versions(scopes)
+
+
+def invalidate_catalog():
+    """Invalidate every cached catalog value (after bulk writes that skip signals)."""
+    bump_versions([EPOCH_SCOPE])
@@ -0,0 +1,258 @@
+"""
+Cart Utilities
+Server-side carts (Cart/CartItem) and pricing of their lines.
+
+Authenticated users own at most one cart; anonymous visitors get a cart
+whose id is the only thing kept in their session. Quantity changes are
+single-row increments, so editing a cart never rewrites the session.
+Anonymous carts are merged into the user's cart on login.
+"""
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import Cart, CartItem, Product
+
+SESSION_CART_ID = 'cart_id'
+# Carts used to be stored whole in the session under this key
+LEGACY_SESSION_CART = 'cart'
+
+
+def parse_cart(cart):
+    """
+    Normalise a session cart into {product_id: quantity}.
+
+    Keys that are not product ids are skipped, as are non-positive quantities.
+    """
+    quantities = {}
+    for product_id, quantity in cart.items():
+        try:
+            product_id = int(product_id)
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            continue
+        if quantity > 0:
+            quantities[product_id] = quantity
+    return quantities
+
+
+def _resolve_named_lines(cart):
+    """
+    Resolve legacy cart lines keyed by product name (from add_item_to_cart).
+
+    Returns a list of (product, quantity) using a single query for all names.
+    """
+    named = {}
+    for key, quantity in cart.items():
+        if not str(key).isdigit():
+            try:
+                named[key] = int(quantity)
+            except (TypeError, ValueError):
+                continue
+    if not named:
+        return []
+
+    by_name = {}
+    for product in Product.objects.filter(name__in=named).order_by('id'):
+        by_name.setdefault(product.name, product)
+    return [(by_name[name], quantity) for name, quantity in named.items()
+            if name in by_name and quantity > 0]
+
+
+def _forget_hydrated(request):
+    if hasattr(request, '_hydrated_cart'):
+        del request._hydrated_cart
+
+
+def _lookup_cart(request, create):
+    user = request.user
+    if user.is_authenticated:
+        cart = Cart.objects.filter(user=user).first()
+        if cart is None and create:
+            cart, created = Cart.objects.get_or_create(user=user)
+        return cart
+
+    cart = None
+    cart_id = request.session.get(SESSION_CART_ID)
+    if cart_id is not None:
+        cart = Cart.objects.filter(id=cart_id, user__isnull=True).first()
+    if cart is None and create:
+        cart = Cart.objects.create()
+        request.session[SESSION_CART_ID] = cart.id
+    return cart
+
+
+def get_cart(request, create=False):
+    """
+    Return the current visitor's cart.
+
+    Args:
+        request: Current HttpRequest with a session
+        create: Create the cart if the visitor does not have one yet
+
+    Returns:
+        Cart or None: None when there is no cart and create is False
+    """
+    cart = getattr(request, '_cart', None)
+    if cart is not None:
+        return cart
+
+    legacy = request.session.pop(LEGACY_SESSION_CART, None)
+    # Move a cart written by an older release out of the session, once
+    cart = _lookup_cart(request, create=create or bool(legacy))
+    if legacy:
+        _import_legacy_cart(cart, legacy)
+
+    if cart is not None:
+        request._cart = cart
+    return cart
+
+
+def _import_legacy_cart(cart, legacy):
+    lines = dict(parse_cart(legacy))
+    for product, quantity in _resolve_named_lines(legacy):
+        lines[product.id] = lines.get(product.id, 0) + quantity
+    existing = set(Product.objects.filter(id__in=lines).values_list('id', flat=True))
+    for product_id, quantity in lines.items():
+        if product_id in existing:
+            add_item(cart, product_id, quantity)
+
+
+def add_item(cart, product_id, quantity):
+    """
+    Add quantity units of a product to a cart as an atomic increment.
+
+    The common case (the product is already in the cart) is one UPDATE;
+    otherwise the line is inserted, falling back to the increment if a
+    concurrent request inserted it first.
+    """
+    lines = CartItem.objects.filter(cart=cart, product_id=product_id)
+    if lines.update(quantity=F('quantity') + quantity):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart=cart, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        lines.update(quantity=F('quantity') + quantity)
+
+
+def add_to_cart(request, product_id, quantity):
+    """Add a product to the visitor's cart, creating the cart if needed."""
+    add_item(get_cart(request, create=True), product_id, quantity)
+    _forget_hydrated(request)
+
+
+def remove_from_cart(request, product_id):
+    """Remove a product's line from the visitor's cart."""
+    cart = get_cart(request)
+    if cart is not None:
+        CartItem.objects.filter(cart=cart, product_id=product_id).delete()
+    _forget_hydrated(request)
+
+
+def cart_quantities(cart):
+    """Return {product_id: quantity} for a cart, in one query."""
+    if cart is None:
+        return {}
+    return dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+
+
+def clear_cart(cart):
+    CartItem.objects.filter(cart=cart).delete()
+
+
+def merge_carts(source, target):
+    """Move every line of source into target, adding quantities, then delete source."""
+    with transaction.atomic():
+        for product_id, quantity in cart_quantities(source).items():
+            add_item(target, product_id, quantity)
+        source.delete()
+
+
+def merge_cart_on_login(request, user):
+    """
+    Attach the anonymous session cart to a user who just logged in.
+
+    The anonymous cart becomes the user's cart, or is merged into the cart
+    they already have. The session id survives login because Django keeps
+    session data when it cycles the session key.
+    """
+    cart_id = request.session.pop(SESSION_CART_ID, None)
+    if hasattr(request, '_cart'):
+        del request._cart
+    _forget_hydrated(request)
+    if cart_id is None:
+        return
+    anonymous = Cart.objects.filter(id=cart_id, user__isnull=True).first()
+    if anonymous is None:
+        return
+
+    existing = Cart.objects.filter(user=user).first()
+    if existing is None:
+        anonymous.user = user
+        anonymous.save(update_fields=['user', 'updated_at'])
+    else:
+        merge_carts(anonymous, existing)
+
+
+def hydrate_cart(request):
+    """
+    Load every product in the visitor's cart and price each line.
+
+    Lines and their products are fetched with one joined query, subtotals
+    and the total are computed in the same pass, and the result is memoized
+    on the request so repeated calls while rendering one page do not query
+    again.
+
+    Args:
+        request: Current HttpRequest with a session
+
+    Returns:
+        tuple: (cart_items, total) where cart_items is a list of dicts with
+        'product', 'quantity' and 'subtotal' keys
+    """
+    cached = getattr(request, '_hydrated_cart', None)
+    if cached is not None:
+        return cached
+
+    cart = get_cart(request)
+    lines = []
+    if cart is not None:
+        lines = _cart_lines(cart)
+    result = _price_lines(lines)
+    request._hydrated_cart = result
+    return result
+
+
+async def ahydrate_cart(request):
+    """Async form of hydrate_cart, loading the lines with the async ORM."""
+    cached = getattr(request, '_hydrated_cart', None)
+    if cached is not None:
+        return cached
+
+    # Finding the cart reads the session (and may import a legacy cart)
+    cart = await sync_to_async(get_cart)(request)
+    lines = []
+    if cart is not None:
+        lines = [line async for line in _cart_lines(cart)]
+    result = _price_lines(lines)
+    request._hydrated_cart = result
+    return result
+
+
+def _cart_lines(cart):
+    return CartItem.objects.filter(cart=cart).select_related('product').order_by('added_at', 'id')
+
+
+def _price_lines(lines):
+    cart_items = []
+    total = Decimal('0.00')
+    for line in lines:
+        subtotal = line.product.price * line.quantity
+        total += subtotal
+        cart_items.append({
+            'product': line.product,
+            'quantity': line.quantity,
+            'subtotal': subtotal
+        })
+    return cart_items, total
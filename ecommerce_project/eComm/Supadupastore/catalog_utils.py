@@ -0,0 +1,291 @@
+"""
+Catalog Utilities
+Bulk import and streaming export of vendor product catalogs as CSV or NDJSON.
+
+Rows are read lazily from a text stream, validated in chunks and written
+with bulk_create/bulk_update, so memory use depends on the chunk size rather
+than the size of the catalog.
+"""
+import codecs
+import csv
+import io
+import json
+import logging
+from itertools import islice
+from django.db import transaction
+from django.utils import timezone
+from .cache_utils import invalidate_products
+from .export_utils import iter_export
+from .models import Product, Review, Store
+from .search_utils import get_search_backend
+from .serializers import ProductImportRowSerializer
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FORMATS = ('csv', 'ndjson')
+CATALOG_COLUMNS = [
+    ('id', 'id'),
+    ('store', 'store_id'),
+    ('name', 'name'),
+    ('description', 'description'),
+    ('price', 'price'),
+    ('stock', 'stock'),
+]
+MAX_REPORTED_ERRORS = 1000
+
+
+class CatalogFormatError(ValueError):
+    """Raised when a catalog file is not valid CSV/NDJSON."""
+
+
+def guess_catalog_format(filename, default='csv'):
+    """Pick csv or ndjson from a file name."""
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_catalog_rows(stream, fmt):
+    """
+    Yield (row_number, row_dict) pairs from a text stream.
+
+    Args:
+        stream: Text file-like object
+        fmt: 'csv' (with a header row) or 'ndjson' (one JSON object per line)
+
+    Raises:
+        CatalogFormatError: For an unknown format, or bytes the stream cannot decode
+    """
+    try:
+        yield from _iter_rows(stream, fmt)
+    except UnicodeDecodeError as e:
+        raise CatalogFormatError(f"The file is not valid {e.encoding} text") from e
+
+
+def _iter_rows(stream, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row_number, row in enumerate(reader, start=1):
+            # Treat empty cells as missing so optional fields fall back to defaults
+            yield row_number, {key: value for key, value in row.items() if key and value != ''}
+    elif fmt == 'ndjson':
+        for row_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, CatalogFormatError(f"Invalid JSON: {e.msg}")
+                continue
+            yield row_number, row if isinstance(row, dict) else CatalogFormatError("Expected a JSON object")
+    else:
+        raise CatalogFormatError(f"Unsupported catalog format '{fmt}'")
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _import_chunk(chunk, store_names, result):
+    """
+    Validate and write one chunk of rows.
+
+    Returns:
+        tuple: (ids of the products written, ids of existing products that were renamed)
+    """
+    valid = []
+    for row_number, row in chunk:
+        if isinstance(row, Exception):
+            _add_error(result, row_number, {'row': [str(row)]})
+            continue
+        serializer = ProductImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            _add_error(result, row_number, serializer.errors)
+            continue
+        data = serializer.validated_data
+        if data['store'] not in store_names:
+            _add_error(result, row_number, {'store': ["You can only add products to your own stores."]})
+            continue
+        valid.append((row_number, data))
+
+    if not valid:
+        return [], set()
+
+    # Resolve updates by id, then by (store, name), with one query each
+    ids = [data['id'] for row_number, data in valid if data.get('id')]
+    by_id = Product.objects.filter(store_id__in=store_names).in_bulk(ids) if ids else {}
+    names = {data['name'] for row_number, data in valid if not data.get('id')}
+    by_name = {}
+    if names:
+        for product in Product.objects.filter(store_id__in=store_names, name__in=names).order_by('id'):
+            by_name.setdefault((product.store_id, product.name), product)
+
+    now = timezone.now()
+    to_create = []
+    to_update = {}
+    renamed = set()
+    merged = 0
+    for row_number, data in valid:
+        if data.get('id'):
+            product = by_id.get(data['id'])
+            if product is None:
+                _add_error(result, row_number, {'id': ["Product not found in your stores."]})
+                continue
+        else:
+            product = by_name.get((data['store'], data['name']))
+
+        if product is None:
+            product = Product(
+                store_id=data['store'],
+                store_name=store_names[data['store']],
+                name=data['name'],
+                description=data.get('description', ''),
+                price=data['price'],
+                stock=data['stock'],
+            )
+            to_create.append(product)
+            # A later row for the same (store, name) in this chunk updates it instead of duplicating it
+            by_name[(data['store'], data['name'])] = product
+        else:
+            if product.pk is not None and product.name != data['name']:
+                renamed.add(product.id)
+            product.store_id = data['store']
+            product.store_name = store_names[data['store']]
+            product.name = data['name']
+            if 'description' in data:
+                product.description = data['description']
+            product.price = data['price']
+            product.stock = data['stock']
+            if product.pk is None:
+                # Created by an earlier row of this chunk; the last row's values win
+                merged += 1
+            else:
+                product.updated_at = now
+                to_update[id(product)] = product
+
+    with transaction.atomic():
+        created = Product.objects.bulk_create(to_create)
+        if to_update:
+            Product.objects.bulk_update(
+                list(to_update.values()),
+                ['store', 'store_name', 'name', 'description', 'price', 'stock', 'updated_at']
+            )
+            # bulk_update skips the signal that copies names to the reviews
+            for product in to_update.values():
+                if product.id in renamed:
+                    Review.objects.filter(product_id=product.id).update(product_name=product.name)
+    result['created'] += len(created)
+    result['updated'] += len(to_update) + merged
+    return [product.id for product in created] + [product.id for product in to_update.values()], renamed
+
+
+def _add_error(result, row_number, errors):
+    result['error_count'] += 1
+    if len(result['errors']) < MAX_REPORTED_ERRORS:
+        result['errors'].append({'row': row_number, 'errors': errors})
+
+
+def import_catalog(stream, fmt, owner, chunk_size=1000):
+    """
+    Create or update products from a CSV/NDJSON catalog.
+
+    Rows with an id update that product; rows without one update the
+    product with the same name in the same store, or create a new one.
+    Each chunk is written in its own transaction, so valid rows are kept
+    even when other rows fail validation.
+
+    Args:
+        stream: Text file-like object with the catalog
+        fmt: 'csv' or 'ndjson'
+        owner: Vendor user; rows may only reference their stores
+        chunk_size: Number of rows validated and written together
+
+    Returns:
+        dict: 'created', 'updated' and 'error_count' totals, and 'errors'
+        (row number and field errors, capped at MAX_REPORTED_ERRORS)
+    """
+    result = {'created': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+    store_names = dict(Store.objects.filter(owner=owner).values_list('id', 'name'))
+
+    written = []
+    renamed = set()
+    for chunk in _chunks(iter_catalog_rows(stream, fmt), chunk_size):
+        chunk_written, chunk_renamed = _import_chunk(chunk, store_names, result)
+        written.extend(chunk_written)
+        renamed |= chunk_renamed
+
+    # bulk_create/bulk_update skip model signals, so refresh the search index and cache here.
+    # Backends that do not return ids from bulk_create (MySQL) get a full rebuild.
+    backend = get_search_backend()
+    if None in written:
+        backend.reset()
+    elif written:
+        backend.update('product', written)
+    if renamed:
+        backend.update('review', Review.objects.filter(product_id__in=renamed).values_list('id', flat=True))
+    if written:
+        invalidate_products([product_id for product_id in written if product_id is not None], store_names)
+
+    logger.info(f"Catalog import for {owner}: {result['created']} created, "
+                f"{result['updated']} updated, {result['error_count']} errors")
+    return result
+
+
+def iter_catalog_export(queryset, fmt, chunk_size=2000):
+    """
+    Yield a product catalog as CSV or NDJSON text, one line at a time.
+
+    The output uses the import columns, so it can be fed straight back
+    into import_catalog.
+    """
+    if fmt not in CATALOG_FORMATS:
+        raise CatalogFormatError(f"Unsupported catalog format '{fmt}'")
+    return iter_export(queryset, CATALOG_COLUMNS, fmt, chunk_size)
+
+
+def check_encoding(binary_file, encoding='utf-8-sig', block_size=64 * 1024):
+    """
+    Check that a binary file decodes cleanly, then rewind it.
+
+    Rows are decoded lazily while chunks are written, so a bad byte found
+    halfway through would otherwise fail the import after earlier chunks
+    were committed. The file is read in blocks, never whole.
+
+    Raises:
+        CatalogFormatError: Naming the first line that does not decode
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    line = 1
+    while True:
+        block = binary_file.read(block_size)
+        try:
+            decoder.decode(block, final=not block)
+        except UnicodeDecodeError as e:
+            # Offsets are relative to the bytes the decoder buffered plus this block
+            line += (decoder.getstate()[0] + block)[:e.start].count(b'\n')
+            # utf-8-sig only differs from UTF-8 in skipping a byte order mark
+            name = encoding.upper().replace('-SIG', '')
+            raise CatalogFormatError(f"Line {line} is not valid {name} text")
+        if not block:
+            break
+        line += block.count(b'\n')
+    binary_file.seek(0)
+
+
+def open_text(binary_file, encoding='utf-8-sig'):
+    """
+    Wrap an uploaded (binary) file as a text stream without reading it into memory.
+
+    utf-8-sig drops a leading byte order mark, which spreadsheet exports
+    often add and which would otherwise end up in the first CSV header.
+    """
+    return io.TextIOWrapper(binary_file, encoding=encoding, newline='')
@@ -0,0 +1,144 @@
+"""
+Checkout Utilities
+Turns a cart into an order inside a single atomic transaction.
+"""
+from collections import Counter
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from .models import Cart, Product, Order, OrderItem, PurchaseRecord, Review
+from .cart_utils import cart_quantities, clear_cart
+from .cache_utils import invalidate_products
+
+
+class InsufficientStock(Exception):
+    """Raised when a cart line asks for more units than are in stock."""
+
+    def __init__(self, product=None):
+        self.product = product
+        if product is not None:
+            super().__init__(f"Insufficient stock for {product.name}")
+        else:
+            super().__init__("Insufficient stock for one or more items")
+
+
+class EmptyCart(Exception):
+    """Raised when checking out a cart with no items."""
+
+
+def place_order(user, cart):
+    """
+    Create an order for a cart, locking the products and decrementing stock.
+
+    All cart products are fetched with one SELECT ... FOR UPDATE, the order
+    items are written with one bulk INSERT and stock is decremented with one
+    conditional UPDATE, so the query count does not grow with the cart size
+    and concurrent checkouts cannot oversell.
+
+    The cart row is locked first and emptied in the same transaction, so
+    a double-submitted checkout cannot place the same cart twice.
+
+    Args:
+        user: User placing the order
+        cart: The user's Cart
+
+    Returns:
+        tuple: (order, invoice_items, total)
+
+    Raises:
+        EmptyCart: if the cart has no items
+        InsufficientStock: if a product has fewer units than requested
+    """
+    with transaction.atomic():
+        # Serialise checkouts of the same cart
+        list(Cart.objects.select_for_update().filter(pk=cart.pk).values_list('pk', flat=True))
+        quantities = cart_quantities(cart)
+        if not quantities:
+            raise EmptyCart()
+
+        # Lock rows in primary key order so concurrent checkouts cannot deadlock
+        products = list(
+            Product.objects.select_for_update()
+            .filter(id__in=quantities)
+            .order_by('id')
+        )
+
+        total = Decimal('0.00')
+        invoice_items = []
+        for product in products:
+            quantity = quantities[product.id]
+            if product.stock < quantity:
+                raise InsufficientStock(product)
+
+            subtotal = product.price * quantity
+            total += subtotal
+            invoice_items.append({
+                'name': product.name,
+                'quantity': quantity,
+                'price': product.price,
+                'subtotal': subtotal
+            })
+
+        order = Order.objects.create(user=user, total_amount=total)
+
+        if products:
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=product,
+                    quantity=quantities[product.id],
+                    price=product.price
+                )
+                for product in products
+            ])
+
+            # Decrement every line in one statement; the stock guard makes the
+            # update a no-op for any row that would go negative
+            guard = Q()
+            for product in products:
+                guard |= Q(id=product.id, stock__gte=quantities[product.id])
+            updated = Product.objects.filter(guard).update(
+                stock=Case(
+                    *[When(id=product.id, then=F('stock') - quantities[product.id])
+                      for product in products],
+                    default=F('stock')
+                )
+            )
+            if updated != len(products):
+                # Only reachable if the row locks were not honoured by the backend
+                raise InsufficientStock()
+
+            record_purchases(user, [product.id for product in products])
+            clear_cart(cart)
+
+            # Stock changed through update(), which skips the cache signals
+            invalidate_products(
+                [product.id for product in products],
+                {product.store_id for product in products}
+            )
+
+    return order, invoice_items, total
+
+
+def record_purchases(user, product_ids):
+    """
+    Add (user, product) pairs to the purchase ledger used for review verification.
+
+    Reviews the user wrote before buying are marked verified here, since
+    Review.save only re-checks the ledger when the reviewer or product changes.
+    """
+    PurchaseRecord.objects.bulk_create(
+        [PurchaseRecord(user=user, product_id=product_id) for product_id in product_ids],
+        ignore_conflicts=True
+    )
+
+    unverified = Review.objects.filter(user=user, product_id__in=product_ids, is_verified=False)
+    newly_verified = Counter(unverified.values_list('product_id', flat=True))
+    if not newly_verified:
+        return
+    unverified.update(is_verified=True)
+    # Queryset update() skips the review signals, so adjust the verified counters here
+    for product_id, count in newly_verified.items():
+        Product.objects.filter(id=product_id).update(
+            verified_review_count=F('verified_review_count') + count
+        )
@@ -0,0 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+from .role_utils import get_user_roles, VENDOR_ROLE, BUYER_ROLE
+
+
+def roles(request):
+    """Expose the user's cached roles to templates, resolved only if a template uses them"""
+    user_roles = SimpleLazyObject(lambda: get_user_roles(getattr(request, 'user', None)))
+    return {
+        'user_roles': user_roles,
+        'user_is_vendor': lambda: VENDOR_ROLE in user_roles,
+        'user_is_buyer': lambda: BUYER_ROLE in user_roles,
+    }
@@ -0,0 +1,6 @@
+"""
+Database backends whose connections come from pool_utils' shared pool.
+
+Use 'Supadupastore.db_backends.mysql' (or '.sqlite3' for local work) as a
+DATABASES ENGINE; with DB_POOL_SIZE = 0 they behave like the stock backends.
+"""
@@ -0,0 +1,6 @@
+from django.db.backends.mysql import base
+from Supadupastore.pool_utils import PooledConnectionMixin
+
+
+class DatabaseWrapper(PooledConnectionMixin, base.DatabaseWrapper):
+    """MySQL backend with pooled, instrumented connections."""
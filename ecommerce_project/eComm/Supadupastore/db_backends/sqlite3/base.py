@@ -0,0 +1,9 @@
+from django.db.backends.sqlite3 import base
+from Supadupastore.pool_utils import PooledConnectionMixin
+
+
+class DatabaseWrapper(PooledConnectionMixin, base.DatabaseWrapper):
+    """SQLite backend with pooled, instrumented connections."""
+    def _pool_enabled(self):
+        # Each connection to an in-memory database is a separate database
+        return not self.is_in_memory_db()
@@ -0,0 +1,143 @@
+"""
+Database Routers
+Sends catalog and reporting reads to the read replicas in DATABASE_REPLICAS.
+
+Replica reads are opt-in per view: ReplicaRoutingMiddleware starts a
+routing state for each request, and views enable replica reads with the
+replica_reads decorator (function views) or ReplicaReadMixin (viewsets).
+Everything else, including management commands and reads inside a
+transaction, uses the primary.
+
+A request that writes a catalog model is pinned to the primary for the rest
+of the request, and a short-lived cookie keeps the same client on the
+primary for REPLICA_STICKY_SECONDS so it reads its own writes despite
+replication lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Routing state of the request being handled; a ContextVar so it also works under ASGI
+_state = ContextVar('db_routing_state', default=None)
+
+
+class RoutingState:
+    """Per-request routing decisions."""
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica_allowed = False
+        self.wrote = False
+        self.replica = None
+
+
+def replica_aliases():
+    """Configured replica aliases that exist in DATABASES."""
+    return [alias for alias in getattr(settings, 'DATABASE_REPLICAS', []) if alias in settings.DATABASES]
+
+
+@contextmanager
+def routing_request(pinned=False):
+    """Track routing for one request; yields the RoutingState."""
+    state = RoutingState(pinned=pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def allow_replica_reads():
+    """Let the rest of the current request read catalog models from a replica."""
+    state = _state.get()
+    if state is not None:
+        state.replica_allowed = True
+
+
+def pin_to_primary():
+    """Send every later read of the current request to the primary."""
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def replica_reads(view_func):
+    """Decorator for function views (sync or async) whose reads may be served by a replica."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            allow_replica_reads()
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        allow_replica_reads()
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """
+    Allow replica reads for the viewset actions listed in replica_actions.
+
+    Enabled after authentication and permission checks, so those always see
+    the primary.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions:
+            allow_replica_reads()
+
+
+class ReplicaRouter:
+    """
+    Route reads of catalog models to a replica when the request allows it.
+
+    Carts, tokens and outboxes are read right after they are written, so
+    they always stay on the primary, as do the auth and session tables.
+    """
+    route_app_labels = {'Supadupastore'}
+    primary_models = {'cart', 'cartitem', 'apitoken', 'resettoken', 'tweetoutbox', 'emailoutbox',
+                      'imagederivativeoutbox'}
+
+    def _routed(self, model):
+        meta = model._meta
+        return meta.app_label in self.route_app_labels and meta.model_name not in self.primary_models
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (state is None or not state.replica_allowed or state.pinned
+                or not self._routed(model) or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            replicas = replica_aliases()
+            if not replicas:
+                return DEFAULT_DB_ALIAS
+            # One replica per request, so its reads see a single snapshot
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and self._routed(model):
+            state.wrote = True
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        if db in replica_aliases():
+            return False
+        return None
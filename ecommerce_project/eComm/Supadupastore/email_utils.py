@@ -0,0 +1,117 @@
+"""
+Email Utilities
+Queues transactional email and sends it in batches over one connection.
+
+Password reset emails carry the raw reset token, which is stored nowhere
+else (ResetToken keeps only its hash). The body is therefore cleared as
+soon as a message is sent, and purge_email_outbox deletes finished entries
+after EMAIL_OUTBOX_RETENTION_DAYS.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from .models import EmailOutbox
+from .outbox_utils import claim_batch, mark_complete, schedule_retry
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(email):
+    """
+    Store an EmailMessage in the outbox instead of sending it.
+    
+    Args:
+        email: django.core.mail.EmailMessage to deliver
+        
+    Returns:
+        EmailOutbox: The queued entry
+    """
+    return EmailOutbox.objects.create(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(email.to),
+        cc=list(email.cc),
+        bcc=list(email.bcc),
+    )
+
+
+def _build_message(entry, connection):
+    """Rebuild the EmailMessage for an outbox entry, bound to the batch connection."""
+    return EmailMessage(
+        entry.subject,
+        entry.body,
+        entry.from_email,
+        entry.to,
+        bcc=entry.bcc,
+        cc=entry.cc,
+        connection=connection,
+    )
+
+
+def process_email_outbox(batch_size=50, backend=None):
+    """
+    Send one batch of queued email over a single connection.
+    
+    Args:
+        batch_size: Maximum number of messages to send
+        backend: Optional email backend path; defaults to EMAIL_OUTBOX_BACKEND,
+            then EMAIL_BACKEND (use the locmem or filebased backend in tests)
+            
+    Returns:
+        dict: Counts of 'sent', 'retried' and 'failed' messages
+    """
+    results = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    entries = claim_batch(EmailOutbox, batch_size, 'EMAIL_OUTBOX')
+    if not entries:
+        return results
+
+    backend = backend or getattr(settings, 'EMAIL_OUTBOX_BACKEND', None)
+    connection = get_connection(backend=backend)
+    try:
+        connection.open()
+    except Exception as e:
+        # Could not connect at all; retry the whole batch later
+        logger.error(f"Error opening email connection: {str(e)}")
+        for entry in entries:
+            results['retried' if schedule_retry(entry, e, 'EMAIL_OUTBOX') else 'failed'] += 1
+        return results
+
+    try:
+        for entry in entries:
+            try:
+                # The connection is already open, so send_messages reuses it
+                connection.send_messages([_build_message(entry, connection)])
+            except Exception as e:
+                logger.error(f"Error sending email '{entry.subject}' to {entry.to}: {str(e)}")
+                results['retried' if schedule_retry(entry, e, 'EMAIL_OUTBOX') else 'failed'] += 1
+            else:
+                # Keep no copy of delivered content, e.g. a password reset link
+                mark_complete(entry, EmailOutbox.STATUS_SENT, 'sent_at', body='')
+                results['sent'] += 1
+    finally:
+        connection.close()
+
+    return results
+
+
+def purge_email_outbox(retention_days=None):
+    """
+    Delete sent and failed outbox entries older than the retention period.
+
+    Args:
+        retention_days: Age in days (default EMAIL_OUTBOX_RETENTION_DAYS)
+
+    Returns:
+        int: Number of entries deleted
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'EMAIL_OUTBOX_RETENTION_DAYS', 7)
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = EmailOutbox.objects.filter(
+        status__in=[EmailOutbox.STATUS_SENT, EmailOutbox.STATUS_FAILED], created_at__lt=cutoff
+    ).delete()
+    return deleted
@@ -0,0 +1,52 @@
+"""
+Fragment Utilities
+Pre-rendered product cards for the browse listing.
+
+Each card is rendered once per product version and stored in the catalog
+cache, so a listing page is assembled from cached HTML and only cards for
+products that changed since they were last rendered go through the
+template engine.
+"""
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .cache_utils import acached_read_many, cached_read_many, product_scope
+
+PRODUCT_CARD_TEMPLATE = 'Supadupastore/product_card.html'
+
+
+def _card_name(product_id):
+    return f'product-card:{product_id}'
+
+
+def render_product_cards(products, timeout=None):
+    """
+    Return the rendered card for each product, in order.
+
+    Args:
+        products: Products with their store loaded (select_related('store'))
+        timeout: Cache timeout for newly rendered cards (default CATALOG_CACHE_TIMEOUT)
+
+    Returns:
+        list: Safe HTML strings, one per product
+    """
+    products = list(products)
+    cards = cached_read_many(_card_items(products), _card_builder(products), timeout=timeout)
+    return [mark_safe(card) for card in cards]
+
+
+async def arender_product_cards(products):
+    """Async form of render_product_cards."""
+    products = list(products)
+    cards = await acached_read_many(_card_items(products), _card_builder(products))
+    return [mark_safe(card) for card in cards]
+
+
+def _card_items(products):
+    return [(_card_name(product.id), [product_scope(product.id)]) for product in products]
+
+
+def _card_builder(products):
+    def build(missing):
+        return {index: render_to_string(PRODUCT_CARD_TEMPLATE, {'product': products[index]})
+                for index in missing}
+    return build
@@ -0,0 +1,242 @@
+"""
+Image Utilities
+Resized, re-encoded copies ("derivatives") of product images.
+
+The uploaded original is kept as is. For every width in
+IMAGE_DERIVATIVE_WIDTHS narrower than the original, a WebP and a JPEG copy
+are written next to it (product_images/shoe.png -> product_images/shoe_640w.webp),
+and their names are recorded in ProductImage.derivatives. Pages and the API
+offer them through srcset, and tweets attach a JPEG derivative instead of
+the full-size upload.
+
+Saving a new or replaced image queues it in ImageDerivativeOutbox, and
+python manage.py process_image_outbox generates the files off the request
+path. python manage.py backfill_image_derivatives covers images uploaded
+before the pipeline existed, encoding them in a process pool.
+"""
+import logging
+import posixpath
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+from .cache_utils import invalidate_products
+from .models import ImageDerivativeOutbox, ProductImage
+from .outbox_utils import claim_batch, mark_complete, schedule_retry
+
+logger = logging.getLogger(__name__)
+
+# Derivative format -> (Pillow format, file extension)
+IMAGE_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def derivative_settings():
+    """
+    The configured derivative widths, formats and encoder qualities.
+
+    Returns:
+        tuple: (sorted widths, formats, {format: quality})
+    """
+    widths = sorted(set(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', [320, 640, 1280])))
+    formats = [fmt for fmt in getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ['webp', 'jpeg'])
+               if fmt in IMAGE_FORMATS]
+    quality = dict({'webp': 80, 'jpeg': 82}, **getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', {}))
+    return widths, formats, quality
+
+
+def derivative_name(original_name, width, image_format):
+    """Storage name of a derivative, in the original's directory."""
+    root, _ = posixpath.splitext(original_name)
+    return f'{root}_{width}w.{IMAGE_FORMATS[image_format][1]}'
+
+
+def needs_derivatives(product_image):
+    """True if the image has no derivatives for its current file and settings."""
+    derivatives = product_image.derivatives or {}
+    widths, formats, _ = derivative_settings()
+    return (
+        derivatives.get('source') != product_image.image.name
+        or derivatives.get('widths') != widths
+        or any(fmt not in derivatives for fmt in formats)
+    )
+
+
+def _prepare(original):
+    """Apply the EXIF orientation and convert to a mode both encoders accept."""
+    image = ImageOps.exif_transpose(original)
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    return image
+
+
+def _flatten(image):
+    """JPEG has no alpha channel; composite transparent images onto white."""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def encode_derivatives(data, widths, formats, quality):
+    """
+    Resize and re-encode one image.
+
+    Pure Pillow work with no Django access, so it can run in a process pool.
+    Widths at or above the original's are skipped rather than upscaled; an
+    image narrower than every width is re-encoded at its own width.
+
+    Args:
+        data: The original file's bytes
+        widths: Target widths in pixels
+        formats: Keys of IMAGE_FORMATS to encode
+        quality: {format: encoder quality}
+
+    Returns:
+        dict: {'width', 'height', 'files': {format: {width: bytes}}}
+    """
+    with Image.open(BytesIO(data)) as original:
+        image = _prepare(original)
+        width, height = image.size
+        targets = [target for target in widths if target < width] or [width]
+
+        files = {fmt: {} for fmt in formats}
+        for target in targets:
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS
+            )
+            for fmt in formats:
+                buffer = BytesIO()
+                if fmt == 'jpeg':
+                    _flatten(resized).save(buffer, 'JPEG', quality=quality['jpeg'],
+                                           optimize=True, progressive=True)
+                else:
+                    resized.save(buffer, IMAGE_FORMATS[fmt][0], quality=quality[fmt], method=4)
+                files[fmt][target] = buffer.getvalue()
+    return {'width': width, 'height': height, 'files': files}
+
+
+def read_original(product_image):
+    """Bytes of the uploaded original."""
+    with product_image.image.open('rb') as original:
+        return original.read()
+
+
+def derivative_files(derivatives):
+    """Storage names of every file in a derivatives map."""
+    return {name for fmt in IMAGE_FORMATS for name in (derivatives or {}).get(fmt, {}).values()}
+
+
+def delete_derivative_files(derivatives, storage, keep=()):
+    """Delete the files named in a derivatives map, except those in keep."""
+    for name in derivative_files(derivatives) - set(keep):
+        storage.delete(name)
+
+
+def store_derivatives(product_image, encoded):
+    """
+    Write encoded derivatives next to the original and record them.
+
+    Files left over from an earlier original or width setting are removed.
+    If the image was replaced while it was being encoded, nothing is
+    recorded and the new files are removed again; the replacement has its
+    own outbox entry.
+
+    Args:
+        product_image: ProductImage the derivatives were encoded from
+        encoded: Result of encode_derivatives
+
+    Returns:
+        bool: True if the derivatives were recorded
+    """
+    storage = product_image.image.storage
+    source = product_image.image.name
+    widths, _, _ = derivative_settings()
+    derivatives = {'source': source, 'widths': widths,
+                   'width': encoded['width'], 'height': encoded['height']}
+    for fmt, files in encoded['files'].items():
+        derivatives[fmt] = {}
+        for width, data in files.items():
+            name = derivative_name(source, width, fmt)
+            # Overwrite in place instead of letting the storage pick a suffixed name
+            storage.delete(name)
+            derivatives[fmt][str(width)] = storage.save(name, ContentFile(data))
+
+    with transaction.atomic():
+        current = (ProductImage.objects.select_for_update()
+                   .filter(pk=product_image.pk).values_list('image', 'derivatives').first())
+        if current is not None and current[0] == source:
+            ProductImage.objects.filter(pk=product_image.pk).update(derivatives=derivatives)
+
+    if current is None or current[0] != source:
+        # Replaced or deleted meanwhile; keep any files the current record uses
+        delete_derivative_files(derivatives, storage, keep=derivative_files(current and current[1]))
+        return False
+    delete_derivative_files(current[1], storage, keep=derivative_files(derivatives))
+    product_image.derivatives = derivatives
+    invalidate_products([product_image.product_id])
+    return True
+
+
+def generate_derivatives(product_image, force=False):
+    """
+    Encode and store derivatives for one image in this process.
+
+    Args:
+        product_image: ProductImage instance
+        force: Regenerate even if derivatives for the current file exist
+
+    Returns:
+        bool: True if derivatives were written
+    """
+    if not product_image.image or not (force or needs_derivatives(product_image)):
+        return False
+    encoded = encode_derivatives(read_original(product_image), *derivative_settings())
+    return store_derivatives(product_image, encoded)
+
+
+# ==================== DERIVATIVE OUTBOX ====================
+
+def queue_image_derivatives(product_image):
+    """Queue derivative generation for a new or replaced image; the outbox worker runs it."""
+    return ImageDerivativeOutbox.objects.create(image=product_image)
+
+
+def process_image_outbox(batch_size=10):
+    """
+    Generate derivatives for one batch of queued images.
+
+    Args:
+        batch_size: Maximum number of outbox entries to process
+
+    Returns:
+        dict: Counts of 'generated', 'skipped', 'retried' and 'failed' entries
+    """
+    results = {'generated': 0, 'skipped': 0, 'retried': 0, 'failed': 0}
+
+    entries = claim_batch(ImageDerivativeOutbox, batch_size, 'IMAGE_OUTBOX')
+    if not entries:
+        return results
+
+    images = ProductImage.objects.in_bulk([entry.image_id for entry in entries])
+    for entry in entries:
+        product_image = images.get(entry.image_id)
+        if product_image is None:
+            # Deleted since it was claimed; the entry went with it
+            continue
+        try:
+            generated = generate_derivatives(product_image)
+        except Exception as e:
+            logger.error(f"Error generating derivatives for image #{entry.image_id}: {str(e)}")
+            results['retried' if schedule_retry(entry, e, 'IMAGE_OUTBOX') else 'failed'] += 1
+            continue
+
+        mark_complete(entry, ImageDerivativeOutbox.STATUS_DONE, 'processed_at')
+        results['generated' if generated else 'skipped'] += 1
+
+    return results
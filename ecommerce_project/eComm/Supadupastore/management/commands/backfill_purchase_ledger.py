@@ -0,0 +1,39 @@
+"""
+Build the purchase ledger (PurchaseRecord) from existing orders.
+
+Usage:
+    python manage.py backfill_purchase_ledger
+    python manage.py backfill_purchase_ledger --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+from Supadupastore.models import OrderItem, PurchaseRecord
+
+
+class Command(BaseCommand):
+    help = "Record every (user, product) pair found in past orders in the purchase ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of ledger rows inserted per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pairs = (
+            OrderItem.objects.values_list('order__user_id', 'product_id')
+            .order_by('order__user_id', 'product_id')
+            .distinct()
+        )
+
+        batch = []
+        total = 0
+        for user_id, product_id in pairs.iterator(chunk_size=batch_size):
+            batch.append(PurchaseRecord(user_id=user_id, product_id=product_id))
+            if len(batch) >= batch_size:
+                PurchaseRecord.objects.bulk_create(batch, ignore_conflicts=True)
+                total += len(batch)
+                batch = []
+        if batch:
+            PurchaseRecord.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled purchase ledger ({total} user/product pairs)"))
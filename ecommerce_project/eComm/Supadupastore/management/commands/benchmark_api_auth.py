@@ -0,0 +1,73 @@
+"""
+Compare API requests per second under Basic and bearer token authentication.
+
+Requests GET /api/products/<id>/ with a temporary user's credentials, once
+with BasicAuthentication (the password hasher runs on every request) and
+once with CachedTokenAuthentication. The temporary user and its token are
+deleted afterwards.
+
+Usage:
+    python manage.py benchmark_api_auth
+    python manage.py benchmark_api_auth --requests 500
+"""
+import base64
+import time
+import uuid
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.test import APIClient
+from Supadupastore.api_views import ProductViewSet
+from Supadupastore.authentication import CachedTokenAuthentication
+from Supadupastore.models import Product
+from Supadupastore.token_utils import issue_token
+
+
+class Command(BaseCommand):
+    help = "Benchmark API requests/sec with Basic auth versus cached bearer tokens"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per authentication scheme')
+
+    def _run(self, authorization, path, count):
+        """Issue count authenticated GET requests; returns (req/s, mean ms)"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=authorization)
+        started = time.perf_counter()
+        for _ in range(count):
+            response = client.get(path)
+            if response.status_code >= 400:
+                raise CommandError(f"{path} returned {response.status_code}")
+        elapsed = time.perf_counter() - started
+        return count / elapsed, elapsed * 1000 / count
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        product_id = Product.objects.values_list('id', flat=True).first()
+        if product_id is None:
+            raise CommandError("Need at least one product to benchmark against")
+        path = reverse('Supadupastore:api-product-detail', args=[product_id])
+
+        username = f'auth-bench-{uuid.uuid4().hex[:8]}'
+        password = uuid.uuid4().hex
+        user = User.objects.create_user(username, password=password)
+        raw_key, token = issue_token(user, name='benchmark')
+        basic = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        schemes = [
+            ('basic', BasicAuthentication, f'Basic {basic}'),
+            ('token', CachedTokenAuthentication, f'Bearer {raw_key}'),
+        ]
+
+        original = ProductViewSet.authentication_classes
+        self.stdout.write(f"{'auth':<10}{'req/s':>10}{'ms/req':>10}")
+        try:
+            for label, auth_class, authorization in schemes:
+                # Only the scheme under test, so the other cannot answer first
+                ProductViewSet.authentication_classes = [auth_class]
+                rate, mean_ms = self._run(authorization, path, count)
+                self.stdout.write(f"{label:<10}{rate:>10.1f}{mean_ms:>10.2f}")
+        finally:
+            ProductViewSet.authentication_classes = original
+            user.delete()
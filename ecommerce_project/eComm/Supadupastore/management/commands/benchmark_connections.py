@@ -0,0 +1,82 @@
+"""
+Compare per-request latency with and without database connection reuse.
+
+Runs the same review API requests (not served from the catalog cache, so
+every request queries) through the test client in three modes and
+closes connections after each request the way the request_finished
+handler does in a server:
+
+    new          DB_POOL_SIZE = 0, CONN_MAX_AGE = 0: connect on every request
+    persistent   DB_POOL_SIZE = 0, connection kept by the thread (CONN_MAX_AGE)
+    pooled       connections returned to and reused from pool_utils' pool
+
+Usage:
+    python manage.py benchmark_connections
+    python manage.py benchmark_connections --requests 500 --mode new --mode pooled
+"""
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from Supadupastore.metrics_utils import registry
+from Supadupastore.models import Product
+from Supadupastore.pool_utils import reset_pools
+
+MODES = ('new', 'persistent', 'pooled')
+
+
+class Command(BaseCommand):
+    help = "Benchmark request latency with new, persistent and pooled database connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per mode')
+        parser.add_argument('--mode', action='append', dest='modes', choices=MODES,
+                            help='Mode to benchmark (may be repeated; default: all)')
+
+    def _paths(self):
+        reviews = reverse('Supadupastore:api-review-list')
+        paths = [reviews]
+        product_id = Product.objects.values_list('id', flat=True).first()
+        if product_id is not None:
+            paths.append(f'{reviews}?product={product_id}')
+        return paths
+
+    def _run(self, mode, paths, count):
+        """Returns (mean ms, p50 ms, p95 ms, new connections per request)"""
+        client = Client()
+        pool_metrics = registry.pool(DEFAULT_DB_ALIAS)
+        connects_before = pool_metrics.counters['connects']
+        latencies = []
+        for index in range(count):
+            started = time.perf_counter()
+            response = client.get(paths[index % len(paths)])
+            if mode != 'persistent':
+                # Server behaviour with CONN_MAX_AGE = 0; pooled connections go back to the pool
+                connections.close_all()
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f"{paths[index % len(paths)]} returned {response.status_code}")
+        latencies.sort()
+        connects = pool_metrics.counters['connects'] - connects_before
+        return (sum(latencies) / count, latencies[count // 2],
+                latencies[min(count - 1, int(count * 0.95))], connects / count)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        modes = options['modes'] or list(MODES)
+        paths = self._paths()
+        pool_size = getattr(settings, 'DB_POOL_SIZE', 0) or 5
+
+        self.stdout.write(f"{'mode':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'connects/req':>14}")
+        for mode in modes:
+            with override_settings(DB_POOL_SIZE=pool_size if mode == 'pooled' else 0):
+                connections.close_all()
+                reset_pools()
+                try:
+                    mean_ms, p50, p95, connects = self._run(mode, paths, count)
+                finally:
+                    connections.close_all()
+                    reset_pools()
+            self.stdout.write(f"{mode:<12}{mean_ms:>10.2f}{p50:>10.2f}{p95:>10.2f}{connects:>14.2f}")
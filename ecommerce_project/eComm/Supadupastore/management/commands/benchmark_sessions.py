@@ -0,0 +1,76 @@
+"""
+Compare session engines by requests per second and database queries per request.
+
+Runs the same anonymous and logged-in browsing scenario through the test
+client once per engine in SESSION_ENGINES. A temporary user is created for
+the logged-in scenario and deleted afterwards.
+
+Usage:
+    python manage.py benchmark_sessions
+    python manage.py benchmark_sessions --requests 500 --mode cached_db --mode signed_cookie
+"""
+import time
+import uuid
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from Supadupastore.models import Product
+
+
+class Command(BaseCommand):
+    help = "Benchmark requests/sec and queries/request for each session engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per scenario and engine')
+        parser.add_argument('--mode', action='append', dest='modes',
+                            choices=sorted(settings.SESSION_ENGINES),
+                            help='Engine to benchmark (may be repeated; default: all)')
+
+    def _paths(self):
+        paths = [reverse('Supadupastore:browse_products')]
+        product_id = Product.objects.values_list('id', flat=True).first()
+        if product_id is not None:
+            paths.append(reverse('Supadupastore:product_detail', args=[product_id]))
+        return paths
+
+    def _run(self, client, paths, count):
+        """Issue count GET requests cycling through paths; returns (req/s, queries/req)"""
+        queries = 0
+        started = time.perf_counter()
+        for index in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                response = client.get(paths[index % len(paths)])
+            if response.status_code >= 400:
+                raise RuntimeError(f"{paths[index % len(paths)]} returned {response.status_code}")
+            queries += len(captured.captured_queries)
+        elapsed = time.perf_counter() - started
+        return count / elapsed, queries / count
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        modes = options['modes'] or list(settings.SESSION_ENGINES)
+        paths = self._paths()
+        cart_path = reverse('Supadupastore:view_cart')
+        user = User.objects.create_user(f'session-bench-{uuid.uuid4().hex[:8]}', password=uuid.uuid4().hex)
+
+        self.stdout.write(f"{'mode':<15}{'scenario':<12}{'req/s':>10}{'queries/req':>14}")
+        try:
+            for mode in modes:
+                with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[mode]):
+                    # A fresh client per mode so SessionMiddleware picks up the engine
+                    anonymous = Client()
+                    logged_in = Client()
+                    logged_in.force_login(user)
+                    results = [
+                        ('anonymous', self._run(anonymous, paths, count)),
+                        ('logged-in', self._run(logged_in, paths + [cart_path], count)),
+                    ]
+                for scenario, (rate, queries) in results:
+                    self.stdout.write(f"{mode:<15}{scenario:<12}{rate:>10.1f}{queries:>14.2f}")
+        finally:
+            user.delete()
@@ -0,0 +1,35 @@
+"""
+Write a vendor's products as a CSV or NDJSON catalog that import_catalog can read back.
+
+Usage:
+    python manage.py export_catalog --owner alice > catalog.csv
+    python manage.py export_catalog --owner alice --format ndjson --output catalog.ndjson
+"""
+import sys
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from Supadupastore.catalog_utils import CATALOG_FORMATS, iter_catalog_export
+from Supadupastore.models import Product
+
+
+class Command(BaseCommand):
+    help = "Stream a vendor's product catalog as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', required=True, help='Username of the vendor to export')
+        parser.add_argument('--format', choices=CATALOG_FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['owner']}' does not exist")
+
+        products = Product.objects.filter(store__owner=owner)
+        lines = iter_catalog_export(products, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                stream.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
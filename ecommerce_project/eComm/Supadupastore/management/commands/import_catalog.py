@@ -0,0 +1,47 @@
+"""
+Create or update a vendor's products from a CSV or NDJSON catalog.
+
+Usage:
+    python manage.py import_catalog catalog.csv --owner alice
+    python manage.py import_catalog catalog.ndjson --owner alice --chunk-size 2000
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from Supadupastore.catalog_utils import (
+    CATALOG_FORMATS, CatalogFormatError, check_encoding, guess_catalog_format, import_catalog, open_text
+)
+
+
+class Command(BaseCommand):
+    help = "Bulk import products for a vendor from a CSV or NDJSON catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file (columns: id, store, name, description, price, stock)')
+        parser.add_argument('--owner', required=True, help='Username of the vendor that owns the stores')
+        parser.add_argument('--format', choices=CATALOG_FORMATS,
+                            help='Catalog format (default: guessed from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of rows validated and written together')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['owner']}' does not exist")
+
+        fmt = options['format'] or guess_catalog_format(options['path'])
+        with open(options['path'], 'rb') as catalog:
+            try:
+                check_encoding(catalog)
+            except CatalogFormatError as e:
+                raise CommandError(str(e))
+            result = import_catalog(open_text(catalog), fmt, owner, chunk_size=options['chunk_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        if result['error_count'] > len(result['errors']):
+            self.stderr.write(f"... {result['error_count'] - len(result['errors'])} more errors not shown")
+
+        summary = (f"Imported catalog: {result['created']} created, {result['updated']} updated, "
+                   f"{result['error_count']} errors")
+        self.stdout.write(self.style.SUCCESS(summary) if not result['error_count'] else self.style.WARNING(summary))
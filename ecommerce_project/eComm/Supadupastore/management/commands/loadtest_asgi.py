@@ -0,0 +1,165 @@
+"""
+Load test the site under uvicorn (eComm.asgi) at several concurrency limits.
+
+For each --limit, starts uvicorn with --limit-concurrency set to it, then
+keeps --connections keep-alive clients requesting the given paths for
+--duration seconds. Requests beyond the limit are answered 503 by uvicorn
+and reported as rejected. Runs against the configured database, so seed it
+(and start any cache it needs) first.
+
+Usage:
+    python manage.py loadtest_asgi
+    python manage.py loadtest_asgi --limit 10 --limit 100 --connections 200 --duration 15
+    python manage.py loadtest_asgi --path /products/ --path /api/products/ --workers 2
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+async def _read_response(reader):
+    """Read one HTTP/1.1 response; returns its status code."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+    return status, headers.get('connection', '').lower() == 'close'
+
+
+class Command(BaseCommand):
+    help = "Compare throughput, latency and rejections under uvicorn at several --limit-concurrency values"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, action='append', dest='limits',
+                            help='uvicorn --limit-concurrency value (may be repeated; default: 20, 100, 500)')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request (may be repeated; default: /products/)')
+        parser.add_argument('--connections', type=int, default=100, help='Concurrent client connections')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per limit')
+        parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+        parser.add_argument('--port', type=int, default=0, help='Port to serve on (default: a free one)')
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise CommandError("uvicorn is not installed (pip install -r requirements.txt)")
+
+        limits = options['limits'] or [20, 100, 500]
+        paths = options['paths'] or ['/products/']
+        self.stdout.write(
+            f"{'limit':>7}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'ok':>8}{'503':>8}{'errors':>8}"
+        )
+        for limit in limits:
+            port = options['port'] or self._free_port()
+            server = self._start_server(port, limit, options['workers'])
+            try:
+                self._wait_for_server(port, server)
+                stats = asyncio.run(self._load(port, paths, options['connections'], options['duration']))
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+            self._report(limit, stats, options['duration'])
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def _start_server(self, port, limit, workers):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'eComm.settings'))
+        command = [
+            sys.executable, '-m', 'uvicorn', 'eComm.asgi:application',
+            '--host', '127.0.0.1', '--port', str(port),
+            '--limit-concurrency', str(limit), '--workers', str(workers),
+            '--no-access-log', '--log-level', 'error',
+        ]
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    @staticmethod
+    def _wait_for_server(port, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"uvicorn exited with status {server.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"uvicorn did not start listening on port {port}")
+
+    async def _load(self, port, paths, connections, duration):
+        stats = {'latencies': [], 'ok': 0, 'rejected': 0, 'errors': 0}
+        deadline = time.monotonic() + duration
+
+        async def client(index):
+            reader = writer = None
+            sent = index
+            while time.monotonic() < deadline:
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    path = paths[sent % len(paths)]
+                    sent += 1
+                    started = time.perf_counter()
+                    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode())
+                    await writer.drain()
+                    status, closed = await _read_response(reader)
+                    stats['latencies'].append((time.perf_counter() - started) * 1000)
+                    if status == 503:
+                        stats['rejected'] += 1
+                    elif status < 400:
+                        stats['ok'] += 1
+                    else:
+                        stats['errors'] += 1
+                    if closed:
+                        writer.close()
+                        reader = writer = None
+                except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    stats['errors'] += 1
+                    if writer is not None:
+                        writer.close()
+                    reader = writer = None
+                    await asyncio.sleep(0.01)
+            if writer is not None:
+                writer.close()
+
+        await asyncio.gather(*(client(index) for index in range(connections)))
+        return stats
+
+    def _report(self, limit, stats, duration):
+        latencies = sorted(stats['latencies'])
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else 0.0
+
+        self.stdout.write(
+            f"{limit:>7}{stats['ok'] / duration:>10.1f}{percentile(0.5):>10.1f}{percentile(0.95):>10.1f}"
+            f"{percentile(0.99):>10.1f}{stats['ok']:>8}{stats['rejected']:>8}{stats['errors']:>8}"
+        )
@@ -0,0 +1,108 @@
+"""
+Print the endpoints with the worst latency, query counts or duplicate queries.
+
+Reads the per-process files written by QueryMetricsMiddleware to METRICS_DIR.
+Also summarises the database connection pools: reuse, connect latency and
+time spent waiting for a free connection.
+
+Usage:
+    python manage.py metrics_report
+    python manage.py metrics_report --sort duplicates --limit 5
+    python manage.py metrics_report --reset
+"""
+import os
+from django.core.management.base import BaseCommand
+from Supadupastore.metrics_utils import load_metrics, load_pool_metrics, metrics_dir
+
+SORT_KEYS = {
+    'latency': lambda metrics: metrics.histograms['latency_ms'].quantile(0.95),
+    'queries': lambda metrics: metrics.histograms['queries'].mean(),
+    'db': lambda metrics: metrics.histograms['db_ms'].mean(),
+    'duplicates': lambda metrics: metrics.histograms['duplicate_queries'].mean(),
+    'serializer': lambda metrics: metrics.histograms['serializer_ms'].mean(),
+    'connects': lambda metrics: metrics.histograms['connects'].mean(),
+    'total-time': lambda metrics: metrics.histograms['latency_ms'].total,
+}
+
+
+class Command(BaseCommand):
+    help = "Show the top offending endpoints from the request metrics files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='latency',
+                            help='Rank by p95 latency (default), mean queries, mean DB time, '
+                                 'mean duplicate queries, mean serializer time, new connections '
+                                 'per request or total time')
+        parser.add_argument('--limit', type=int, default=10, help='Number of endpoints to show')
+        parser.add_argument('--dir', help='Metrics directory (default: METRICS_DIR)')
+        parser.add_argument('--reset', action='store_true', help='Delete the metrics files and exit')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or metrics_dir()
+        if options['reset']:
+            removed = 0
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if name.startswith('metrics-') and name.endswith('.json'):
+                        os.remove(os.path.join(directory, name))
+                        removed += 1
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} metrics files"))
+            return
+
+        endpoints = load_metrics(directory)
+        if not endpoints:
+            self.stdout.write(f"No metrics recorded in {directory}")
+            return
+        self._endpoint_report(endpoints, options)
+        self._pool_report(load_pool_metrics(directory))
+
+    @staticmethod
+    def _reuse_percent(metrics):
+        """Share of requests that ran queries without opening a connection"""
+        queries = metrics.histograms['queries']
+        # The first query bucket counts requests with no queries at all
+        with_queries = queries.count - queries.counts[0]
+        if not with_queries:
+            return '-'
+        opened = metrics.histograms['connects'].total
+        return f"{max(0.0, 100 * (1 - opened / with_queries)):.0f}"
+
+    def _endpoint_report(self, endpoints, options):
+        ranked = sorted(endpoints.items(), key=lambda item: SORT_KEYS[options['sort']](item[1]), reverse=True)
+        self.stdout.write(
+            f"{'endpoint':<45}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}"
+            f"{'queries':>9}{'max q':>7}{'dup q':>7}{'db ms':>9}{'ser ms':>9}{'reuse%':>8}"
+        )
+        for endpoint, metrics in ranked[:options['limit']]:
+            latency = metrics.histograms['latency_ms']
+            queries = metrics.histograms['queries']
+            self.stdout.write(
+                f"{endpoint[:44]:<45}{latency.count:>9}{latency.quantile(0.5):>9.0f}"
+                f"{latency.quantile(0.95):>9.0f}{latency.maximum:>9.1f}"
+                f"{queries.mean():>9.1f}{queries.maximum:>7.0f}"
+                f"{metrics.histograms['duplicate_queries'].mean():>7.1f}"
+                f"{metrics.histograms['db_ms'].mean():>9.1f}"
+                f"{metrics.histograms['serializer_ms'].mean():>9.1f}"
+                f"{self._reuse_percent(metrics):>8}"
+            )
+            if metrics.worst_duplicate['count'] > 1:
+                self.stdout.write(self.style.WARNING(
+                    f"    repeated {metrics.worst_duplicate['count']}x: {metrics.worst_duplicate['sql'][:120]}"
+                ))
+
+    def _pool_report(self, pools):
+        if not pools:
+            return
+        self.stdout.write('')
+        self.stdout.write(
+            f"{'database':<12}{'size':>6}{'in use':>8}{'peak':>6}{'checkouts':>11}{'reused':>9}"
+            f"{'connects':>10}{'conn p50':>10}{'conn p95':>10}{'wait p95':>10}{'timeouts':>10}"
+        )
+        for alias, pool in sorted(pools.items()):
+            counters = pool.counters
+            self.stdout.write(
+                f"{alias:<12}{pool.size:>6}{pool.in_use:>8}{pool.peak_in_use:>6}"
+                f"{counters['checkouts']:>11}{counters['reused']:>9}{counters['connects']:>10}"
+                f"{pool.connect_ms.quantile(0.5):>10.1f}{pool.connect_ms.quantile(0.95):>10.1f}"
+                f"{pool.wait_ms.quantile(0.95):>10.1f}{counters['timeouts']:>10}"
+            )
@@ -0,0 +1,49 @@
+"""
+Drain the email outbox, sending queued invoices and password reset emails.
+
+Usage:
+    python manage.py process_email_outbox            # run until interrupted
+    python manage.py process_email_outbox --once     # send one batch and exit
+    python manage.py process_email_outbox --backend django.core.mail.backends.locmem.EmailBackend
+    python manage.py process_email_outbox --purge    # delete old sent/failed entries and exit
+
+Sent messages keep no body. Run --purge daily (e.g. from cron) so finished
+entries are dropped after EMAIL_OUTBOX_RETENTION_DAYS.
+"""
+import time
+from django.core.management.base import BaseCommand
+from Supadupastore.email_utils import process_email_outbox, purge_email_outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued transactional email in batches over one connection, with retry and backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Maximum number of messages to send per connection')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Send a single batch and exit')
+        parser.add_argument('--backend', default=None,
+                            help='Email backend to send with (defaults to EMAIL_OUTBOX_BACKEND / EMAIL_BACKEND)')
+        parser.add_argument('--purge', action='store_true',
+                            help='Delete sent and failed entries older than EMAIL_OUTBOX_RETENTION_DAYS and exit')
+
+    def handle(self, *args, **options):
+        if options['purge']:
+            self.stdout.write(f"purged={purge_email_outbox()}")
+            return
+
+        while True:
+            results = process_email_outbox(batch_size=options['batch_size'], backend=options['backend'])
+            if any(results.values()):
+                self.stdout.write(
+                    f"sent={results['sent']} retried={results['retried']} failed={results['failed']}"
+                )
+
+            if options['once']:
+                break
+            # Keep draining while batches are full, otherwise wait for new work
+            if sum(results.values()) < options['batch_size']:
+                time.sleep(options['interval'])
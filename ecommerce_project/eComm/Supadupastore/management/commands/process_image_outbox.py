@@ -0,0 +1,37 @@
+"""
+Drain the image outbox, generating resized WebP/JPEG copies of new product images.
+
+Usage:
+    python manage.py process_image_outbox            # run until interrupted
+    python manage.py process_image_outbox --once     # process one batch and exit
+"""
+import time
+from django.core.management.base import BaseCommand
+from Supadupastore.image_utils import process_image_outbox
+
+
+class Command(BaseCommand):
+    help = "Generate queued product image derivatives with retry and backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Maximum number of images to process per batch')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Process a single batch and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            results = process_image_outbox(batch_size=options['batch_size'])
+            if any(results.values()):
+                self.stdout.write(
+                    f"generated={results['generated']} skipped={results['skipped']} "
+                    f"retried={results['retried']} failed={results['failed']}"
+                )
+
+            if options['once']:
+                break
+            # Keep draining while batches are full, otherwise wait for new work
+            if sum(results.values()) < options['batch_size']:
+                time.sleep(options['interval'])
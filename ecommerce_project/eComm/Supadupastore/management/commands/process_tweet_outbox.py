@@ -0,0 +1,49 @@
+"""
+Drain the tweet outbox, posting queued store and product announcements.
+
+Usage:
+    python manage.py process_tweet_outbox            # run until interrupted
+    python manage.py process_tweet_outbox --once     # process one batch and exit
+    python manage.py process_tweet_outbox --stub     # record tweets locally instead of posting
+"""
+import time
+from django.core.management.base import BaseCommand
+from Supadupastore.twitter_utils import process_tweet_outbox, StubTwitterClient, twitter_client_pool
+
+
+class Command(BaseCommand):
+    help = "Post queued Twitter announcements with batching, retry and rate-limit backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Maximum number of tweets to post per batch')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Process a single batch and exit')
+        parser.add_argument('--stub', action='store_true',
+                            help='Use the local stub client instead of the Twitter API')
+
+    def handle(self, *args, **options):
+        stub = StubTwitterClient() if options['stub'] else None
+        twitter = stub.as_twitter() if stub else None
+
+        while True:
+            results = process_tweet_outbox(twitter=twitter, batch_size=options['batch_size'])
+            if any(results.values()):
+                self.stdout.write(
+                    f"sent={results['sent']} retried={results['retried']} "
+                    f"failed={results['failed']} deferred={results['deferred']}"
+                )
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"client pool: {twitter_client_pool.stats()}")
+            if stub:
+                for tweet in stub.tweets:
+                    self.stdout.write(tweet['text'])
+                stub.tweets.clear()
+
+            if options['once']:
+                break
+            # Keep draining while batches are full, otherwise wait for new work
+            if sum(results.values()) < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+"""
+Recompute the review aggregates stored on Product from the Review table.
+
+Usage:
+    python manage.py rebuild_rating_aggregates
+    python manage.py rebuild_rating_aggregates --product 12 --product 15
+"""
+from django.core.management.base import BaseCommand
+from Supadupastore.rating_utils import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = "Rebuild product review counts, rating sums, verified counts and rating histograms"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help='Only rebuild this product id (may be repeated)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of products written per bulk update')
+
+    def handle(self, *args, **options):
+        reviewed = rebuild_rating_aggregates(options['products'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates ({reviewed} products with reviews)"))
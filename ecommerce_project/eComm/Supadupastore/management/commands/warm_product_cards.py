@@ -0,0 +1,71 @@
+"""
+Render and cache the browse listing's product cards ahead of traffic.
+
+The cards go into CATALOG_CACHE_ALIAS, so it must be a cache the web
+workers share (Memcached/Redis). With the per-process local-memory cache
+the cards would only land in this command's own memory, so the command
+refuses to run unless --force is given.
+
+Warmed cards expire like any catalog entry, after CATALOG_CACHE_TIMEOUT
+seconds (300 by default), so run the command just before traffic (e.g. at
+the end of a deploy) or pass --timeout. Cards are keyed by product version,
+so a long timeout never serves an outdated card. Cards that are already
+cached are left as they are.
+
+Usage:
+    python manage.py warm_product_cards
+    python manage.py warm_product_cards --limit 480 --batch-size 200
+    python manage.py warm_product_cards --timeout 86400
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from Supadupastore.cache_utils import catalog_cache_is_shared
+from Supadupastore.fragment_utils import render_product_cards
+from Supadupastore.models import Product
+
+
+class Command(BaseCommand):
+    help = "Pre-render product card fragments into the catalog cache, newest products first"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int,
+                            help='Only warm this many of the newest products (default: all)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products loaded and cached per batch')
+        parser.add_argument('--timeout', type=int,
+                            help='Seconds to keep the warmed cards (default: CATALOG_CACHE_TIMEOUT)')
+        parser.add_argument('--force', action='store_true',
+                            help='Warm even if the catalog cache is not shared with the web workers')
+
+    def handle(self, *args, **options):
+        alias = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+        if not catalog_cache_is_shared():
+            message = (f"CATALOG_CACHE_ALIAS '{alias}' is a per-process cache; cards warmed here "
+                       f"are not visible to the web workers. Point it at a shared cache "
+                       f"(Memcached/Redis).")
+            if not options['force']:
+                raise CommandError(f"{message} Use --force to warm anyway.")
+            self.stderr.write(self.style.WARNING(message))
+
+        timeout = options['timeout']
+        if timeout is None:
+            timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+        batch_size = options['batch_size']
+        products = (Product.objects.select_related('store').prefetch_related('productimage_set')
+                    .order_by('-created_at', '-id'))
+        if options['limit'] is not None:
+            products = products[:options['limit']]
+
+        warmed = 0
+        batch = []
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                render_product_cards(batch, timeout=timeout)
+                warmed += len(batch)
+                batch = []
+        if batch:
+            render_product_cards(batch, timeout=timeout)
+            warmed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Warmed {warmed} product cards (cached for {timeout}s)"))
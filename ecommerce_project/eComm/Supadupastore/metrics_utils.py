@@ -0,0 +1,376 @@
+"""
+Metrics Utilities
+Per-endpoint request metrics: latency, database time, query counts, duplicate
+queries (N+1 patterns) and serializer time.
+
+QueryMetricsMiddleware (middleware.py) measures each request and records it
+here. Each process keeps cumulative histograms in memory and periodically
+writes them to METRICS_DIR/metrics-<pid>.json; `manage.py metrics_report`
+merges the files and prints the slowest and chattiest endpoints.
+The database connection pools (pool_utils) keep their counters here too.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from django.conf import settings
+
+LATENCY_BOUNDS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+QUERY_BOUNDS = [0, 1, 2, 5, 10, 20, 50, 100, 200]
+# Connecting and waiting for a pooled connection take (sub)milliseconds when healthy
+CONNECT_BOUNDS_MS = [0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000]
+
+# Metrics of the request being handled, for code outside the middleware
+# (serializers) to add to; a ContextVar so it also works under ASGI
+_current = ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram; bucket i counts values <= bounds[i], the last bucket the rest."""
+    def __init__(self, bounds, counts=None, total=0.0, maximum=0.0):
+        self.bounds = list(bounds)
+        self.counts = list(counts) if counts else [0] * (len(self.bounds) + 1)
+        self.total = total
+        self.maximum = maximum
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (the maximum for the last bucket)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.bounds[index] if index < len(self.bounds) else self.maximum
+        return self.maximum
+
+    def to_dict(self):
+        return {'bounds': self.bounds, 'counts': self.counts, 'sum': self.total, 'max': self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['bounds'], data['counts'], data['sum'], data['max'])
+
+
+class EndpointMetrics:
+    """Histograms for one endpoint (method and view name)."""
+    FIELDS = {
+        'latency_ms': LATENCY_BOUNDS_MS,
+        'db_ms': LATENCY_BOUNDS_MS,
+        'serializer_ms': LATENCY_BOUNDS_MS,
+        'queries': QUERY_BOUNDS,
+        'duplicate_queries': QUERY_BOUNDS,
+        'connects': QUERY_BOUNDS,
+        'connect_ms': CONNECT_BOUNDS_MS,
+        'pool_wait_ms': CONNECT_BOUNDS_MS,
+    }
+
+    def __init__(self):
+        self.histograms = {field: Histogram(bounds) for field, bounds in self.FIELDS.items()}
+        self.worst_duplicate = {'sql': '', 'count': 0}
+
+    def observe(self, request_metrics, latency_ms):
+        self.histograms['latency_ms'].observe(latency_ms)
+        self.histograms['db_ms'].observe(request_metrics.db_ms)
+        self.histograms['serializer_ms'].observe(request_metrics.serializer_ms)
+        self.histograms['queries'].observe(request_metrics.query_count)
+        self.histograms['duplicate_queries'].observe(request_metrics.duplicate_count)
+        self.histograms['connects'].observe(request_metrics.connects)
+        self.histograms['connect_ms'].observe(request_metrics.connect_ms)
+        self.histograms['pool_wait_ms'].observe(request_metrics.pool_wait_ms)
+        sql, count = request_metrics.most_repeated()
+        if count > self.worst_duplicate['count']:
+            self.worst_duplicate = {'sql': sql[:300], 'count': count}
+
+    def merge(self, other):
+        for field, histogram in other.histograms.items():
+            self.histograms[field].merge(histogram)
+        if other.worst_duplicate['count'] > self.worst_duplicate['count']:
+            self.worst_duplicate = dict(other.worst_duplicate)
+
+    def to_dict(self):
+        data = {field: histogram.to_dict() for field, histogram in self.histograms.items()}
+        data['worst_duplicate'] = self.worst_duplicate
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls()
+        for field in cls.FIELDS:
+            if field in data:
+                metrics.histograms[field] = Histogram.from_dict(data[field])
+        metrics.worst_duplicate = data.get('worst_duplicate', metrics.worst_duplicate)
+        return metrics
+
+
+class RequestMetrics:
+    """
+    Query and timing counters for one request.
+
+    Called for every query by the execute wrapper that install_query_wrapper()
+    adds to each connection, so it sees every database alias without needing
+    DEBUG.
+    """
+    def __init__(self):
+        self.query_count = 0
+        self.db_ms = 0.0
+        self.serializer_ms = 0.0
+        self.statements = Counter()
+        # New database connections opened for this request (0 when one was reused)
+        self.connects = 0
+        self.connect_ms = 0.0
+        self.pool_wait_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            self.query_count += 1
+            # sql still has its placeholders, so repeats of one statement with
+            # different parameters count as duplicates (the N+1 signature)
+            self.statements[sql] += 1
+
+    @property
+    def duplicate_count(self):
+        return self.query_count - len(self.statements)
+
+    def most_repeated(self):
+        if not self.statements:
+            return '', 0
+        sql, count = self.statements.most_common(1)[0]
+        return (sql, count) if count > 1 else ('', 0)
+
+
+def current_request_metrics():
+    """Metrics of the request being handled, or None outside the middleware."""
+    return _current.get()
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    return request_metrics(execute, sql, params, many, context)
+
+
+def install_query_wrapper(connection):
+    """
+    Route a connection's queries through the current request's metrics.
+
+    Installed once per connection (from the connection_created signal)
+    rather than per request, because under ASGI queries run on executor
+    threads whose connections the middleware cannot reach.
+    """
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def activate(request_metrics):
+    return _current.set(request_metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+_timed_classes = {}
+
+
+def _timed_class(serializer_class):
+    """Subclass of a serializer class whose .data adds its time to the request metrics."""
+    timed = _timed_classes.get(serializer_class)
+    if timed is None:
+        def data(self):
+            started = time.perf_counter()
+            try:
+                return super(timed, self).data
+            finally:
+                request_metrics = _current.get()
+                if request_metrics is not None:
+                    request_metrics.serializer_ms += (time.perf_counter() - started) * 1000
+
+        timed = type(f'Timed{serializer_class.__name__}', (serializer_class,),
+                     {'data': property(data), '_metrics_timed': True})
+        _timed_classes[serializer_class] = timed
+    return timed
+
+
+def timed_serializer(serializer):
+    """
+    Count the time spent producing serializer.data as serializer time.
+
+    Works for list serializers (many=True) as well; the instance's class is
+    swapped for a cached timing subclass, so behaviour is otherwise unchanged.
+    """
+    if not getattr(type(serializer), '_metrics_timed', False):
+        serializer.__class__ = _timed_class(type(serializer))
+    return serializer
+
+
+class PoolMetrics:
+    """Counters for one database alias's connections in one process."""
+    COUNTERS = ('checkouts', 'connects', 'reused', 'discarded', 'timeouts')
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.size = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.connect_ms = Histogram(CONNECT_BOUNDS_MS)
+        self.wait_ms = Histogram(CONNECT_BOUNDS_MS)
+
+    def merge(self, other):
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        self.size += other.size
+        self.in_use += other.in_use
+        self.peak_in_use += other.peak_in_use
+        self.connect_ms.merge(other.connect_ms)
+        self.wait_ms.merge(other.wait_ms)
+
+    def to_dict(self):
+        return dict(self.counters, size=self.size, in_use=self.in_use, peak_in_use=self.peak_in_use,
+                    connect_ms=self.connect_ms.to_dict(), wait_ms=self.wait_ms.to_dict())
+
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls()
+        metrics.counters = {name: data.get(name, 0) for name in cls.COUNTERS}
+        metrics.size = data.get('size', 0)
+        metrics.in_use = data.get('in_use', 0)
+        metrics.peak_in_use = data.get('peak_in_use', 0)
+        metrics.connect_ms = Histogram.from_dict(data['connect_ms'])
+        metrics.wait_ms = Histogram.from_dict(data['wait_ms'])
+        return metrics
+
+
+class MetricsRegistry:
+    """Cumulative per-endpoint metrics for this process, flushed to a JSON file."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._pools = {}
+        self._last_flush = time.monotonic()
+
+    def pool(self, alias):
+        """PoolMetrics for a database alias; callers update it under their own lock."""
+        with self._lock:
+            metrics = self._pools.get(alias)
+            if metrics is None:
+                metrics = self._pools[alias] = PoolMetrics()
+            return metrics
+
+    def record(self, endpoint, request_metrics, latency_ms):
+        with self._lock:
+            metrics = self._endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self._endpoints[endpoint] = EndpointMetrics()
+            metrics.observe(request_metrics, latency_ms)
+        self.flush_if_due()
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: metrics.to_dict() for endpoint, metrics in self._endpoints.items()}
+
+    def pool_snapshot(self):
+        with self._lock:
+            return {alias: metrics.to_dict() for alias, metrics in self._pools.items()}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def flush_if_due(self):
+        interval = getattr(settings, 'METRICS_FLUSH_SECONDS', 10)
+        if time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's metrics atomically to METRICS_DIR/metrics-<pid>.json."""
+        self._last_flush = time.monotonic()
+        directory = metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as stream:
+            json.dump({'pid': os.getpid(), 'written_at': time.time(), 'endpoints': self.snapshot(),
+                       'pools': self.pool_snapshot()}, stream)
+        os.replace(temporary, path)
+
+
+registry = MetricsRegistry()
+
+
+def metrics_dir():
+    return str(getattr(settings, 'METRICS_DIR', os.path.join(settings.BASE_DIR, 'metrics')))
+
+
+def _metrics_files(directory):
+    """Parsed contents of every process's metrics file."""
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as stream:
+                yield json.load(stream)
+        except (OSError, ValueError):
+            continue
+
+
+def _merge_files(directory, key, metrics_class):
+    merged = {}
+    for data in _metrics_files(directory or metrics_dir()):
+        for name, values in data.get(key, {}).items():
+            metrics = metrics_class.from_dict(values)
+            if name in merged:
+                merged[name].merge(metrics)
+            else:
+                merged[name] = metrics
+    return merged
+
+
+def load_metrics(directory=None):
+    """
+    Merge every process's metrics file.
+
+    Returns:
+        dict: {endpoint: EndpointMetrics}
+    """
+    return _merge_files(directory, 'endpoints', EndpointMetrics)
+
+
+def load_pool_metrics(directory=None):
+    """
+    Merge every process's connection pool counters.
+
+    Sizes and in-use gauges are summed, so they describe all processes together.
+
+    Returns:
+        dict: {database alias: PoolMetrics}
+    """
+    return _merge_files(directory, 'pools', PoolMetrics)
@@ -0,0 +1,176 @@
+"""
+Middleware
+QueryMetricsMiddleware records latency, query counts, duplicate queries,
+database time and serializer time for every request, per endpoint.
+ReplicaRoutingMiddleware tracks which database each request may read from.
+
+Both run natively under WSGI and ASGI, so async views are not pushed
+through a thread by a synchronous middleware.
+"""
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from . import db_routers, metrics_utils
+
+
+def endpoint_name(request):
+    """'<METHOD> <view name>' for a resolved request, e.g. 'GET api-product-list'."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return f'{request.method} <unresolved>'
+    return f'{request.method} {match.view_name or match._func_path}'
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively in sync and async stacks.
+
+    Subclasses define handle(request) for the sync stack and an async
+    __acall__(request) for the async one; __call__ picks the one matching
+    get_response.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class QueryMetricsMiddleware(HybridMiddleware):
+    """
+    Measure each request and add it to the process's metrics registry.
+
+    Queries are counted by the per-connection wrapper from
+    metrics_utils.install_query_wrapper. With METRICS_SERVER_TIMING enabled
+    the measurements are also returned in a Server-Timing header, which
+    browser dev tools display per request.
+
+    Streaming responses (the exports) run most of their queries while the
+    content is sent, after this middleware has returned. Their content is
+    wrapped so those queries are counted too, and the request is recorded
+    once the stream is exhausted or closed; they get no Server-Timing
+    header because their headers are sent first.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', settings.DEBUG)
+
+    def _start(self):
+        request_metrics = metrics_utils.RequestMetrics()
+        return request_metrics, metrics_utils.activate(request_metrics), time.perf_counter()
+
+    def _finish(self, request, response, request_metrics, started):
+        latency_ms = (time.perf_counter() - started) * 1000
+        metrics_utils.registry.record(endpoint_name(request), request_metrics, latency_ms)
+        if self.server_timing and response is not None:
+            response['Server-Timing'] = (
+                f'db;dur={request_metrics.db_ms:.1f};desc="{request_metrics.query_count} queries", '
+                f'serializer;dur={request_metrics.serializer_ms:.1f}, '
+                f'total;dur={latency_ms:.1f}'
+            )
+
+    def _complete(self, request, response, request_metrics, started):
+        """Record the request now, or once a streaming response's content has been sent."""
+        if response is not None and response.streaming:
+            response.streaming_content = self._measured_stream(request, response, request_metrics, started)
+        else:
+            self._finish(request, response, request_metrics, started)
+
+    def _measured_stream(self, request, response, request_metrics, started):
+        content = response.streaming_content
+
+        if response.is_async:
+            async def measured():
+                chunks = aiter(content)
+                try:
+                    while True:
+                        token = metrics_utils.activate(request_metrics)
+                        try:
+                            chunk = await anext(chunks)
+                        except StopAsyncIteration:
+                            return
+                        finally:
+                            metrics_utils.deactivate(token)
+                        yield chunk
+                finally:
+                    self._finish(request, None, request_metrics, started)
+            return measured()
+
+        def measured():
+            chunks = iter(content)
+            try:
+                while True:
+                    token = metrics_utils.activate(request_metrics)
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        return
+                    finally:
+                        metrics_utils.deactivate(token)
+                    yield chunk
+            finally:
+                # Runs when the content is exhausted or the response is closed early
+                self._finish(request, None, request_metrics, started)
+        return measured()
+
+    def handle(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+        request_metrics, token, started = self._start()
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics_utils.deactivate(token)
+            self._complete(request, response, request_metrics, started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        request_metrics, token, started = self._start()
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics_utils.deactivate(token)
+            self._complete(request, response, request_metrics, started)
+        return response
+
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    """
+    Give each request a database routing state (see db_routers).
+
+    A request that wrote a catalog model sets a cookie that keeps the client
+    on the primary for REPLICA_STICKY_SECONDS, so its next pages read its
+    own writes even if the replicas lag behind.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.cookie_name = getattr(settings, 'REPLICA_PIN_COOKIE', 'pin_primary')
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+    def _pin_after_write(self, state, response):
+        if state.wrote and self.sticky_seconds:
+            response.set_cookie(self.cookie_name, '1', max_age=self.sticky_seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def handle(self, request):
+        with db_routers.routing_request(pinned=self.cookie_name in request.COOKIES) as state:
+            response = self.get_response(request)
+        return self._pin_after_write(state, response)
+
+    async def __acall__(self, request):
+        with db_routers.routing_request(pinned=self.cookie_name in request.COOKIES) as state:
+            response = await self.get_response(request)
+        return self._pin_after_write(state, response)
@@ -0,0 +1,35 @@
+# FULLTEXT indexes for MySQLFullTextBackend (search_utils). Skipped on other databases.
+
+from django.db import migrations
+
+
+FULLTEXT_INDEXES = [
+    ('Supadupastore_product', 'product_fulltext_idx', ['name', 'description']),
+    ('Supadupastore_review', 'review_fulltext_idx', ['comment']),
+]
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name, columns in FULLTEXT_INDEXES:
+        column_list = ', '.join(f'`{column}`' for column in columns)
+        schema_editor.execute(f'ALTER TABLE `{table}` ADD FULLTEXT INDEX `{name}` ({column_list})')
+
+
+def remove_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(f'ALTER TABLE `{table}` DROP INDEX `{name}`')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Supadupastore', '0005_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_indexes, remove_fulltext_indexes),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.27 on 2026-10-17 12:11
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    # Same computation as rating_utils.rebuild_rating_aggregates, on historical models
+    Product = apps.get_model('Supadupastore', 'Product')
+    Review = apps.get_model('Supadupastore', 'Review')
+    histogram = {
+        f'rating_{rating}_count': Count('id', filter=Q(rating=rating))
+        for rating in range(1, 6)
+    }
+    rows = (
+        Review.objects.values('product_id')
+        .annotate(
+            review_count=Count('id'),
+            rating_sum=Sum('rating'),
+            verified_review_count=Count('id', filter=Q(is_verified=True)),
+            **histogram
+        )
+        .order_by('product_id')
+    )
+    fields = ['review_count', 'rating_sum', 'verified_review_count', 'average_rating'] + list(histogram)
+    batch = []
+    for row in rows.iterator(chunk_size=1000):
+        product = Product(id=row.pop('product_id'), **row)
+        product.average_rating = (Decimal(product.rating_sum) / product.review_count).quantize(Decimal('0.01'))
+        batch.append(product)
+        if len(batch) >= 1000:
+            Product.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Supadupastore', '0006_fulltext_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='verified_review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['average_rating'], name='product_avg_rating_idx'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.27 on 2026-10-17 12:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_purchase_ledger(apps, schema_editor):
+    # Same as the backfill_purchase_ledger command, on historical models
+    OrderItem = apps.get_model('Supadupastore', 'OrderItem')
+    PurchaseRecord = apps.get_model('Supadupastore', 'PurchaseRecord')
+    pairs = (
+        OrderItem.objects.values_list('order__user_id', 'product_id')
+        .order_by('order__user_id', 'product_id')
+        .distinct()
+    )
+    batch = []
+    for user_id, product_id in pairs.iterator(chunk_size=2000):
+        batch.append(PurchaseRecord(user_id=user_id, product_id=product_id))
+        if len(batch) >= 2000:
+            PurchaseRecord.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        PurchaseRecord.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Supadupastore', '0007_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_purchased_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Supadupastore.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='purchaserecord',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='purchase_user_product_uniq'),
+        ),
+        migrations.RunPython(backfill_purchase_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.27 on 2026-10-17 13:07
+# Copies of the store and product names for the search indexes. MySQL FULLTEXT
+# indexes cannot span a join, so the indexes from 0006 are recreated over the
+# new columns; this makes MySQLFullTextBackend match store and product names
+# like InProcessSearchBackend does.
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+OLD_FULLTEXT_INDEXES = [
+    ('Supadupastore_product', 'product_fulltext_idx', ['name', 'description']),
+    ('Supadupastore_review', 'review_fulltext_idx', ['comment']),
+]
+NEW_FULLTEXT_INDEXES = [
+    ('Supadupastore_product', 'product_fulltext_idx', ['name', 'store_name', 'description']),
+    ('Supadupastore_review', 'review_fulltext_idx', ['product_name', 'comment']),
+]
+
+
+def backfill_names(apps, schema_editor):
+    Product = apps.get_model('Supadupastore', 'Product')
+    Review = apps.get_model('Supadupastore', 'Review')
+    Store = apps.get_model('Supadupastore', 'Store')
+    Product.objects.filter(store__isnull=False).update(
+        store_name=Subquery(Store.objects.filter(pk=OuterRef('store_id')).values('name')[:1])
+    )
+    Review.objects.update(
+        product_name=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('name')[:1])
+    )
+
+
+def _replace_fulltext_indexes(schema_editor, old, new):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name, columns in old:
+        schema_editor.execute(f'ALTER TABLE `{table}` DROP INDEX `{name}`')
+    for table, name, columns in new:
+        column_list = ', '.join(f'`{column}`' for column in columns)
+        schema_editor.execute(f'ALTER TABLE `{table}` ADD FULLTEXT INDEX `{name}` ({column_list})')
+
+
+def widen_fulltext_indexes(apps, schema_editor):
+    _replace_fulltext_indexes(schema_editor, OLD_FULLTEXT_INDEXES, NEW_FULLTEXT_INDEXES)
+
+
+def narrow_fulltext_indexes(apps, schema_editor):
+    _replace_fulltext_indexes(schema_editor, NEW_FULLTEXT_INDEXES, OLD_FULLTEXT_INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Supadupastore', '0011_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='store_name',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='product_name',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(backfill_names, migrations.RunPython.noop),
+        migrations.RunPython(widen_fulltext_indexes, narrow_fulltext_indexes),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.27 on 2026-10-17 13:10
+
+# Existing ratings outside 1-5 would block the constraint, so they are clamped
+# first and their contribution to the product rating aggregates moved with them.
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F, Q
+
+
+def clamp_ratings(apps, schema_editor):
+    Product = apps.get_model('Supadupastore', 'Product')
+    Review = apps.get_model('Supadupastore', 'Review')
+    product_ids = set()
+    for review in Review.objects.filter(Q(rating__lt=1) | Q(rating__gt=5)).iterator():
+        rating = min(max(review.rating, 1), 5)
+        Product.objects.filter(id=review.product_id).update(**{
+            'rating_sum': F('rating_sum') + (rating - review.rating),
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + 1,
+        })
+        Review.objects.filter(id=review.id).update(rating=rating)
+        product_ids.add(review.product_id)
+    for product in Product.objects.filter(id__in=product_ids, review_count__gt=0):
+        product.average_rating = (Decimal(product.rating_sum) / product.review_count).quantize(Decimal('0.01'))
+        product.save(update_fields=['average_rating'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Supadupastore', '0012_search_name_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(clamp_ratings, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.IntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.CheckConstraint(check=models.Q(('rating__gte', 1), ('rating__lte', 5)), name='review_rating_range'),
+        ),
+    ]
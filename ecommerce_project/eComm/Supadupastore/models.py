@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
 
 # Create your models here.
 
@@ -23,9 +25,66 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Review aggregates, maintained by rating_utils whenever a Review changes
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    verified_review_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+
+    # Copy of store.name for the search indexes (a FULLTEXT index cannot span a join);
+    # set on save when the store changes and by the Store post_save signal on renames
+    store_name = models.CharField(max_length=100, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Name lookups in view_product_page, change_product_price and the cart
+            models.Index(fields=['name'], name='product_name_idx'),
+            # Ordering fields exposed by ProductViewSet
+            models.Index(fields=['created_at'], name='product_created_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+            models.Index(fields=['average_rating'], name='product_avg_rating_idx'),
+        ]
+
+    RATING_AGGREGATE_FIELDS = {
+        'review_count', 'rating_sum', 'verified_review_count', 'average_rating',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+    }
+
+    # store_id and name as last read from or written to the database
+    _loaded_store_id = None
+    _loaded_name = None
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_store_id = instance.__dict__.get('store_id')
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
+    def save(self, *args, **kwargs):
+        store_changed = self._state.adding or self.store_id != self._loaded_store_id
+        if store_changed:
+            self.store_name = self.store.name if self.store_id else ''
+        # Don't write back rating aggregates loaded earlier; reviews update them with F() expressions.
+        # Likewise store_name, which a concurrent store rename may have updated.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_AGGREGATE_FIELDS
+                and (store_changed or field.name != 'store_name')
+            ]
+        super().save(*args, **kwargs)
+        self._loaded_store_id = self.store_id
+        self._loaded_name = self.name
+
 #Creating category model for app 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -66,32 +125,134 @@ class OrderItem(models.Model):
 class Review(models.Model): 
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
-    rating = models.IntegerField()
+    rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField()
     is_verified = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Copy of product.name for the search indexes, kept up to date like Product.store_name
+    product_name = models.CharField(max_length=100, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Existing-review lookup in add_review
+            models.Index(fields=['user', 'product'], name='review_user_product_idx'),
+            # Newest-first review list in product_detail
+            models.Index(fields=['product', '-created_at'], name='review_product_created_idx'),
+        ]
+        constraints = [
+            # The rating aggregates on Product only have a histogram bucket for 1-5
+            models.CheckConstraint(check=models.Q(rating__gte=1, rating__lte=5), name='review_rating_range'),
+        ]
+
+    # (product_id, user_id, rating, is_verified) as last read from or written to the database
+    _loaded_state = None
 
     def __str__(self):
         return f"Review for {self.product.name} by {self.user.username}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_state()
+        return instance
+
+    def _remember_state(self):
+        fields = self.__dict__
+        self._loaded_state = (
+            fields.get('product_id'), fields.get('user_id'),
+            fields.get('rating'), fields.get('is_verified'),
+        )
     
     def save(self, *args, **kwargs):
-        # Check if user has purchased this product
-        has_purchased = OrderItem.objects.filter(
-            order__user=self.user,
-            product=self.product
-        ).exists()
-        self.is_verified = has_purchased
-        super().save(*args, **kwargs)
+        # Check if user has purchased this product, unless the reviewer and product are unchanged
+        loaded = self._loaded_state
+        if loaded is None or loaded[:2] != (self.product_id, self.user_id):
+            self.is_verified = PurchaseRecord.objects.filter(
+                user_id=self.user_id,
+                product_id=self.product_id
+            ).exists()
+        if loaded is None or loaded[0] != self.product_id:
+            self.product_name = self.product.name
+        elif kwargs.get('update_fields') is None and not self._state.adding:
+            # Don't write back a product_name that a concurrent product rename may have updated
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'product_name'
+            ]
+        # Keep the review and the product rating aggregates (updated by signals) in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._remember_state()
 
 #Creating a model for product images
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='product_images/')
     alt_text = models.CharField(max_length=255, blank=True, null=True)
+    # Resized copies written next to the original by image_utils:
+    # {'source': image name, 'widths': [...], '<format>': {'<width>': storage name}}
+    derivatives = models.JSONField(default=dict, blank=True)
+
+    # Image name as last read from or written to the database
+    _loaded_image = None
 
     def __str__(self):
         return f"Image for {self.product.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name
+
+    @property
+    def image_changed(self):
+        """True if the saved file differs from the one loaded (or the image is new)."""
+        return self._loaded_image != self.image.name
+
+    def derivative_name(self, image_format, width):
+        """
+        Storage name of the narrowest derivative at least `width` wide.
+
+        Falls back to the widest one, and to None until derivatives exist
+        for the current file.
+        """
+        if self.derivatives.get('source') != self.image.name:
+            return None
+        names = sorted((int(w), name) for w, name in self.derivatives.get(image_format, {}).items())
+        for derivative_width, name in names:
+            if derivative_width >= width:
+                return name
+        return names[-1][1] if names else None
+
+    def derivative_urls(self, image_format):
+        """[(width, url)] of the derivatives in one format, narrowest first."""
+        if self.derivatives.get('source') != self.image.name:
+            return []
+        storage = self.image.storage
+        return sorted((int(w), storage.url(name)) for w, name in self.derivatives.get(image_format, {}).items())
+
+    def srcset(self, image_format):
+        return ', '.join(f'{url} {width}w' for width, url in self.derivative_urls(image_format))
+
+    @property
+    def webp_srcset(self):
+        return self.srcset('webp')
+
+    @property
+    def jpeg_srcset(self):
+        return self.srcset('jpeg')
+
+    @property
+    def display_url(self):
+        """URL for a plain <img src>: a JPEG derivative, or the original until one exists."""
+        name = self.derivative_name('jpeg', getattr(settings, 'IMAGE_DISPLAY_WIDTH', 640))
+        return self.image.storage.url(name) if name else self.image.url
+
 #Creating a model for product tags
 class Tag(models.Model):
     name = models.CharField(max_length=50)
@@ -116,9 +277,167 @@ class ProductTag(models.Model):
 
 class ResetToken(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    token = models.CharField(max_length=500)
+    token = models.CharField(max_length=500, unique=True)
     expiry_date = models.DateTimeField()
     used = models.BooleanField(default=False)
     def __str__(self):
         return f"Reset token for {self.user.username}"
 
+
+#Creating an outbox for store/product announcements so tweets are posted off the request path
+class TweetOutbox(models.Model):
+    KIND_STORE = 'store'
+    KIND_PRODUCT = 'product'
+    KIND_CHOICES = [
+        (KIND_STORE, 'Store'),
+        (KIND_PRODUCT, 'Product'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='tweetoutbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Tweet for {self.kind} #{self.object_id} ({self.status})"
+
+#Creating an outbox for transactional email so messages are sent off the request path
+class EmailOutbox(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='emailoutbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Email '{self.subject}' to {', '.join(self.to)} ({self.status})"
+
+#Creating a purchase ledger so review verification is a single indexed lookup
+class PurchaseRecord(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    first_purchased_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='purchase_user_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} purchased {self.product.name}"
+
+#Creating a server-side cart so cart edits are single-row writes instead of session rewrites
+class Cart(models.Model):
+    # Anonymous carts have no user; the session only holds their id
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                null=True, blank=True, related_name='cart')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Pruning abandoned anonymous carts
+            models.Index(fields=['updated_at'], name='cart_updated_idx'),
+        ]
+
+    def __str__(self):
+        owner = self.user.username if self.user_id else 'anonymous'
+        return f"Cart #{self.id} ({owner})"
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_cart_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product.name} in Cart #{self.cart_id}"
+
+#Creating API tokens for clients that cannot keep a session; only a hash of the key is stored
+class ApiToken(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True, default='')
+    # First characters of the key, so users can tell their tokens apart
+    key_prefix = models.CharField(max_length=8)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    revoked_at = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def is_active(self):
+        return self.revoked_at is None and self.expires_at > timezone.now()
+
+    def __str__(self):
+        return f"Token {self.key_prefix}... for {self.user.username}"
+
+#Creating an outbox for image derivatives so uploads are resized off the request path
+class ImageDerivativeOutbox(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    image = models.ForeignKey(ProductImage, on_delete=models.CASCADE, related_name='derivative_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='imageoutbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Derivatives for image #{self.image_id} ({self.status})"
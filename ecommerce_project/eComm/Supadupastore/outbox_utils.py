@@ -0,0 +1,86 @@
+"""
+Outbox Utilities
+Leasing and retry logic shared by the outbox workers (tweets, email, image
+derivatives).
+
+An outbox model has status, attempts, next_attempt_at and last_error fields
+and STATUS_PENDING / STATUS_FAILED constants. Its worker settings share a
+prefix: <PREFIX>_LEASE_SECONDS, <PREFIX>_MAX_ATTEMPTS and
+<PREFIX>_RETRY_SECONDS, e.g. TWEET_OUTBOX_LEASE_SECONDS.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+def outbox_setting(prefix, name, default):
+    """Read <prefix>_<name> from settings."""
+    return getattr(settings, f'{prefix}_{name}', default)
+
+
+def claim_batch(model, batch_size, prefix):
+    """
+    Lease a batch of due outbox entries.
+
+    Entries are locked with SKIP LOCKED and pushed past the lease window so
+    that several workers can drain the outbox without handling an entry twice.
+
+    Args:
+        model: Outbox model class
+        batch_size: Maximum number of entries to claim
+        prefix: Settings prefix, e.g. 'TWEET_OUTBOX'
+
+    Returns:
+        list: The claimed entries, oldest due first
+    """
+    now = timezone.now()
+    lease_seconds = outbox_setting(prefix, 'LEASE_SECONDS', 300)
+    with transaction.atomic():
+        entries = list(
+            model.objects.select_for_update(skip_locked=True)
+            .filter(status=model.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if entries:
+            model.objects.filter(id__in=[entry.id for entry in entries]).update(
+                next_attempt_at=now + timedelta(seconds=lease_seconds)
+            )
+    return entries
+
+
+def schedule_retry(entry, error, prefix):
+    """
+    Record a failed attempt and back off exponentially, giving up after the max attempts.
+
+    Returns:
+        bool: True if the entry will be retried, False if it is now failed
+    """
+    max_attempts = outbox_setting(prefix, 'MAX_ATTEMPTS', 5)
+    retry_seconds = outbox_setting(prefix, 'RETRY_SECONDS', 60)
+
+    entry.attempts += 1
+    entry.last_error = str(error)
+    if entry.attempts >= max_attempts:
+        entry.status = entry.STATUS_FAILED
+    else:
+        entry.next_attempt_at = timezone.now() + timedelta(
+            seconds=retry_seconds * 2 ** (entry.attempts - 1)
+        )
+    entry.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+    return entry.status != entry.STATUS_FAILED
+
+
+def mark_complete(entry, status, timestamp_field, **changes):
+    """
+    Record a successful attempt, e.g. mark_complete(entry, entry.STATUS_SENT, 'sent_at').
+
+    Extra keyword arguments are field values saved in the same UPDATE, e.g.
+    body='' to drop content that is no longer needed.
+    """
+    entry.status = status
+    entry.attempts += 1
+    setattr(entry, timestamp_field, timezone.now())
+    for field, value in changes.items():
+        setattr(entry, field, value)
+    entry.save(update_fields=['status', 'attempts', timestamp_field, *changes])
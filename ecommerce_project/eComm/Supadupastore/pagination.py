@@ -0,0 +1,239 @@
+"""
+Pagination Utilities
+Keyset (cursor) pagination for the API and the HTML product listings.
+
+Both page by a (created_at, id) or (<ordering field>, id) position instead of
+an OFFSET, so a deep page costs the same single indexed range scan as the first.
+"""
+import base64
+import json
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+def _reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def _after_position(ordering, values):
+    """
+    Filter for the rows that follow a position in a multi-column ordering.
+
+    (a, -b, id) after (1, 2, 3) is a > 1 OR (a = 1 AND b < 2) OR
+    (a = 1 AND b = 2 AND id > 3).
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        condition |= equal & Q(**{f"{name}__{'lt' if field.startswith('-') else 'gt'}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Cursor pagination for the catalog viewsets.
+    
+    Defaults to newest first; an ?ordering= value accepted by the view's
+    OrderingFilter (e.g. price, -created_at) is used as the cursor position,
+    with id appended as a tie-breaker. DRF's CursorPagination positions on
+    the first ordering field alone and skips rows sharing its value with an
+    offset; here the cursor carries the value of every ordering field, so
+    each page is a true keyset range however many rows share a price or
+    rating. Searches without an explicit ordering page by the search_rank
+    annotation.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # Search results page by relevance unless the client asked for an ordering
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get('ordering'):
+            return ('-search_rank', '-id')
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            tie_breaker = '-id' if ordering[0].startswith('-') else 'id'
+            ordering = ordering + (tie_breaker,)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        current_position = self.cursor.position if self.cursor else None
+
+        # A reverse cursor walks back from its position, so the page is read in reverse order
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = queryset.filter(_after_position(ordering, self._decode_position(current_position)))
+
+        # Fetch one extra row to learn whether another page follows
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+
+        # Positions are unique (id is always part of the ordering), so links
+        # never need the offset DRF uses to step over duplicate positions
+        has_position_before = current_position is not None
+        self.has_next = has_position_before if reverse else has_following
+        self.has_previous = has_following if reverse else has_position_before
+        if self.has_next:
+            self.next_position = current_position if reverse else self._position_of(results[-1])
+        if self.has_previous:
+            self.previous_position = self._position_of(results[-1]) if reverse else current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        # Set by FullTextSearchFilter when the search backend capped the matches
+        if getattr(self.request, 'search_truncated', False):
+            response.data['search_truncated'] = True
+        return response
+
+    def _position_of(self, instance):
+        return self._get_position_from_instance(instance, self.ordering)
+
+    def _get_position_from_instance(self, instance, ordering):
+        # {'-price': '9.99', '-id': '42'}; keeping the fields lets a cursor be checked against the ordering
+        position = {}
+        for field in ordering:
+            name = field.lstrip('-')
+            position[field] = str(instance[name] if isinstance(instance, dict) else getattr(instance, name))
+        return json.dumps(position)
+
+    def _decode_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, dict) or list(values) != list(self.ordering):
+            # Cursor from another ordering or an older cursor format
+            raise NotFound(self.invalid_cursor_message)
+        return list(values.values())
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset for template rendering."""
+    def __init__(self, object_list, next_cursor, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def is_first_page(self):
+        return not self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def _encode_cursor(obj, backward=False):
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    if backward:
+        raw += '|prev'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Return (created_at, pk, backward) from a cursor string, or None if it is invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, pk, *direction = raw.split('|')
+        if direction not in ([], ['prev']):
+            return None
+        return datetime.fromisoformat(created_at), int(pk), bool(direction)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_paginate(request, queryset, page_size=24, cursor_param='cursor'):
+    """
+    Return one newest-first page of queryset, positioned by ?cursor=.
+    
+    A cursor either continues after an object (next_cursor) or steps back
+    to the page before one (previous_cursor).
+    
+    Args:
+        request: Current HttpRequest
+        queryset: Queryset of a model with created_at and id fields
+        page_size: Number of objects per page
+        cursor_param: Query parameter carrying the position
+        
+    Returns:
+        KeysetPage: The page, with next_cursor / previous_cursor set when
+        more objects follow / precede it
+    """
+    queryset, position = _keyset_queryset(request, queryset, cursor_param)
+    # Fetch one extra row to learn whether there is another page without a COUNT
+    return _keyset_page(list(queryset[:page_size + 1]), page_size, position)
+
+
+async def akeyset_paginate(request, queryset, page_size=24, cursor_param='cursor'):
+    """Async form of keyset_paginate, evaluating the page with the async ORM."""
+    queryset, position = _keyset_queryset(request, queryset, cursor_param)
+    return _keyset_page([obj async for obj in queryset[:page_size + 1]], page_size, position)
+
+
+def _keyset_queryset(request, queryset, cursor_param):
+    position = _decode_cursor(request.GET.get(cursor_param, ''))
+    if position is None:
+        return queryset.order_by('-created_at', '-id'), None
+    created_at, pk, backward = position
+    if backward:
+        # Walk up from the position, oldest first; _keyset_page restores the order
+        return queryset.order_by('created_at', 'id').filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        ), position
+    return queryset.order_by('-created_at', '-id').filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+    ), position
+
+
+def _keyset_page(object_list, page_size, position):
+    has_more = len(object_list) > page_size
+    object_list = object_list[:page_size]
+    backward = position is not None and position[2]
+    if backward:
+        object_list.reverse()
+    if not object_list:
+        return KeysetPage(object_list, None)
+    if backward:
+        # Stepped back from a later page; more rows mean an earlier page exists
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, position is not None
+    return KeysetPage(
+        object_list,
+        _encode_cursor(object_list[-1]) if has_next else None,
+        _encode_cursor(object_list[0], backward=True) if has_previous else None,
+    )
@@ -1,4 +1,5 @@
 from rest_framework import permissions
+from .role_utils import is_vendor
 
 
 class IsVendor(permissions.BasePermission):
@@ -12,7 +13,7 @@ class IsVendor(permissions.BasePermission):
         
         # Write permissions only for vendors
         return request.user and request.user.is_authenticated and \
-               request.user.groups.filter(name='Vendors').exists()
+               is_vendor(request.user)
 
 
 class IsStoreOwner(permissions.BasePermission):
@@ -25,7 +26,8 @@ class IsStoreOwner(permissions.BasePermission):
             return True
         
         # Write permissions are only allowed to the owner of the store
-        return obj.owner == request.user
+        # (compare ids so the owner row is never loaded)
+        return obj.owner_id == request.user.pk
 
 
 class IsProductOwner(permissions.BasePermission):
@@ -38,4 +40,5 @@ class IsProductOwner(permissions.BasePermission):
             return True
         
         # Write permissions are only allowed to the owner of the store
-        return obj.store.owner == request.user
+        # (the viewset joins the store, and owner_id avoids loading the owner)
+        return obj.store_id is not None and obj.store.owner_id == request.user.pk
@@ -0,0 +1,243 @@
+"""
+Pool Utilities
+A bounded pool of database connections shared by all threads of a process.
+
+Django ties a connection to the thread that opened it. With CONN_MAX_AGE
+that gives reuse under a fixed set of worker threads, but under ASGI (and
+in thread pools that grow and shrink) connections are opened and torn down
+per request, or leak with their threads. The backends in db_backends return
+the raw connection to this pool when Django closes it at the end of a
+request, and the next request on any thread checks it out again.
+
+DB_POOL_SIZE caps the open connections per alias and process; a request
+that finds every connection in use waits up to DB_POOL_TIMEOUT seconds.
+Idle connections are recycled after DB_POOL_RECYCLE_SECONDS and, with
+CONN_HEALTH_CHECKS, pinged before reuse. Counters go to metrics_utils.
+"""
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db.utils import DatabaseError
+from . import metrics_utils
+
+
+# Guards the PoolMetrics counters shared with metrics_utils' flush
+_stats_lock = threading.Lock()
+
+
+class PoolExhausted(DatabaseError):
+    """No pooled connection became free within DB_POOL_TIMEOUT."""
+
+
+def _record_request(connects=0, connect_ms=0.0, wait_ms=0.0):
+    request_metrics = metrics_utils.current_request_metrics()
+    if request_metrics is not None:
+        request_metrics.connects += connects
+        request_metrics.connect_ms += connect_ms
+        request_metrics.pool_wait_ms += wait_ms
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def _healthy(connection):
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+def record_direct_connect(alias, connect_ms):
+    """Count a connection opened without the pool (DB_POOL_SIZE = 0)."""
+    metrics = metrics_utils.registry.pool(alias)
+    with _stats_lock:
+        metrics.counters['checkouts'] += 1
+        metrics.counters['connects'] += 1
+        metrics.connect_ms.observe(connect_ms)
+    _record_request(connects=1, connect_ms=connect_ms)
+
+
+class ConnectionPool:
+    """Idle raw connections for one alias plus a semaphore bounding the open ones."""
+    def __init__(self, alias, size, timeout, recycle_seconds, health_checks):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.recycle_seconds = recycle_seconds
+        self.health_checks = health_checks
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.metrics = metrics_utils.registry.pool(alias)
+        self.metrics.size = size
+
+    def checkout(self, connect):
+        """
+        Take an idle connection, or open one with connect() if none is usable.
+
+        Args:
+            connect: Callable returning a new raw DB-API connection
+
+        Returns:
+            tuple: (connection, opened_at) where opened_at is a monotonic time
+        """
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with _stats_lock:
+                self.metrics.counters['timeouts'] += 1
+            raise PoolExhausted(
+                f"No connection to '{self.alias}' became free within {self.timeout}s "
+                f"(DB_POOL_SIZE={self.size})"
+            )
+        wait_ms = (time.perf_counter() - started) * 1000
+        connect_ms = 0.0
+        try:
+            idle = self._take_idle()
+            if idle is not None:
+                connection, opened_at = idle
+            else:
+                connect_started = time.perf_counter()
+                connection = connect()
+                connect_ms = (time.perf_counter() - connect_started) * 1000
+                opened_at = time.monotonic()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with _stats_lock:
+            counters = self.metrics.counters
+            counters['checkouts'] += 1
+            if idle is None:
+                counters['connects'] += 1
+                self.metrics.connect_ms.observe(connect_ms)
+            else:
+                counters['reused'] += 1
+            self.metrics.wait_ms.observe(wait_ms)
+            self.metrics.in_use += 1
+            self.metrics.peak_in_use = max(self.metrics.peak_in_use, self.metrics.in_use)
+        _record_request(connects=1 if idle is None else 0, connect_ms=connect_ms, wait_ms=wait_ms)
+        return connection, opened_at
+
+    def _take_idle(self):
+        """Most recently returned usable idle connection, discarding stale ones."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                # LIFO: the hottest connection is the least likely to have timed out
+                connection, opened_at = self._idle.pop()
+            if (time.monotonic() - opened_at > self.recycle_seconds
+                    or (self.health_checks and not _healthy(connection))):
+                _close_quietly(connection)
+                with _stats_lock:
+                    self.metrics.counters['discarded'] += 1
+                continue
+            return connection, opened_at
+
+    def checkin(self, connection, opened_at, reusable=True):
+        """Return a checked-out connection; unusable ones are closed instead."""
+        try:
+            if reusable and time.monotonic() - opened_at <= self.recycle_seconds:
+                with self._lock:
+                    self._idle.append((connection, opened_at))
+            else:
+                _close_quietly(connection)
+                with _stats_lock:
+                    self.metrics.counters['discarded'] += 1
+        finally:
+            with _stats_lock:
+                self.metrics.in_use -= 1
+            self._slots.release()
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for connection, opened_at in idle:
+            _close_quietly(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    """
+    The process's pool for a database alias, or None when pooling is off.
+
+    Args:
+        alias: Database alias
+        settings_dict: The alias's DATABASES entry (for CONN_HEALTH_CHECKS)
+    """
+    size = getattr(settings, 'DB_POOL_SIZE', 0)
+    if size <= 0:
+        return None
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(
+                alias, size,
+                timeout=getattr(settings, 'DB_POOL_TIMEOUT', 10),
+                recycle_seconds=getattr(settings, 'DB_POOL_RECYCLE_SECONDS', 600),
+                health_checks=settings_dict.get('CONN_HEALTH_CHECKS', False),
+            )
+        return pool
+
+
+def reset_pools():
+    """Close idle connections and forget the pools, so settings changes take effect."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_idle()
+
+
+class PooledConnectionMixin:
+    """
+    DatabaseWrapper mixin that gets raw connections from the alias's pool.
+
+    Django's connect() still runs after checkout, so autocommit and session
+    state are reset on every reuse. Closing returns the connection to the
+    pool unless it is mid-transaction or failed its usability check.
+    """
+    _pool = None
+    _pool_opened_at = None
+
+    def _pool_enabled(self):
+        return True
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict) if self._pool_enabled() else None
+        if pool is None:
+            started = time.perf_counter()
+            connection = super().get_new_connection(conn_params)
+            record_direct_connect(self.alias, (time.perf_counter() - started) * 1000)
+            return connection
+        connection, self._pool_opened_at = pool.checkout(
+            lambda: super(PooledConnectionMixin, self).get_new_connection(conn_params)
+        )
+        self._pool = pool
+        return connection
+
+    def _close(self):
+        pool, self._pool = self._pool, None
+        if pool is None or self.connection is None:
+            return super()._close()
+        connection = self.connection
+        reusable = not self.in_atomic_block and (not self.errors_occurred or self.is_usable())
+        if reusable and not self.autocommit:
+            try:
+                connection.rollback()
+            except Exception:
+                reusable = False
+        pool.checkin(connection, self._pool_opened_at, reusable=reusable)
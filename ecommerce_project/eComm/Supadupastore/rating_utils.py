@@ -0,0 +1,136 @@
+"""
+Rating Utilities
+Maintains the denormalised review aggregates stored on Product.
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When
+from .cache_utils import invalidate_catalog, invalidate_products
+from .models import Product, Review
+
+RATING_VALUES = range(1, 6)
+
+AGGREGATE_FIELDS = sorted(Product.RATING_AGGREGATE_FIELDS)
+
+
+def _average_expression():
+    """SQL expression for rating_sum / review_count, or 0 with no reviews"""
+    return Case(
+        When(review_count=0, then=Value(0)),
+        default=ExpressionWrapper(
+            F('rating_sum') * Value(1.0) / F('review_count'),
+            output_field=DecimalField(max_digits=3, decimal_places=2)
+        ),
+        output_field=DecimalField(max_digits=3, decimal_places=2)
+    )
+
+
+def _review_counts(rating, is_verified, sign):
+    """Counter increments contributed by one review (sign=1) or removed (sign=-1)"""
+    counts = {'review_count': sign, 'rating_sum': sign * rating}
+    if is_verified:
+        counts['verified_review_count'] = sign
+    if rating in RATING_VALUES:
+        counts[f'rating_{rating}_count'] = sign
+    return counts
+
+
+def _apply_counts(product_id, counts):
+    """
+    Apply counter increments to one product and refresh its average.
+
+    Counters are changed with F() expressions so concurrent reviews of the
+    same product cannot lose updates; the average is recomputed from the
+    new counters in a second statement.
+    """
+    changes = {field: F(field) + amount for field, amount in counts.items() if amount}
+    if not changes:
+        return
+    with transaction.atomic():
+        Product.objects.filter(id=product_id).update(**changes)
+        Product.objects.filter(id=product_id).update(average_rating=_average_expression())
+
+
+def apply_review_delta(product_id, rating, is_verified, sign):
+    """Add (sign=1) or remove (sign=-1) one review's contribution to a product."""
+    _apply_counts(product_id, _review_counts(rating, is_verified, sign))
+
+
+def review_changed(old, new):
+    """
+    Move a review's contribution from its previous state to its new one.
+
+    Args:
+        old: (product_id, rating, is_verified) before the save, or None when created
+        new: (product_id, rating, is_verified) after the save
+    """
+    if old == new:
+        return
+    if old is not None and old[0] != new[0]:
+        apply_review_delta(*old, sign=-1)
+        old = None
+
+    counts = _review_counts(new[1], new[2], 1)
+    if old is not None:
+        # Same product: net the old and new contributions into one update
+        for field, amount in _review_counts(old[1], old[2], -1).items():
+            counts[field] = counts.get(field, 0) + amount
+    _apply_counts(new[0], counts)
+
+
+def rebuild_rating_aggregates(product_ids=None, batch_size=1000):
+    """
+    Recompute the aggregates from the Review table in bulk.
+
+    Args:
+        product_ids: Optional iterable limiting the rebuild to some products
+        batch_size: Number of products written per bulk_update
+
+    Returns:
+        int: Number of products that have at least one review
+    """
+    reviews = Review.objects.all()
+    products = Product.objects.all()
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        reviews = reviews.filter(product_id__in=product_ids)
+        products = products.filter(id__in=product_ids)
+
+    histogram = {
+        f'rating_{rating}_count': Count('id', filter=Q(rating=rating))
+        for rating in RATING_VALUES
+    }
+    rows = (
+        reviews.values('product_id')
+        .annotate(
+            review_count=Count('id'),
+            rating_sum=Sum('rating'),
+            verified_review_count=Count('id', filter=Q(is_verified=True)),
+            **histogram
+        )
+        .order_by('product_id')
+    )
+
+    with transaction.atomic():
+        # Reset everything in scope, then write the products that have reviews
+        products.update(**{field: 0 for field in AGGREGATE_FIELDS})
+
+        batch = []
+        reviewed = 0
+        for row in rows.iterator(chunk_size=batch_size):
+            product = Product(id=row.pop('product_id'), **row)
+            product.average_rating = (Decimal(product.rating_sum) / product.review_count).quantize(Decimal('0.01'))
+            batch.append(product)
+            reviewed += 1
+            if len(batch) >= batch_size:
+                Product.objects.bulk_update(batch, AGGREGATE_FIELDS)
+                batch = []
+        if batch:
+            Product.objects.bulk_update(batch, AGGREGATE_FIELDS)
+
+        if product_ids is None:
+            invalidate_catalog()
+        else:
+            invalidate_products(product_ids)
+
+    return reviewed
@@ -0,0 +1,98 @@
+"""
+Role Utilities
+Resolves a user's group-based roles (Vendors, Buyers) once and caches them.
+
+Roles are memoized on the user object for the rest of the request and kept in
+ROLE_CACHE_ALIAS under a versioned key. Changing a user's groups bumps that
+user's version; renaming or deleting a group bumps a global version. Either
+way stale entries are simply never read again.
+
+The bump only reaches other processes through a shared cache
+(Memcached/Redis). With a per-process cache, a user removed from Vendors
+would keep vendor access in the other workers until their entry expired,
+so roles are then read from the database once per request.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from .cache_utils import incr_version, is_shared_cache, read_versions
+
+VENDOR_ROLE = 'Vendors'
+BUYER_ROLE = 'Buyers'
+
+ROLE_CACHE_TIMEOUT = 60 * 60
+GLOBAL_VERSION_KEY = 'roles:version'
+
+
+def _user_version_key(user_id):
+    return f'roles:version:{user_id}'
+
+
+def _role_cache():
+    """The shared role cache, or None if ROLE_CACHE_ALIAS is per-process."""
+    cache = caches[getattr(settings, 'ROLE_CACHE_ALIAS', 'default')]
+    return cache if is_shared_cache(cache) else None
+
+
+def get_user_roles(user):
+    """
+    Return the names of the groups a user belongs to.
+    
+    Args:
+        user: User (or AnonymousUser) instance
+        
+    Returns:
+        frozenset: Group names; empty for anonymous users
+    """
+    if user is None or not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, '_cached_roles', None)
+    if roles is not None:
+        return roles
+
+    cache = _role_cache()
+    if cache is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+    else:
+        versions = read_versions(cache, [GLOBAL_VERSION_KEY, _user_version_key(user.pk)])
+        global_version = versions.get(GLOBAL_VERSION_KEY, 0)
+        user_version = versions.get(_user_version_key(user.pk), 0)
+        roles_key = f'roles:{user.pk}:{global_version}:{user_version}'
+
+        roles = cache.get(roles_key)
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            cache.set(roles_key, roles, ROLE_CACHE_TIMEOUT)
+
+    user._cached_roles = roles
+    return roles
+
+
+def has_role(user, role):
+    """Return True if the user belongs to the named group."""
+    return role in get_user_roles(user)
+
+
+def is_vendor(user):
+    return has_role(user, VENDOR_ROLE)
+
+
+def is_buyer(user):
+    return has_role(user, BUYER_ROLE)
+
+
+def _bump(key):
+    cache = _role_cache()
+    if cache is not None:
+        incr_version(cache, key)
+
+
+def invalidate_user_roles(user_ids):
+    """Invalidate cached roles for the given users."""
+    for user_id in user_ids:
+        _bump(_user_version_key(user_id))
+
+
+def invalidate_all_roles():
+    """Invalidate cached roles for every user."""
+    _bump(GLOBAL_VERSION_KEY)
@@ -0,0 +1,390 @@
+"""
+Search Utilities
+Ranked full-text search for products and reviews behind the API `search` parameter.
+
+Two backends are provided and selected with the SEARCH_BACKEND setting:
+- MySQLFullTextBackend (the default): MATCH ... AGAINST over the FULLTEXT
+  indexes added in migrations 0006 and 0012, maintained by MySQL itself
+- InProcessSearchBackend: an inverted index held in memory by each process,
+  for SQLite and development; see its docstring for how copies stay current
+
+Both search the same columns. The store and product names are searched
+through the Product.store_name and Review.product_name copies, because a
+FULLTEXT index cannot span a join.
+"""
+import bisect
+import logging
+import re
+import threading
+from collections import defaultdict
+from functools import reduce
+from operator import and_, or_
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+from .cache_utils import bump_version, get_versions
+from .models import Product, Review
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Searchable documents: model, (field, weight) pairs for the in-process index,
+# and the columns covered by the MySQL FULLTEXT index
+SEARCH_DOCUMENTS = {
+    'product': {
+        'model': Product,
+        'fields': [('name', 3), ('store_name', 2), ('description', 1)],
+        'fulltext_columns': ['name', 'store_name', 'description'],
+    },
+    'review': {
+        'model': Review,
+        'fields': [('product_name', 2), ('comment', 1)],
+        'fulltext_columns': ['product_name', 'comment'],
+    },
+}
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def search_scope(doc_type):
+    """Cache version scope of one document type's in-process indexes."""
+    return f'search:{doc_type}'
+
+
+def rank_by_ids(queryset, ranked):
+    """
+    Restrict a queryset to ranked (id, score) pairs and annotate search_rank.
+
+    The rank is an integer, higher for earlier pairs, so rows sort in the
+    order the backend returned them.
+    """
+    if not ranked:
+        return queryset.none()
+    total = len(ranked)
+    rank = Case(
+        *[When(id=doc_id, then=Value(total - position)) for position, (doc_id, score) in enumerate(ranked)],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return queryset.filter(id__in=[doc_id for doc_id, score in ranked]).annotate(search_rank=rank)
+
+
+class InvertedIndex:
+    """
+    Term -> {document id: weight} index for one document type.
+
+    Terms are also kept in a sorted list so the last query word can be
+    matched as a prefix with a bisect instead of a scan.
+    """
+    def __init__(self, fields):
+        self.fields = fields
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.sorted_terms = []
+
+    def _weights(self, values):
+        weights = defaultdict(int)
+        for (field, weight), value in zip(self.fields, values):
+            for token in tokenize(value):
+                weights[token] += weight
+        return weights
+
+    def add(self, doc_id, values):
+        """Index (or re-index) one document from its field values."""
+        self.remove(doc_id)
+        weights = self._weights(values)
+        for term, weight in weights.items():
+            if term not in self.postings:
+                bisect.insort(self.sorted_terms, term)
+            self.postings[term][doc_id] = weight
+        self.doc_terms[doc_id] = list(weights)
+
+    def remove(self, doc_id):
+        """Drop one document from the index."""
+        for term in self.doc_terms.pop(doc_id, []):
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+                position = bisect.bisect_left(self.sorted_terms, term)
+                if position < len(self.sorted_terms) and self.sorted_terms[position] == term:
+                    del self.sorted_terms[position]
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self.sorted_terms, prefix)
+        end = bisect.bisect_left(self.sorted_terms, prefix + '\uffff')
+        return self.sorted_terms[start:end]
+
+    def search(self, query, limit):
+        """
+        Return up to limit (doc_id, score) pairs matching every query word.
+
+        The last word also matches as a prefix, so partially typed queries work.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        scores = None
+        for index, term in enumerate(terms):
+            matches = defaultdict(int)
+            candidates = self._prefix_matches(term) if index == len(terms) - 1 else [term]
+            for candidate in candidates:
+                # Exact matches outrank prefix matches
+                boost = 2 if candidate == term else 1
+                for doc_id, weight in self.postings.get(candidate, {}).items():
+                    matches[doc_id] = max(matches[doc_id], weight * boost)
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {doc_id: score + matches[doc_id]
+                          for doc_id, score in scores.items() if doc_id in matches}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:limit]
+
+
+class InProcessSearchBackend:
+    """
+    Search backend holding one InvertedIndex per document type in memory.
+
+    Every process has its own copy, built from the database and updated
+    incrementally through update()/remove() from the model signals. Each
+    change also bumps the document type's version in the shared catalog
+    cache (cache_utils), and a copy built at an older version is rebuilt, so
+    a worker never keeps serving an index another worker has changed.
+    Versions are only shared if CATALOG_CACHE_ALIAS is a shared backend.
+
+    Rebuilds read the whole table, so with SEARCH_INDEX_BACKGROUND_BUILD
+    they run in a background thread: searches keep using the previous copy,
+    or a plain database query until the first copy is ready. No lock is held
+    while the database is read.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # doc_type -> (versions the copy was built at, InvertedIndex)
+        self._indexes = {}
+        self._building = set()
+
+    def _read_rows(self, doc_type, doc_ids=None):
+        document = SEARCH_DOCUMENTS[doc_type]
+        field_names = [field for field, weight in document['fields']]
+        rows = document['model'].objects.all()
+        if doc_ids is not None:
+            rows = rows.filter(id__in=doc_ids)
+        return rows.values_list('id', *field_names)
+
+    def _build(self, doc_type, versions, background):
+        try:
+            index = InvertedIndex(SEARCH_DOCUMENTS[doc_type]['fields'])
+            for row in self._read_rows(doc_type).iterator(chunk_size=2000):
+                index.add(row[0], row[1:])
+            with self._lock:
+                self._indexes[doc_type] = (versions, index)
+            logger.info(f"Built in-process search index for {doc_type} ({len(index.doc_terms)} documents)")
+        except Exception:
+            logger.exception(f"Error building in-process search index for {doc_type}")
+        finally:
+            with self._lock:
+                self._building.discard(doc_type)
+            if background:
+                connections.close_all()
+
+    def _get_index(self, doc_type):
+        """Return a copy of the index to search, or None while the first one is built."""
+        versions = get_versions([search_scope(doc_type)])
+        with self._lock:
+            built = self._indexes.get(doc_type)
+            if built is not None and built[0] == versions:
+                return built[1]
+            if doc_type in self._building:
+                return built and built[1]
+            self._building.add(doc_type)
+
+        if getattr(settings, 'SEARCH_INDEX_BACKGROUND_BUILD', True):
+            threading.Thread(target=self._build, args=(doc_type, versions, True),
+                             name=f'search-index-{doc_type}', daemon=True).start()
+            return built and built[1]
+        self._build(doc_type, versions, False)
+        with self._lock:
+            built = self._indexes.get(doc_type)
+        return built and built[1]
+
+    def search(self, doc_type, query, limit):
+        index = self._get_index(doc_type)
+        if index is None:
+            return database_search(doc_type, query, limit)
+        with self._lock:
+            return index.search(query, limit)
+
+    def rank_queryset(self, doc_type, queryset, query, limit):
+        """Return (queryset restricted to matches and annotated with search_rank, truncated)."""
+        ranked = self.search(doc_type, query, limit + 1)
+        return rank_by_ids(queryset, ranked[:limit]), len(ranked) > limit
+
+    def _changed(self, doc_type):
+        """
+        Bump the shared version for a change this process has applied to its copy.
+
+        The copy stays current only if no other process changed the index
+        since it was built; otherwise it is left at its old version and
+        rebuilt on the next search.
+        """
+        version = bump_version(search_scope(doc_type))
+        built = self._indexes.get(doc_type)
+        if built is not None and built[0][-1] + 1 == version:
+            self._indexes[doc_type] = (built[0][:-1] + (version,), built[1])
+
+    def update(self, doc_type, doc_ids):
+        """Re-index the given documents from the database."""
+        doc_ids = list(doc_ids)
+        rows = list(self._read_rows(doc_type, doc_ids)) if doc_type in self._indexes else []
+        with self._lock:
+            index = self._indexes.get(doc_type, (None, None))[1]
+            if index is not None:
+                found = set()
+                for row in rows:
+                    index.add(row[0], row[1:])
+                    found.add(row[0])
+                for doc_id in set(doc_ids) - found:
+                    index.remove(doc_id)
+            self._changed(doc_type)
+
+    def remove(self, doc_type, doc_ids):
+        """Drop the given documents from the index."""
+        with self._lock:
+            index = self._indexes.get(doc_type, (None, None))[1]
+            if index is not None:
+                for doc_id in doc_ids:
+                    index.remove(doc_id)
+            self._changed(doc_type)
+
+    def reset(self):
+        """Mark every copy, in every process, stale so they are rebuilt on next use."""
+        for doc_type in SEARCH_DOCUMENTS:
+            bump_version(search_scope(doc_type))
+
+
+def database_search(doc_type, query, limit):
+    """
+    Unranked search straight from the database, requiring every word in some field.
+
+    Used while an in-process index is being built; newest documents first.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    document = SEARCH_DOCUMENTS[doc_type]
+    condition = reduce(and_, [
+        reduce(or_, [Q(**{f'{field}__icontains': term}) for field, weight in document['fields']])
+        for term in terms
+    ])
+    doc_ids = document['model'].objects.filter(condition).order_by('-id').values_list('id', flat=True)
+    return [(doc_id, 1) for doc_id in doc_ids[:limit]]
+
+
+class MySQLFullTextBackend:
+    """
+    Search backend using MySQL FULLTEXT indexes in boolean mode.
+
+    MySQL maintains the index itself, so update()/remove() are no-ops, and
+    the API ranks with MATCH directly in the listing query, so results are
+    not capped at SEARCH_MAX_RESULTS.
+    """
+    def _score(self, doc_type, query):
+        terms = tokenize(query)
+        if not terms:
+            return None
+        # Require every word; let the last one match as a prefix
+        boolean_query = ' '.join(f'+{term}' for term in terms[:-1])
+        boolean_query = f"{boolean_query} +{terms[-1]}*".strip()
+
+        document = SEARCH_DOCUMENTS[doc_type]
+        # Qualify the columns; the API querysets join tables that also have a `name`
+        table = document['model']._meta.db_table
+        columns = ', '.join(f'`{table}`.`{column}`' for column in document['fulltext_columns'])
+        return RawSQL(f"MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)", (boolean_query,),
+                      output_field=FloatField())
+
+    def search(self, doc_type, query, limit):
+        score = self._score(doc_type, query)
+        if score is None:
+            return []
+        rows = (
+            SEARCH_DOCUMENTS[doc_type]['model'].objects.annotate(search_score=score)
+            .filter(search_score__gt=0)
+            .order_by('-search_score', '-id')
+            .values_list('id', 'search_score')[:limit]
+        )
+        return list(rows)
+
+    def rank_queryset(self, doc_type, queryset, query, limit):
+        """Return (queryset restricted to matches and annotated with search_rank, truncated)."""
+        score = self._score(doc_type, query)
+        if score is None:
+            return queryset.none(), False
+        return queryset.annotate(search_rank=score).filter(search_rank__gt=0), False
+
+    def update(self, doc_type, doc_ids):
+        pass
+
+    def remove(self, doc_type, doc_ids):
+        pass
+
+    def reset(self):
+        pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    """Return the process-wide search backend configured by SEARCH_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_path = getattr(settings, 'SEARCH_BACKEND',
+                                       'Supadupastore.search_utils.MySQLFullTextBackend')
+                _backend = import_string(backend_path)()
+    return _backend
+
+
+class FullTextSearchFilter(filters.BaseFilterBackend):
+    """
+    Filter backend serving the `search` query parameter from the search index.
+
+    Matching rows are annotated with a `search_rank` (higher is better) and
+    ordered by it; CatalogCursorPagination pages by that rank when no
+    explicit ?ordering= is given. Views declare which index to use with a
+    `search_document` attribute.
+
+    Backends that rank by id (InProcessSearchBackend) stop at
+    SEARCH_MAX_RESULTS matches; when that happens the request is flagged and
+    the paginated response carries "search_truncated": true.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+
+        limit = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+        queryset, truncated = get_search_backend().rank_queryset(view.search_document, queryset, query, limit)
+        if truncated:
+            request.search_truncated = True
+            logger.info(f"Search for {query!r} in {view.search_document} stopped at {limit} results")
+        return queryset.order_by('-search_rank')
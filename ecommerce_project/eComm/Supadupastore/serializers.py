@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Store, Product, Review, Order, OrderItem
+from django.db.models import Prefetch
+from .models import ApiToken, Store, Product, ProductImage, Review, Order, OrderItem
+from .image_utils import IMAGE_FORMATS
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -18,56 +20,111 @@ class StoreSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Store
-        fields = ['id', 'name', 'description', 'owner', 'owner_id', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'owner', 'owner_id', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at', 'owner']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join the owner so nested UserSerializer does not query per store"""
+        return queryset.select_related('owner')
+    
     def create(self, validated_data):
         # Set owner from request user
         validated_data['owner'] = self.context['request'].user
         validated_data.pop('owner_id', None)
         store = super().create(validated_data)
         
-        # Post tweet about new store
-        from .twitter_utils import tweet_new_store
-        tweet_new_store(store)
+        # Queue tweet about new store
+        from .twitter_utils import queue_tweet_new_store
+        queue_tweet_new_store(store)
         
         return store
 
 
+class ProductImageSerializer(serializers.ModelSerializer):
+    """
+    Serializer for ProductImage model
+
+    `derivatives` maps each format to {width: url} of the resized copies;
+    it is empty until the image outbox worker has generated them.
+    """
+    url = serializers.SerializerMethodField()
+    derivatives = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProductImage
+        fields = ['id', 'url', 'alt_text', 'derivatives']
+
+    def get_url(self, obj):
+        return obj.image.url
+
+    def get_derivatives(self, obj):
+        derivatives = {}
+        for image_format in IMAGE_FORMATS:
+            urls = obj.derivative_urls(image_format)
+            if urls:
+                derivatives[image_format] = {str(width): url for width, url in urls}
+        return derivatives
+
+
 class ProductSerializer(serializers.ModelSerializer):
     """Serializer for Product model"""
     store_name = serializers.CharField(source='store.name', read_only=True)
     store_owner = serializers.CharField(source='store.owner.username', read_only=True)
+    images = ProductImageSerializer(source='productimage_set', many=True, read_only=True)
     
     class Meta:
         model = Product
         fields = ['id', 'store', 'store_name', 'store_owner', 'name', 'description', 
-                  'price', 'stock', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+                  'price', 'stock', 'average_rating', 'review_count', 'verified_review_count',
+                  'images', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'average_rating', 'review_count', 'verified_review_count',
+                            'created_at', 'updated_at']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join store and owner and prefetch images so nothing queries per product"""
+        return queryset.select_related('store__owner').prefetch_related('productimage_set')
     
     def validate_store(self, value):
         """Ensure vendor can only add products to their own stores"""
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            if value.owner != request.user:
+            if value.owner_id != request.user.pk:
                 raise serializers.ValidationError("You can only add products to your own stores.")
         return value
     
     def create(self, validated_data):
-        """Create product and post to Twitter"""
+        """Create product and queue its Twitter announcement"""
         product = super().create(validated_data)
         
-        # Post tweet about new product
-        from .twitter_utils import tweet_new_product
-        tweet_new_product(product)
+        # Queue tweet about new product
+        from .twitter_utils import queue_tweet_new_product
+        queue_tweet_new_product(product)
         
         return product
 
 
+class ProductImportRowSerializer(serializers.Serializer):
+    """
+    Validates one row of a bulk catalog import.
+
+    Store is a plain id so validating a row never queries; catalog_utils
+    checks it against the vendor's stores for the whole chunk at once.
+    """
+    id = serializers.IntegerField(required=False, min_value=1)
+    store = serializers.IntegerField()
+    name = serializers.CharField(max_length=100)
+    description = serializers.CharField(required=False, allow_blank=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    stock = serializers.IntegerField(min_value=0)
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     """Serializer for Review model"""
     user = UserSerializer(read_only=True)
     product_name = serializers.CharField(source='product.name', read_only=True)
+    rating = serializers.IntegerField(min_value=1, max_value=5)
     
     class Meta:
         model = Review
@@ -75,6 +132,11 @@ class ReviewSerializer(serializers.ModelSerializer):
                   'is_verified', 'created_at']
         read_only_fields = ['id', 'user', 'is_verified', 'created_at']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join user and product so nested user and product_name do not query per review"""
+        return queryset.select_related('user', 'product')
+    
     def create(self, validated_data):
         # Set user from request
         validated_data['user'] = self.context['request'].user
@@ -100,3 +162,26 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id', 'user', 'created_at', 'total_amount', 'items']
         read_only_fields = ['id', 'user', 'created_at']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join the user and prefetch items with their products in one extra query"""
+        return queryset.select_related('user').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+        )
+
+
+class ApiTokenSerializer(serializers.ModelSerializer):
+    """Serializer for ApiToken model; the key itself is only returned once, on creation"""
+    class Meta:
+        model = ApiToken
+        fields = ['id', 'name', 'key_prefix', 'created_at', 'expires_at', 'revoked_at']
+        read_only_fields = fields
+
+
+class ApiTokenRequestSerializer(serializers.Serializer):
+    """Credentials and options for issuing a token"""
+    username = serializers.CharField(required=False)
+    password = serializers.CharField(required=False, write_only=True, style={'input_type': 'password'})
+    name = serializers.CharField(required=False, allow_blank=True, max_length=100, default='')
+    days = serializers.IntegerField(required=False, min_value=1)
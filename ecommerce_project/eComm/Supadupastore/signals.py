@@ -0,0 +1,239 @@
+"""
+Model signal handlers.
+Keeps derived data (the search index, product rating aggregates, cached
+user roles, the catalog cache and image derivatives) in step with the models
+they are computed from, attaches anonymous carts to users when they log in,
+and hooks request metrics into new database connections.
+"""
+from django.db import transaction
+from django.contrib.auth.models import Group, User
+from django.contrib.auth.signals import user_logged_in
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Product, ProductImage, Review, Store
+from .cache_utils import CATALOG_SCOPE, bump_versions, invalidate_products, product_scope, store_scope
+from .search_utils import get_search_backend
+from .rating_utils import apply_review_delta, rebuild_rating_aggregates, review_changed
+from .role_utils import invalidate_user_roles, invalidate_all_roles
+from .cart_utils import merge_cart_on_login
+from .metrics_utils import install_query_wrapper
+from .image_utils import delete_derivative_files, queue_image_derivatives
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, created, **kwargs):
+    """Re-index a saved product, and the reviews that show its name if it was renamed"""
+    # post_save runs before Product.save records the new name as loaded
+    renamed = not created and instance.name != instance._loaded_name
+    if renamed:
+        # Keep the reviews' copy of the name (searched by the review index) current
+        Review.objects.filter(product_id=instance.id).exclude(
+            product_name=instance.name
+        ).update(product_name=instance.name)
+
+    def update():
+        backend = get_search_backend()
+        backend.update('product', [instance.id])
+        if renamed:
+            backend.update('review', Review.objects.filter(product_id=instance.id).values_list('id', flat=True))
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    transaction.on_commit(lambda: get_search_backend().remove('product', [instance.id]))
+
+
+@receiver(post_save, sender=Store)
+def index_store_products(sender, instance, created, **kwargs):
+    """Re-index a store's products, which are searchable by store name"""
+    if created:
+        return
+    Product.objects.filter(store_id=instance.id).exclude(
+        store_name=instance.name
+    ).update(store_name=instance.name)
+    transaction.on_commit(lambda: get_search_backend().update(
+        'product', Product.objects.filter(store_id=instance.id).values_list('id', flat=True)
+    ))
+
+
+@receiver(post_save, sender=Review)
+def index_review(sender, instance, **kwargs):
+    transaction.on_commit(lambda: get_search_backend().update('review', [instance.id]))
+
+
+@receiver(post_delete, sender=Review)
+def unindex_review(sender, instance, **kwargs):
+    transaction.on_commit(lambda: get_search_backend().remove('review', [instance.id]))
+
+
+def _locked_rating_state(review):
+    """
+    Re-read what a review contributes to its product, locking the row.
+
+    Runs inside the transaction of the save or delete, so a concurrent edit of
+    the same review waits here instead of applying a delta computed from the
+    same stale state (the instance's _loaded_state may be long out of date).
+    """
+    return (
+        Review.objects.select_for_update()
+        .filter(pk=review.pk)
+        .values_list('product_id', 'rating', 'is_verified')
+        .first()
+    )
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    """Record what the review contributed to its product before this save"""
+    instance._rating_snapshot = None
+    if kwargs.get('raw') or not instance.pk:
+        return
+    # Review.save wraps the save, and so this handler, in a transaction
+    instance._rating_snapshot = _locked_rating_state(instance)
+
+
+@receiver(post_save, sender=Review)
+def update_product_rating(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = None if created else getattr(instance, '_rating_snapshot', None)
+    review_changed(old, (instance.product_id, instance.rating, instance.is_verified))
+
+
+def _deleted_by_cascade(origin):
+    """True if a review delete started from another model (a product, store or user)"""
+    if origin is None:
+        return False
+    return not (isinstance(origin, Review) or getattr(origin, 'model', None) is Review)
+
+
+def _rebuild_after_cascade(origin, product_id):
+    """
+    Recompute the aggregates of the products a cascade removed reviews from, once.
+
+    The product ids are gathered on the delete's origin and rebuilt in one
+    pass after commit. Products deleted by the same cascade are simply no
+    longer there to update.
+    """
+    product_ids = getattr(origin, '_cascaded_review_products', None)
+    if product_ids is None:
+        product_ids = origin._cascaded_review_products = set()
+        transaction.on_commit(lambda: rebuild_rating_aggregates(product_ids))
+    product_ids.add(product_id)
+
+
+@receiver(pre_delete, sender=Review)
+def remember_deleted_review_rating(sender, instance, origin=None, **kwargs):
+    """Record what a review being deleted contributes; deletes run in a transaction"""
+    instance._rating_snapshot = None
+    if _deleted_by_cascade(origin):
+        _rebuild_after_cascade(origin, instance.product_id)
+        return
+    instance._rating_snapshot = _locked_rating_state(instance)
+
+
+@receiver(post_delete, sender=Review)
+def remove_product_rating(sender, instance, **kwargs):
+    old = getattr(instance, '_rating_snapshot', None)
+    if old is None:
+        # Deleted by a cascade, or already gone (e.g. deleted by a concurrent
+        # request that we waited for)
+        return
+    apply_review_delta(*old, sign=-1)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop cached roles when users are added to or removed from groups"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups.add(...): instance is the user
+        invalidate_user_roles([instance.pk])
+    elif pk_set:
+        # group.user_set.add(...): pk_set holds the user ids
+        invalidate_user_roles(pk_set)
+    else:
+        # group.user_set.clear() does not say which users were affected
+        invalidate_all_roles()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_group_change(sender, **kwargs):
+    """Group renames and deletions change the roles of every member"""
+    invalidate_all_roles()
+
+
+@receiver(post_save, sender=Product)
+def invalidate_saved_product(sender, instance, **kwargs):
+    """Invalidate the product and its store, and the store it left if it moved"""
+    # post_save runs before Product.save records the new store_id as loaded
+    store_ids = {instance.store_id, instance._loaded_store_id}
+    invalidate_products([instance.id], store_ids)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product(sender, instance, **kwargs):
+    invalidate_products([instance.id], [instance.store_id])
+
+
+@receiver(post_save, sender=Store)
+def invalidate_store(sender, instance, created, **kwargs):
+    """Product pages and listings show the store name"""
+    scopes = {store_scope(instance.id), CATALOG_SCOPE}
+    if not created:
+        scopes.update(product_scope(product_id) for product_id in
+                      Product.objects.filter(store_id=instance.id).values_list('id', flat=True))
+    bump_versions(scopes)
+
+
+@receiver(post_delete, sender=Store)
+def invalidate_deleted_store(sender, instance, **kwargs):
+    # Its products are deleted by cascade and invalidate themselves
+    bump_versions([store_scope(instance.id), CATALOG_SCOPE])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviewed_product(sender, instance, origin=None, **kwargs):
+    """Reviews and rating aggregates are shown on product pages and listings"""
+    if _deleted_by_cascade(origin):
+        # Invalidated with the aggregate rebuild after the cascade
+        return
+    invalidate_products([instance.product_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_product_images(sender, instance, **kwargs):
+    invalidate_products([instance.product_id])
+
+
+@receiver(post_save, sender=ProductImage)
+def queue_derivatives(sender, instance, **kwargs):
+    """Resize new and replaced uploads in the image outbox worker"""
+    if instance.image and instance.image_changed:
+        queue_image_derivatives(instance)
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_derivatives(sender, instance, **kwargs):
+    """Remove the resized copies once the image is gone; the original is left as before"""
+    derivatives, storage = instance.derivatives, instance.image.storage
+    transaction.on_commit(lambda: delete_derivative_files(derivatives, storage))
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Keep what a visitor put in their cart before logging in"""
+    if request is not None and hasattr(request, 'session'):
+        merge_cart_on_login(request, user)
+
+
+@receiver(connection_created)
+def track_connection_queries(sender, connection, **kwargs):
+    """Count the queries of every connection in the current request's metrics"""
+    install_query_wrapper(connection)
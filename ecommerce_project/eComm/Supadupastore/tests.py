@@ -1,3 +1,1343 @@
-from django.test import TestCase
+import codecs
+import io
+import json
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+import tweepy
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core import mail
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.mail import EmailMessage
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import generics
+from rest_framework.test import APIClient
+from rest_framework.throttling import ScopedRateThrottle
+
+from .models import (ApiToken, Cart, CartItem, EmailOutbox, ImageDerivativeOutbox, Order, OrderItem,
+                     Product, ProductImage, ResetToken, Review, Store, TweetOutbox)
+from . import (cache_utils, cart_utils, db_routers, email_utils, image_utils, metrics_utils, role_utils,
+               search_utils, token_utils, twitter_utils)
+from .checkout_utils import InsufficientStock, place_order
+from .outbox_utils import claim_batch
+from .pool_utils import ConnectionPool, PoolExhausted
+from .pagination import keyset_paginate
+
+
+def make_vendor(username='vendor'):
+    user = User.objects.create_user(username, password='pw-12345!')
+    group, _ = Group.objects.get_or_create(name='Vendors')
+    user.groups.add(group)
+    return user
+
+
+def make_product(store, name='Widget', price='9.99', stock=5):
+    return Product.objects.create(store=store, name=name, description='A product',
+                                  price=price, stock=stock)
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+    cache_utils.local_cache.clear()
+
+
+# ==================== CARTS ====================
+
+class CartHydrationTests(TestCase):
+    def setUp(self):
+        store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+        self.products = [make_product(store, name=f'Item {i}', price='2.50') for i in range(5)]
+        self.buyer = User.objects.create_user('buyer', password='pw-12345!')
+        cart = Cart.objects.create(user=self.buyer)
+        for quantity, product in enumerate(self.products, start=1):
+            cart_utils.add_item(cart, product.id, quantity)
+
+    def test_hydration_queries_do_not_grow_with_the_cart(self):
+        request = RequestFactory().get('/cart/')
+        request.user = self.buyer
+        request.session = self.client.session
+
+        # One query for the cart, one joined query for its lines and products
+        with self.assertNumQueries(2):
+            cart_items, total = cart_utils.hydrate_cart(request)
+        with self.assertNumQueries(0):
+            cart_utils.hydrate_cart(request)
+
+        self.assertEqual([item['product'] for item in cart_items], self.products)
+        self.assertEqual(str(total), '37.50')
+
+
+class CartTests(TestCase):
+    def setUp(self):
+        store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+        self.widget = make_product(store)
+        self.gadget = make_product(store, name='Gadget')
+        self.buyer = User.objects.create_user('buyer', password='pw-12345!')
+
+    def anonymous_cart(self, lines):
+        cart = Cart.objects.create()
+        for product, quantity in lines:
+            cart_utils.add_item(cart, product.id, quantity)
+        session = self.client.session
+        session[cart_utils.SESSION_CART_ID] = cart.id
+        session.save()
+        return cart
+
+    def test_add_item_increments_an_existing_line(self):
+        cart = Cart.objects.create(user=self.buyer)
+        cart_utils.add_item(cart, self.widget.id, 1)
+
+        with self.assertNumQueries(1):
+            cart_utils.add_item(cart, self.widget.id, 2)
+
+        self.assertEqual(cart_utils.cart_quantities(cart), {self.widget.id: 3})
+
+    def test_add_item_increments_a_line_inserted_concurrently(self):
+        cart = Cart.objects.create(user=self.buyer)
+        update = QuerySet.update
+        raced = []
+
+        def racing_update(queryset, **kwargs):
+            if not raced:
+                # Another request inserts the line right after this one's UPDATE found nothing
+                raced.append(True)
+                CartItem.objects.bulk_create([CartItem(cart=cart, product=self.widget, quantity=2)])
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=racing_update):
+            cart_utils.add_item(cart, self.widget.id, 1)
+
+        self.assertEqual(cart_utils.cart_quantities(cart), {self.widget.id: 3})
+
+    def test_login_adopts_the_anonymous_cart(self):
+        cart = self.anonymous_cart([(self.widget, 1)])
+
+        self.client.login(username='buyer', password='pw-12345!')
+
+        cart.refresh_from_db()
+        self.assertEqual(cart.user, self.buyer)
+        self.assertNotIn(cart_utils.SESSION_CART_ID, self.client.session)
+
+    def test_login_merges_the_anonymous_cart_into_the_users_cart(self):
+        own = Cart.objects.create(user=self.buyer)
+        cart_utils.add_item(own, self.widget.id, 3)
+        anonymous = self.anonymous_cart([(self.widget, 1), (self.gadget, 2)])
+
+        self.client.login(username='buyer', password='pw-12345!')
+
+        self.assertEqual(cart_utils.cart_quantities(own), {self.widget.id: 4, self.gadget.id: 2})
+        self.assertFalse(Cart.objects.filter(pk=anonymous.pk).exists())
+
+    def test_legacy_session_cart_is_imported_once(self):
+        session = self.client.session
+        session[cart_utils.LEGACY_SESSION_CART] = {
+            str(self.widget.id): 2, 'Gadget': 1, 'Unknown product': 1, '999999': 1, 'bogus': 'x',
+        }
+        request = RequestFactory().get('/cart/')
+        request.user = AnonymousUser()
+        request.session = session
+
+        cart = cart_utils.get_cart(request)
+
+        self.assertEqual(cart_utils.cart_quantities(cart), {self.widget.id: 2, self.gadget.id: 1})
+        self.assertNotIn(cart_utils.LEGACY_SESSION_CART, session)
+        self.assertEqual(session[cart_utils.SESSION_CART_ID], cart.id)
+
+# ==================== CHECKOUT ====================
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+        self.buyer = User.objects.create_user('buyer', password='pw-12345!')
+
+    def cart_with(self, user, lines):
+        cart = Cart.objects.create(user=user)
+        for product, quantity in lines:
+            cart_utils.add_item(cart, product.id, quantity)
+        return cart
+
+    def test_order_decrements_stock_and_empties_the_cart(self):
+        widget = make_product(self.store, stock=5)
+        cart = self.cart_with(self.buyer, [(widget, 2)])
+
+        order, invoice_items, total = place_order(self.buyer, cart)
+
+        self.assertEqual(str(total), '19.98')
+        self.assertEqual([item['quantity'] for item in invoice_items], [2])
+        self.assertEqual(list(OrderItem.objects.filter(order=order).values_list('product_id', 'quantity')), [(widget.id, 2)])
+        self.assertEqual(Product.objects.get(pk=widget.pk).stock, 3)
+        self.assertFalse(CartItem.objects.filter(cart=cart).exists())
+
+    def test_two_carts_cannot_both_buy_the_last_unit(self):
+        widget = make_product(self.store, stock=1)
+        first = self.cart_with(self.buyer, [(widget, 1)])
+        second = self.cart_with(User.objects.create_user('other', password='pw-12345!'), [(widget, 1)])
+
+        place_order(self.buyer, first)
+        with self.assertRaises(InsufficientStock):
+            place_order(second.user, second)
+
+        self.assertEqual(Product.objects.get(pk=widget.pk).stock, 0)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_stock_guard_catches_a_concurrent_decrement(self):
+        widget = make_product(self.store, stock=1)
+        cart = self.cart_with(self.buyer, [(widget, 1)])
+        bulk_create = OrderItem.objects.bulk_create
+
+        def sold_elsewhere(*args, **kwargs):
+            # Another checkout takes the unit after this one read the stock
+            Product.objects.filter(pk=widget.pk).update(stock=0)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=sold_elsewhere):
+            with self.assertRaises(InsufficientStock):
+                place_order(self.buyer, cart)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=widget.pk).stock, 1)
+
+    def test_insufficient_stock_rolls_back_the_whole_order(self):
+        widget = make_product(self.store, stock=5)
+        gadget = make_product(self.store, name='Gadget', stock=1)
+        cart = self.cart_with(self.buyer, [(widget, 2), (gadget, 3)])
+
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(self.buyer, cart)
+
+        self.assertEqual(raised.exception.product, gadget)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Widget': 5, 'Gadget': 1})
+        self.assertEqual(cart_utils.cart_quantities(cart), {widget.id: 2, gadget.id: 3})
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        small = self.cart_with(self.buyer, [(make_product(self.store, name='Single'), 1)])
+        with CaptureQueriesContext(connection) as single_line:
+            place_order(self.buyer, small)
+
+        small.delete()
+        products = [make_product(self.store, name=f'Item {i}') for i in range(5)]
+        cart = self.cart_with(self.buyer, [(product, 1) for product in products])
+        with self.assertNumQueries(len(single_line)):
+            place_order(self.buyer, cart)
+
+# ==================== TWEET OUTBOX ====================
+
+class RateLimitedStub(twitter_utils.StubTwitterClient):
+    """Stub that answers 429 after a number of successful tweets."""
+    def __init__(self, allowed):
+        super().__init__()
+        self.allowed = allowed
+
+    def create_tweet(self, text, media_ids=None):
+        if len(self.tweets) >= self.allowed:
+            response = requests.Response()
+            response.status_code = 429
+            response.headers['x-rate-limit-reset'] = str(int((timezone.now() + timedelta(minutes=15)).timestamp()))
+            raise tweepy.TooManyRequests(response)
+        super().create_tweet(text, media_ids)
+
+
+class FailingStub(twitter_utils.StubTwitterClient):
+    def create_tweet(self, text, media_ids=None):
+        raise RuntimeError('connection reset')
+
+
+@override_settings(TWEET_OUTBOX_QUEUE_UNCONFIGURED=True, TWEET_OUTBOX_CONCURRENCY=2)
+class TweetOutboxTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+        self.products = [make_product(self.store, name=f'Widget {i}') for i in range(3)]
+
+    def test_worker_posts_queued_announcements_with_stub_client(self):
+        twitter_utils.queue_tweet_new_store(self.store)
+        for product in self.products:
+            twitter_utils.queue_tweet_new_product(product)
+        stub = twitter_utils.StubTwitterClient()
+
+        results = twitter_utils.process_tweet_outbox(twitter=stub.as_twitter())
+
+        self.assertEqual(results, {'sent': 4, 'retried': 0, 'failed': 0, 'deferred': 0})
+        self.assertEqual(len(stub.tweets), 4)
+        self.assertTrue(any('Corner Shop' in tweet['text'] for tweet in stub.tweets))
+        self.assertFalse(TweetOutbox.objects.exclude(status=TweetOutbox.STATUS_SENT).exists())
+        # Nothing left for a second run
+        self.assertFalse(any(twitter_utils.process_tweet_outbox(twitter=stub.as_twitter()).values()))
+
+    def test_rate_limit_defers_the_rest_of_the_batch(self):
+        for product in self.products:
+            twitter_utils.queue_tweet_new_product(product)
+        stub = RateLimitedStub(allowed=1)
+
+        results = twitter_utils.process_tweet_outbox(twitter=stub.as_twitter())
+
+        self.assertEqual(results['sent'], 1)
+        self.assertEqual(results['deferred'], 2)
+        pending = TweetOutbox.objects.filter(status=TweetOutbox.STATUS_PENDING)
+        self.assertEqual(pending.count(), 2)
+        self.assertTrue(all(entry.next_attempt_at > timezone.now() + timedelta(minutes=10) for entry in pending))
+
+    def test_failed_post_is_retried_with_backoff(self):
+        entry = twitter_utils.queue_tweet_new_product(self.products[0])
+
+        with mock.patch.object(twitter_utils.twitter_client_pool, 'report_failure'):
+            results = twitter_utils.process_tweet_outbox(twitter=FailingStub().as_twitter())
+
+        self.assertEqual(results['retried'], 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, TweetOutbox.STATUS_PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn('connection reset', entry.last_error)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+    def test_deleted_product_fails_its_entry(self):
+        twitter_utils.queue_tweet_new_product(self.products[0])
+        self.products[0].delete()
+
+        results = twitter_utils.process_tweet_outbox(twitter=twitter_utils.StubTwitterClient().as_twitter())
+
+        self.assertEqual(results['failed'], 1)
+        self.assertEqual(TweetOutbox.objects.get().status, TweetOutbox.STATUS_FAILED)
+
+    @override_settings(TWEET_OUTBOX_QUEUE_UNCONFIGURED=False)
+    def test_nothing_is_queued_without_credentials(self):
+        self.assertIsNone(twitter_utils.queue_tweet_new_store(self.store))
+        self.assertIsNone(twitter_utils.queue_tweet_new_product(self.products[0]))
+        self.assertFalse(TweetOutbox.objects.exists())
+
+    @override_settings(TWEET_OUTBOX_QUEUE_UNCONFIGURED=False, TWITTER_API_KEY='real-key')
+    def test_announcements_are_queued_with_credentials(self):
+        self.assertIsNotNone(twitter_utils.queue_tweet_new_product(self.products[0]))
+        self.assertEqual(TweetOutbox.objects.count(), 1)
+
+
+class FailingUploadStub(twitter_utils.StubTwitterClient):
+    def media_upload(self, filename):
+        raise OSError('upload failed')
+
+
+class PostTweetTests(SimpleTestCase):
+    def test_failed_media_upload_falls_back_to_text(self):
+        stub = FailingUploadStub()
+
+        twitter_utils.post_tweet(stub.as_twitter(), 'hello', media_path='logo.png')
+
+        self.assertEqual(stub.tweets, [{'text': 'hello', 'media_ids': None}])
+
+    def test_failed_tweet_after_upload_is_raised_not_retried_without_media(self):
+        stub = FailingStub()
+
+        with mock.patch.object(stub, 'create_tweet', wraps=stub.create_tweet) as create_tweet:
+            with self.assertRaises(RuntimeError):
+                twitter_utils.post_tweet(stub.as_twitter(), 'hello', media_path='logo.png')
+
+        self.assertEqual(create_tweet.call_count, 1)
+        self.assertEqual(stub.uploads, ['logo.png'])
+
+class TwitterClientPoolTests(TestCase):
+    def test_unconfigured_client_is_not_rebuilt_on_every_call(self):
+        factory = mock.Mock(return_value=None)
+        pool = twitter_utils.TwitterClientPool(factory=factory)
+
+        for _ in range(5):
+            self.assertIsNone(pool.get())
+
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(pool.stats()['misses'], 1)
+        pool.reset()
+        pool.get()
+        self.assertEqual(factory.call_count, 2)
+
+    @override_settings(TWITTER_API_KEY='real-key')
+    def test_failed_build_is_retried(self):
+        factory = mock.Mock(side_effect=[None, {'client': object(), 'api': object()}])
+        pool = twitter_utils.TwitterClientPool(factory=factory)
+
+        self.assertIsNone(pool.get())
+        self.assertIsNotNone(pool.get())
+        self.assertIsNotNone(pool.get())
+        self.assertEqual(factory.call_count, 2)
+        self.assertEqual(pool.stats()['hits'], 1)
+
+
+# ==================== EMAIL OUTBOX ====================
+
+LOCMEM_EMAIL = 'django.core.mail.backends.locmem.EmailBackend'
+
+
+class BrokenEmailBackend:
+    """Backend whose connection cannot be opened."""
+    def __init__(self, **kwargs):
+        pass
+
+    def open(self):
+        raise ConnectionRefusedError('smtp down')
+
+    def close(self):
+        pass
+
+
+@override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class EmailOutboxTests(TestCase):
+    def queue(self, subject='Order Confirmation'):
+        return email_utils.queue_email(EmailMessage(subject, 'body', 'shop@example.com', ['buyer@example.com']))
+
+    def test_queued_email_is_sent_in_one_batch(self):
+        for i in range(3):
+            self.queue(f'Order #{i}')
+
+        results = email_utils.process_email_outbox(backend=LOCMEM_EMAIL)
+
+        self.assertEqual(results, {'sent': 3, 'retried': 0, 'failed': 0})
+        self.assertEqual([message.subject for message in mail.outbox], ['Order #0', 'Order #1', 'Order #2'])
+        self.assertTrue(all(entry.sent_at for entry in EmailOutbox.objects.all()))
+
+    def test_connection_failure_retries_then_fails(self):
+        entry = self.queue()
+
+        results = email_utils.process_email_outbox(backend='Supadupastore.tests.BrokenEmailBackend')
+        self.assertEqual(results['retried'], 1)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (EmailOutbox.STATUS_PENDING, 1))
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        # Not due again until the backoff has passed
+        self.assertFalse(any(email_utils.process_email_outbox(backend=LOCMEM_EMAIL).values()))
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        results = email_utils.process_email_outbox(backend='Supadupastore.tests.BrokenEmailBackend')
+        self.assertEqual(results['failed'], 1)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (EmailOutbox.STATUS_FAILED, 2))
+        self.assertIn('smtp down', entry.last_error)
+
+    def test_claimed_entries_are_leased(self):
+        self.queue()
+
+        self.assertEqual(len(claim_batch(EmailOutbox, 10, 'EMAIL_OUTBOX')), 1)
+        # A second worker finds nothing due while the lease is held
+        self.assertEqual(claim_batch(EmailOutbox, 10, 'EMAIL_OUTBOX'), [])
+
+    def test_no_reset_token_is_kept_after_the_send(self):
+        User.objects.create_user('buyer', email='buyer@example.com', password='pw-12345!')
+        self.client.post(reverse('Supadupastore:reset_password_request'), {'email': 'buyer@example.com'})
+
+        email_utils.process_email_outbox(backend=LOCMEM_EMAIL)
+
+        token = next(line for line in mail.outbox[0].body.splitlines() if line.endswith('/'))[:-1]
+        self.assertFalse(EmailOutbox.objects.filter(body__contains=token).exists())
+        self.assertFalse(EmailOutbox.objects.exclude(body='').exists())
+        self.assertFalse(ResetToken.objects.filter(token__contains=token).exists())
+        self.assertTrue(ResetToken.objects.exists())
+
+    def test_purge_deletes_old_finished_entries(self):
+        sent, failed, pending, recent = (self.queue(f'Order #{i}') for i in range(4))
+        EmailOutbox.objects.filter(pk=sent.pk).update(status=EmailOutbox.STATUS_SENT)
+        EmailOutbox.objects.filter(pk__in=[failed.pk, recent.pk]).update(status=EmailOutbox.STATUS_FAILED)
+        EmailOutbox.objects.exclude(pk=recent.pk).update(created_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(email_utils.purge_email_outbox(retention_days=7), 2)
+        self.assertEqual(set(EmailOutbox.objects.values_list('pk', flat=True)), {pending.pk, recent.pk})
+
+
+# ==================== IMAGE OUTBOX ====================
+
+class ImageOutboxTests(TestCase):
+    @override_settings(IMAGE_OUTBOX_MAX_ATTEMPTS=2)
+    def test_unreadable_image_retries_then_fails(self):
+        store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+        ProductImage.objects.create(product=make_product(store), image='product_images/missing.jpg')
+        entry = ImageDerivativeOutbox.objects.get()
+
+        self.assertEqual(image_utils.process_image_outbox()['retried'], 1)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (ImageDerivativeOutbox.STATUS_PENDING, 1))
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        ImageDerivativeOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(image_utils.process_image_outbox()['failed'], 1)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (ImageDerivativeOutbox.STATUS_FAILED, 2))
+
+# ==================== INDEXES ====================
+
+class LookupIndexTests(TestCase):
+    """EXPLAIN the hot lookups and check they use an index instead of a table scan."""
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_vendor()
+        cls.buyer = User.objects.create_user('buyer', password='pw-12345!')
+        store = Store.objects.create(name='Corner Shop', owner=owner)
+        Product.objects.bulk_create(
+            Product(store=store, name=f'Widget {i}', description='', price=i, stock=1) for i in range(200)
+        )
+        cls.product = Product.objects.order_by('id').first()
+        Review.objects.create(product=cls.product, user=cls.buyer, rating=4, comment='ok')
+        ResetToken.objects.create(user=owner, token='a' * 40, expiry_date=timezone.now())
+
+    def assertUsesIndex(self, queryset, index_name=None):
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            self.assertRegex(plan, r'USING (COVERING )?INDEX', plan)
+        elif connection.vendor == 'mysql':
+            self.assertNotRegex(plan, r'\bALL\b', plan)
+        if index_name:
+            self.assertIn(index_name, plan)
+
+    def test_product_name_lookup(self):
+        self.assertUsesIndex(Product.objects.filter(name='Widget 7'), 'product_name_idx')
+
+    def test_product_ordering(self):
+        self.assertUsesIndex(Product.objects.order_by('created_at')[:10], 'product_created_idx')
+        self.assertUsesIndex(Product.objects.order_by('price')[:10], 'product_price_idx')
+
+    def test_existing_review_lookup(self):
+        self.assertUsesIndex(Review.objects.filter(user=self.buyer, product=self.product),
+                             'review_user_product_idx')
+
+    def test_product_review_list(self):
+        self.assertUsesIndex(Review.objects.filter(product=self.product).order_by('-created_at'),
+                             'review_product_created_idx')
+
+    def test_reset_token_lookup(self):
+        self.assertUsesIndex(ResetToken.objects.filter(token='a' * 40, used=False))
+
+
+# ==================== API QUERY COUNTS ====================
+
+class ApiQueryCountTests(TestCase):
+    """List and retrieve must run the same number of queries however many rows they serialize."""
+    def setUp(self):
+        self.client = APIClient()
+        self.vendor = make_vendor()
+        self.store = Store.objects.create(name='Corner Shop', owner=self.vendor)
+        self.product = make_product(self.store)
+        self.review = Review.objects.create(product=self.product, user=self.vendor, rating=4, comment='ok')
+        self.rows = 0
+        self.add_rows(1)
+
+    def add_rows(self, count):
+        """Add stores with their own owners, products with images, and reviews by different users."""
+        for _ in range(count):
+            self.rows += 1
+            owner = make_vendor(f'vendor{self.rows}')
+            store = Store.objects.create(name=f'Shop {self.rows}', owner=owner)
+            Store.objects.create(name=f'Second Shop {self.rows}', owner=self.vendor)
+            for product in (make_product(store, name=f'Gadget {self.rows}'),
+                            make_product(self.store, name=f'Widget {self.rows}')):
+                ProductImage.objects.create(product=product, image=f'product_images/{self.rows}.jpg')
+            buyer = User.objects.create_user(f'buyer{self.rows}', password='pw-12345!')
+            Review.objects.create(product=self.product, user=buyer, rating=5, comment='great')
+
+    def count_queries(self, url, user=None):
+        clear_caches()
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def assertConstantQueries(self, url, user=None):
+        few = self.count_queries(url, user)
+        # Enough rows to fill a whole page
+        self.add_rows(12)
+        self.assertEqual(self.count_queries(url, user), few, url)
+
+    def test_store_list(self):
+        self.assertConstantQueries('/api/stores/')
+
+    def test_store_retrieve(self):
+        self.assertConstantQueries(f'/api/stores/{self.store.id}/')
+
+    def test_store_products(self):
+        self.assertConstantQueries(f'/api/stores/{self.store.id}/products/')
+
+    def test_my_stores(self):
+        self.assertConstantQueries('/api/stores/my_stores/', user=self.vendor)
+
+    def test_vendor_stores(self):
+        self.assertConstantQueries(f'/api/vendors/{self.vendor.id}/stores/')
+
+    def test_product_list(self):
+        self.assertConstantQueries('/api/products/')
+
+    def test_product_retrieve(self):
+        self.assertConstantQueries(f'/api/products/{self.product.id}/')
+
+    def test_product_reviews(self):
+        self.assertConstantQueries(f'/api/products/{self.product.id}/reviews/')
+
+    def test_my_products(self):
+        self.assertConstantQueries('/api/products/my_products/', user=self.vendor)
+
+    def test_review_list(self):
+        self.assertConstantQueries('/api/reviews/')
+
+    def test_review_retrieve(self):
+        self.assertConstantQueries(f'/api/reviews/{self.review.id}/')
+
+
+# ==================== PAGINATION ====================
+
+class CatalogCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+        # Many rows share each price, so a page boundary falls inside a run of equal values
+        Product.objects.bulk_create(
+            Product(store=store, name=f'Widget {i}', description='', price=i % 3, stock=1) for i in range(25)
+        )
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.append([product['id'] for product in response.data['results']])
+            url = response.data[link]
+        return ids
+
+    def test_pages_cover_every_row_once_in_order(self):
+        pages = self.walk('/api/products/?ordering=price&page_size=4', 'next')
+
+        ids = [product_id for page in pages for product_id in page]
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_links_walk_back_over_the_same_pages(self):
+        forward = self.walk('/api/products/?ordering=-price&page_size=4', 'next')
+        last_page = self.client.get('/api/products/?ordering=-price&page_size=4')
+        while last_page.data['next']:
+            last_page = self.client.get(last_page.data['next'])
+
+        backward = self.walk(last_page.data['previous'], 'previous')
+
+        self.assertEqual(backward[::-1], forward[:-1])
+
+    def test_cursor_for_another_ordering_is_rejected(self):
+        response = self.client.get('/api/products/?ordering=price&page_size=4')
+        next_link = response.data['next'].replace('ordering=price', 'ordering=name')
+
+        self.assertEqual(self.client.get(next_link).status_code, 404)
+
+    def test_keyset_pages_link_back(self):
+        factory = RequestFactory()
+        first = keyset_paginate(factory.get('/'), Product.objects.all(), page_size=10)
+        second = keyset_paginate(factory.get('/', {'cursor': first.next_cursor}), Product.objects.all(), page_size=10)
+        back = keyset_paginate(factory.get('/', {'cursor': second.previous_cursor}), Product.objects.all(), page_size=10)
+
+        self.assertTrue(first.is_first_page)
+        self.assertTrue(second.has_previous)
+        self.assertEqual(list(back), list(first))
+        self.assertTrue(back.is_first_page)
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+
+# ==================== SEARCH ====================
+
+def result_ids(ranked):
+    return sorted(doc_id for doc_id, score in ranked)
+
+
+@override_settings(SEARCH_INDEX_BACKGROUND_BUILD=False)
+class InProcessSearchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.store = Store.objects.create(name='Harbour Supplies', owner=make_vendor())
+        self.lantern = make_product(self.store, name='Brass Lantern')
+        self.ladder = make_product(self.store, name='Rope Ladder')
+
+    def test_copies_in_other_processes_see_changes(self):
+        first, second = search_utils.InProcessSearchBackend(), search_utils.InProcessSearchBackend()
+        self.assertEqual(result_ids(first.search('product', 'brass', 10)), [self.lantern.id])
+        self.assertEqual(result_ids(second.search('product', 'brass', 10)), [self.lantern.id])
+
+        Product.objects.filter(pk=self.ladder.pk).update(name='Brass Ladder')
+        first.update('product', [self.ladder.id])
+
+        both = sorted([self.lantern.id, self.ladder.id])
+        self.assertEqual(result_ids(second.search('product', 'brass', 10)), both)
+        # The process that applied the change kept its copy current instead of rebuilding
+        with self.assertNumQueries(0):
+            self.assertEqual(result_ids(first.search('product', 'brass', 10)), both)
+
+    def test_store_and_product_names_are_searchable(self):
+        buyer = User.objects.create_user('buyer', password='pw-12345!')
+        review = Review.objects.create(product=self.lantern, user=buyer, rating=5, comment='Bright')
+        backend = search_utils.InProcessSearchBackend()
+
+        self.assertEqual(result_ids(backend.search('product', 'harbour lantern', 10)), [self.lantern.id])
+        self.assertEqual(result_ids(backend.search('review', 'lantern bright', 10)), [review.id])
+
+    def test_renames_are_copied_to_the_search_columns(self):
+        buyer = User.objects.create_user('buyer', password='pw-12345!')
+        review = Review.objects.create(product=self.lantern, user=buyer, rating=5, comment='Bright')
+
+        self.store.name = 'Quayside'
+        self.store.save()
+        self.lantern.name = 'Copper Lantern'
+        self.lantern.save()
+
+        self.assertEqual(Product.objects.get(pk=self.ladder.pk).store_name, 'Quayside')
+        self.assertEqual(Review.objects.get(pk=review.pk).product_name, 'Copper Lantern')
+
+    @override_settings(SEARCH_INDEX_BACKGROUND_BUILD=True)
+    def test_first_search_does_not_wait_for_the_build(self):
+        backend = search_utils.InProcessSearchBackend()
+
+        with mock.patch.object(search_utils.threading, 'Thread') as thread:
+            self.assertEqual(result_ids(backend.search('product', 'lantern', 10)), [self.lantern.id])
+            self.assertEqual(result_ids(backend.search('product', 'lantern', 10)), [self.lantern.id])
+
+        # One build started in the background; both searches were answered from the database
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_truncated_results_are_flagged(self):
+        make_product(self.store, name='Brass Bell')
+        backend = search_utils.InProcessSearchBackend()
+
+        with mock.patch.object(search_utils, 'get_search_backend', return_value=backend):
+            response = APIClient().get('/api/products/?search=brass')
+
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertTrue(response.data['search_truncated'])
+
+
+# ==================== REVIEWS ====================
+
+class ReviewRatingTests(TestCase):
+    def setUp(self):
+        self.product = make_product(Store.objects.create(name='Corner Shop', owner=make_vendor()))
+        self.buyer = User.objects.create_user('buyer', password='pw-12345!')
+
+    def test_api_rejects_ratings_outside_one_to_five(self):
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+
+        for rating in (0, 6):
+            response = client.post('/api/reviews/', {'product': self.product.id, 'rating': rating, 'comment': 'x'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('rating', response.data)
+        self.assertFalse(Review.objects.exists())
+
+    def test_model_validation_and_database_constraint(self):
+        review = Review(product=self.product, user=self.buyer, rating=9, comment='x')
+        with self.assertRaises(ValidationError):
+            review.full_clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            review.save()
+
+    def test_review_form_rejects_bad_rating(self):
+        self.client.force_login(self.buyer)
+
+        response = self.client.post(reverse('Supadupastore:add_review', args=[self.product.id]), {'rating': '11', 'comment': 'x'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Rating must be a whole number from 1 to 5')
+        self.assertFalse(Review.objects.exists())
+
+
+class ReviewAggregateTests(TestCase):
+    def setUp(self):
+        self.product = make_product(Store.objects.create(name='Corner Shop', owner=make_vendor()))
+        buyer = User.objects.create_user('buyer', password='pw-12345!')
+        self.review = Review.objects.create(product=self.product, user=buyer, rating=5, comment='x')
+
+    def assertAggregates(self, **expected):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual({field: getattr(product, field) for field in expected}, expected)
+
+    def test_edit_from_a_stale_instance_moves_the_current_rating(self):
+        first, second = Review.objects.get(pk=self.review.pk), Review.objects.get(pk=self.review.pk)
+        first.rating = 1
+        first.save()
+
+        # second still believes the review is rated 5
+        second.rating = 3
+        second.save()
+
+        self.assertAggregates(review_count=1, rating_sum=3, rating_1_count=0, rating_3_count=1, rating_5_count=0)
+
+    def test_delete_of_a_stale_instance_removes_the_current_rating(self):
+        stale = Review.objects.get(pk=self.review.pk)
+        current = Review.objects.get(pk=self.review.pk)
+        current.rating = 2
+        current.save()
+
+        stale.delete()
+
+        self.assertAggregates(review_count=0, rating_sum=0, rating_2_count=0, rating_5_count=0)
+
+
+class CascadeReviewDeleteTests(TestCase):
+    """Deleting a product or user removes its reviews without per-review aggregate updates."""
+    def setUp(self):
+        self.store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+
+    def reviewed_products(self, count):
+        """count products, each reviewed (rating 4) by a new buyer; returns (buyer, products)."""
+        buyer = User.objects.create_user(f'buyer-{User.objects.count()}', password='pw-12345!')
+        products = [make_product(self.store, name=f'Item {buyer.pk}-{i}') for i in range(count)]
+        for product in products:
+            Review.objects.create(product=product, user=buyer, rating=4, comment='ok')
+        return buyer, products
+
+    def delete_queries(self, instance):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                instance.delete()
+        return len(queries)
+
+    def test_user_delete_recomputes_each_product_once(self):
+        other = User.objects.create_user('other', password='pw-12345!')
+        one_buyer, (single,) = self.reviewed_products(1)
+        buyer, products = self.reviewed_products(5)
+        for product in (single, products[0]):
+            Review.objects.create(product=product, user=other, rating=2, comment='meh')
+
+        self.assertEqual(self.delete_queries(buyer), self.delete_queries(one_buyer))
+
+        aggregates = Product.objects.filter(pk__in=[product.pk for product in products]).order_by('pk')
+        self.assertEqual([(product.review_count, product.rating_sum, product.rating_4_count)
+                          for product in aggregates], [(1, 2, 0)] + [(0, 0, 0)] * 4)
+        self.assertEqual(str(aggregates[0].average_rating), '2.00')
+
+    def test_product_delete_does_not_update_the_product_per_review(self):
+        buyer, products = self.reviewed_products(1)
+        for i in range(4):
+            reviewer = User.objects.create_user(f'reviewer-{i}', password='pw-12345!')
+            Review.objects.create(product=products[0], user=reviewer, rating=5, comment='great')
+        _, (single,) = self.reviewed_products(1)
+
+        self.assertEqual(self.delete_queries(products[0]), self.delete_queries(single))
+        self.assertFalse(Review.objects.exists())
+
+
+# ==================== ROLES ====================
+
+SHARED_ROLE_CACHE_DIR = tempfile.mkdtemp()
+
+
+class RoleCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = make_vendor()
+        self.vendors = Group.objects.get(name=role_utils.VENDOR_ROLE)
+
+    def roles(self):
+        """Roles as a new request would see them."""
+        return role_utils.get_user_roles(User.objects.get(pk=self.user.pk))
+
+    def test_roles_are_memoized_for_the_request(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(role_utils.is_vendor(user))
+            self.assertFalse(role_utils.is_buyer(user))
+
+    def test_per_process_cache_reads_roles_once_per_request(self):
+        self.roles()
+        user = User.objects.get(pk=self.user.pk)
+
+        with self.assertNumQueries(1):
+            role_utils.get_user_roles(user)
+
+        # A membership change in another process reaches this one at once
+        self.user.groups.through.objects.filter(user=self.user).delete()
+        self.assertEqual(self.roles(), frozenset())
+
+    @override_settings(
+        CACHES=dict(settings.CACHES, roles={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': SHARED_ROLE_CACHE_DIR,
+        }),
+        ROLE_CACHE_ALIAS='roles',
+    )
+    def test_shared_cache_is_invalidated_by_membership_changes(self):
+        caches['roles'].clear()
+        self.assertEqual(self.roles(), {role_utils.VENDOR_ROLE})
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            role_utils.get_user_roles(user)
+
+        self.user.groups.remove(self.vendors)
+        self.assertEqual(self.roles(), frozenset())
+
+        self.vendors.user_set.add(self.user)
+        self.assertEqual(self.roles(), {role_utils.VENDOR_ROLE})
+
+        self.vendors.user_set.clear()
+        self.assertEqual(self.roles(), frozenset())
+
+# ==================== OWNERSHIP ====================
+
+class OwnerPermissionTests(TestCase):
+    """Writes load the object once, check ownership by id, and refuse non-owners."""
+    def setUp(self):
+        self.owner = make_vendor()
+        self.other = make_vendor('other-vendor')
+        self.store = Store.objects.create(name='Corner Shop', owner=self.owner)
+        self.product = make_product(self.store)
+        self.review = Review.objects.create(product=self.product, user=self.owner, rating=4, comment='ok')
+
+    def request(self, method, url, user, data=None):
+        """Return (response, number of get_object() database loads)."""
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch('rest_framework.generics.get_object_or_404',
+                        wraps=generics.get_object_or_404) as load:
+            response = getattr(client, method)(url, data, format='json')
+        return response, load.call_count
+
+    def assertOwnerOnly(self, method, url, data=None):
+        response, loads = self.request(method, url, self.other, data)
+        self.assertEqual((response.status_code, loads), (403, 1), url)
+        response, loads = self.request(method, url, self.owner, data)
+        self.assertIn(response.status_code, (200, 204), url)
+        self.assertEqual(loads, 1, url)
+
+    def test_store_update(self):
+        self.assertOwnerOnly('patch', f'/api/stores/{self.store.id}/', {'name': 'Renamed'})
+        self.assertEqual(Store.objects.get(pk=self.store.pk).name, 'Renamed')
+
+    def test_product_update(self):
+        self.assertOwnerOnly('patch', f'/api/products/{self.product.id}/', {'price': '4.50'})
+        self.assertEqual(str(Product.objects.get(pk=self.product.pk).price), '4.50')
+
+    def test_review_update(self):
+        self.assertOwnerOnly('patch', f'/api/reviews/{self.review.id}/', {'comment': 'better'})
+        self.assertEqual(Review.objects.get(pk=self.review.pk).comment, 'better')
+
+    def test_review_delete(self):
+        self.assertOwnerOnly('delete', f'/api/reviews/{self.review.id}/')
+        self.assertFalse(Review.objects.exists())
+
+    def test_product_delete(self):
+        self.assertOwnerOnly('delete', f'/api/products/{self.product.id}/')
+        self.assertFalse(Product.objects.exists())
+
+
+# ==================== CATALOG IMPORT ====================
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.vendor = make_vendor()
+        self.store = Store.objects.create(name='Corner Shop', owner=self.vendor)
+        self.client = APIClient()
+        self.client.force_authenticate(self.vendor)
+
+    def upload(self, content, name='catalog.csv', chunk_size=1000):
+        return self.client.post('/api/products/import/', {
+            'file': SimpleUploadedFile(name, content), 'chunk_size': chunk_size,
+        }, format='multipart')
+
+    def test_byte_order_mark_is_ignored(self):
+        csv_text = f'store,name,price,stock\r\n{self.store.id},Lamp,12.50,3\r\n'
+        response = self.upload(codecs.BOM_UTF8 + csv_text.encode())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['error_count']), (1, 0))
+        self.assertEqual(Product.objects.get().name, 'Lamp')
+
+    def test_undecodable_file_is_rejected_before_anything_is_written(self):
+        rows = [f'{self.store.id},Lamp {i},1.00,1' for i in range(5)]
+        content = ('store,name,price,stock\n' + '\n'.join(rows[:3]) + '\n').encode()
+        content += f'{self.store.id},Caf\xe9,1.00,1\n'.encode('latin-1') + '\n'.join(rows[3:]).encode()
+
+        response = self.upload(content, chunk_size=1)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 5', response.data['error'])
+        self.assertFalse(Product.objects.exists())
+
+    def test_repeated_rows_in_a_chunk_do_not_duplicate_products(self):
+        rows = [
+            {'store': self.store.id, 'name': 'Lamp', 'price': '10.00', 'stock': 1},
+            {'store': self.store.id, 'name': 'Lamp', 'price': '12.00', 'stock': 4},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows).encode()
+
+        response = self.upload(content, name='catalog.ndjson')
+
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        product = Product.objects.get()
+        self.assertEqual((str(product.price), product.stock), ('12.00', 4))
+
+    def test_rows_for_other_vendors_stores_are_reported(self):
+        other_store = Store.objects.create(name='Elsewhere', owner=make_vendor('other-vendor'))
+        content = f'store,name,price,stock\n{other_store.id},Lamp,1.00,1\n'.encode()
+
+        response = self.upload(content)
+
+        self.assertEqual(response.data['error_count'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 1)
+        self.assertFalse(Product.objects.exists())
+
+
+# ==================== EXPORTS ====================
+
+class ExportPermissionTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        make_product(Store.objects.create(name='Corner Shop', owner=make_vendor()))
+        self.user = User.objects.create_user('buyer', password='pw-12345!')
+
+    def test_anonymous_users_cannot_export(self):
+        for url in ('/api/exports/products/', '/api/exports/reviews/'):
+            self.assertIn(APIClient().get(url).status_code, (401, 403), url)
+
+    def test_signed_in_users_can_export(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get('/api/exports/products/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Widget', b''.join(response.streaming_content))
+
+    def test_exports_are_throttled(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        rates = {'exports': '2/hour'}
+
+        with mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', rates):
+            statuses = [client.get('/api/exports/reviews/').status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+    def test_streamed_export_queries_are_recorded(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        recorded = []
+
+        def record(endpoint, request_metrics, latency_ms):
+            recorded.append((endpoint, request_metrics.query_count))
+
+        with mock.patch.object(metrics_utils.registry, 'record', side_effect=record):
+            response = client.get('/api/exports/products/')
+            self.assertEqual(recorded, [])
+            b''.join(response.streaming_content)
+            response.close()
+
+        self.assertEqual(len(recorded), 1)
+        endpoint, query_count = recorded[0]
+        self.assertIn('export', endpoint)
+        self.assertGreater(query_count, 0)
+
+# ==================== API TOKENS ====================
+
+class ApiTokenTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('buyer', password='pw-12345!')
+        self.raw_key, self.token = token_utils.issue_token(self.user)
+
+    def test_revocation_by_another_process_applies_at_once_without_a_shared_cache(self):
+        self.assertIsNotNone(token_utils.lookup_token(self.raw_key))
+
+        # Another process revokes the token; nothing here is told about it
+        ApiToken.objects.filter(pk=self.token.pk).update(revoked_at=timezone.now())
+
+        self.assertIsNone(token_utils.lookup_token(self.raw_key))
+
+    def test_bearer_token_authenticates(self):
+        response = APIClient().get('/api/exports/products/',
+                                   HTTP_AUTHORIZATION=f'Bearer {self.raw_key}')
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_non_utf8_authorization_scheme_is_not_a_server_error(self):
+        response = APIClient().get('/api/exports/products/',
+                                   HTTP_AUTHORIZATION=b'\xff\xfe abc'.decode('latin-1'))
+
+        self.assertIn(response.status_code, (401, 403))
+
+# ==================== READ REPLICAS ====================
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(TransactionTestCase):
+    """The 'replica' alias mirrors 'default' in tests; queries are told apart by connection."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        clear_caches()
+        self.vendor = make_vendor()
+        self.store = Store.objects.create(name='Corner Shop', owner=self.vendor)
+        self.product = make_product(self.store)
+        self.router = db_routers.ReplicaRouter()
+
+    def replica_queries(self, client, method, url, data=None):
+        """Return (response, number of queries sent to the replica)."""
+        clear_caches()
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = getattr(client, method)(url, data, format='json')
+        return response, len(queries)
+
+    def test_opted_in_views_read_from_the_replica(self):
+        response, queries = self.replica_queries(APIClient(), 'get', '/api/products/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(queries, 0)
+
+    def test_other_views_read_from_the_primary(self):
+        client = APIClient()
+        client.force_authenticate(self.vendor)
+
+        response, queries = self.replica_queries(client, 'get', '/api/tokens/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+    def test_reads_inside_a_transaction_use_the_primary(self):
+        with db_routers.routing_request():
+            db_routers.allow_replica_reads()
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_a_write_pins_the_rest_of_the_request(self):
+        with db_routers.routing_request() as state:
+            db_routers.allow_replica_reads()
+            make_product(self.store, name='Gadget')
+
+            self.assertTrue(state.pinned)
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_a_write_sets_the_pin_cookie_and_the_cookie_pins_reads(self):
+        client = APIClient()
+        client.force_authenticate(self.vendor)
+
+        response = client.patch(f'/api/products/{self.product.id}/', {'price': '4.50'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pin_primary', response.cookies)
+
+        response, queries = self.replica_queries(client, 'get', '/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+# ==================== CATALOG CACHE ====================
+
+class CacheVersionTests(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def evict(self, scope):
+        caches[settings.CATALOG_CACHE_ALIAS].delete(cache_utils._version_key(scope))
+
+    def read(self, value):
+        return cache_utils.cached_read('greeting', ['test'], lambda: value)
+
+    def test_evicted_version_never_returns_to_an_old_value(self):
+        cache_utils.bump_version('test')
+        self.assertEqual(self.read('old'), 'old')
+
+        self.evict('test')
+        self.assertEqual(self.read('during eviction'), 'during eviction')
+        cache_utils.bump_version('test')
+
+        self.assertEqual(self.read('new'), 'new')
+
+    def test_bump_after_eviction_restarts_at_an_unused_version(self):
+        versions = {cache_utils.get_versions(['test'])[-1], cache_utils.bump_version('test')}
+
+        self.evict('test')
+        versions.add(cache_utils.bump_version('test'))
+
+        self.assertEqual(len(versions), 3)
+
+
+class ProductSaveTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.store = Store.objects.create(name='Corner Shop', owner=make_vendor())
+        product = make_product(self.store)
+        Review.objects.create(product=product, user=User.objects.create_user('buyer'), rating=4, comment='ok')
+        self.product = Product.objects.get(pk=product.pk)
+
+    def test_edit_is_a_single_update(self):
+        self.product.price = '4.50'
+        with self.assertNumQueries(1):
+            self.product.save()
+
+    def test_rename_updates_the_reviews_copy_of_the_name(self):
+        self.product.name = 'Gizmo'
+        self.product.save()
+
+        self.assertEqual(list(Review.objects.values_list('product_name', flat=True)), ['Gizmo'])
+
+    def test_move_invalidates_both_stores(self):
+        other = Store.objects.create(name='Other Shop', owner=self.store.owner)
+        scopes = [cache_utils.store_scope(self.store.id), cache_utils.store_scope(other.id)]
+        before = cache_utils.get_versions(scopes)
+
+        self.product.store = other
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        after = cache_utils.get_versions(scopes)
+        self.assertNotEqual(before[1], after[1])
+        self.assertNotEqual(before[2], after[2])
+
+
+# ==================== CONNECTION POOL ====================
+
+class FakeConnection:
+    """Raw connection stub; a broken one fails its health-check query."""
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        if self.broken:
+            raise OSError('server has gone away')
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, size=2, timeout=1, recycle_seconds=600, health_checks=False):
+        return ConnectionPool(f'pool-test-{self._testMethodName}', size, timeout, recycle_seconds, health_checks)
+
+    def test_checked_in_connections_are_reused(self):
+        pool = self.make_pool()
+        connection, opened_at = pool.checkout(FakeConnection)
+        pool.checkin(connection, opened_at)
+
+        again, _ = pool.checkout(FakeConnection)
+
+        self.assertIs(again, connection)
+        self.assertEqual((pool.metrics.counters['connects'], pool.metrics.counters['reused']), (1, 1))
+        self.assertEqual(pool.metrics.in_use, 1)
+
+    def test_checkout_times_out_when_every_connection_is_in_use(self):
+        pool = self.make_pool(size=1, timeout=0.01)
+        pool.checkout(FakeConnection)
+
+        with self.assertRaises(PoolExhausted):
+            pool.checkout(FakeConnection)
+        self.assertEqual(pool.metrics.counters['timeouts'], 1)
+
+    def test_a_checkin_frees_the_slot(self):
+        pool = self.make_pool(size=1, timeout=0.01)
+        connection, opened_at = pool.checkout(FakeConnection)
+        pool.checkin(connection, opened_at, reusable=False)
+
+        pool.checkout(FakeConnection)
+
+        self.assertTrue(connection.closed)
+
+    def test_idle_connections_are_recycled_after_the_recycle_time(self):
+        pool = self.make_pool(recycle_seconds=60)
+        connection, opened_at = pool.checkout(FakeConnection)
+        pool.checkin(connection, opened_at)
+
+        with mock.patch('Supadupastore.pool_utils.time.monotonic', return_value=opened_at + 61):
+            fresh, _ = pool.checkout(FakeConnection)
+
+        self.assertIsNot(fresh, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.metrics.counters['discarded'], 1)
+
+    def test_unhealthy_idle_connections_are_discarded(self):
+        pool = self.make_pool(health_checks=True)
+        connection, opened_at = pool.checkout(lambda: FakeConnection(broken=True))
+        pool.checkin(connection, opened_at)
+
+        fresh, _ = pool.checkout(FakeConnection)
+
+        self.assertIsNot(fresh, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.metrics.counters['discarded'], 1)
+
+
+# ==================== ASYNC VIEWS ====================
+
+class AsyncViewTests(TestCase):
+    """The catalog and cart pages are async views; render them through the async client."""
+    def setUp(self):
+        clear_caches()
+        self.product = make_product(Store.objects.create(name='Corner Shop', owner=make_vendor()))
+        self.buyer = User.objects.create_user('buyer', password='pw-12345!')
+        cart = Cart.objects.create(user=self.buyer)
+        cart_utils.add_item(cart, self.product.id, 2)
+
+    async def test_browse_renders_and_honours_its_etag(self):
+        url = reverse('Supadupastore:browse_products')
+        response = await self.async_client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Widget')
+
+        again = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    async def test_product_detail_renders(self):
+        response = await self.async_client.get(reverse('Supadupastore:product_detail', args=[self.product.id]))
+
+        self.assertContains(response, 'Widget')
+
+    async def test_missing_product_is_404(self):
+        response = await self.async_client.get(reverse('Supadupastore:product_detail', args=[999999]))
+
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cart_requires_login_and_renders_the_users_lines(self):
+        url = reverse('Supadupastore:view_cart')
+        self.assertEqual((await self.async_client.get(url)).status_code, 302)
+
+        await sync_to_async(self.async_client.force_login)(self.buyer)
+        response = await self.async_client.get(url)
+
+        self.assertContains(response, 'Widget')
+        self.assertContains(response, '19.98')
+
+# ==================== CACHE WARMING ====================
+
+class WarmProductCardsTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        make_product(Store.objects.create(name='Corner Shop', owner=make_vendor()))
+
+    def test_refuses_a_per_process_cache(self):
+        with self.assertRaisesMessage(CommandError, 'per-process cache'):
+            call_command('warm_product_cards', stdout=io.StringIO())
+
+    def test_force_warms_with_a_warning(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+
+        call_command('warm_product_cards', '--force', stdout=stdout, stderr=stderr)
+
+        self.assertIn('per-process cache', stderr.getvalue())
+        self.assertIn('Warmed 1 product cards', stdout.getvalue())
+
+    def test_warms_a_shared_cache_for_the_given_timeout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+            with override_settings(CACHES=dict(settings.CACHES, shared=shared), CATALOG_CACHE_ALIAS='shared'):
+                stdout = io.StringIO()
+                with mock.patch.object(caches['shared'], 'set_many', wraps=caches['shared'].set_many) as set_many:
+                    call_command('warm_product_cards', '--timeout', '3600', stdout=stdout)
+
+        self.assertIn('Warmed 1 product cards (cached for 3600s)', stdout.getvalue())
+        self.assertEqual(set_many.call_args.args[1], 3600)
@@ -0,0 +1,140 @@
+"""
+Token Utilities
+Issues, looks up and revokes the bearer tokens used by API clients.
+
+Keys are random 256-bit strings, so a single SHA-256 is enough to store
+them safely; unlike a password hash it costs microseconds to check.
+Lookups are cached in API_TOKEN_CACHE_ALIAS, with a per-process LRU (for
+API_TOKEN_LOCAL_TTL seconds) in front of it. Revoking a token clears both
+tiers in the revoking process; other processes stop accepting it once
+their local entry expires. The cache must be shared between processes
+(Memcached/Redis): with a per-process cache a revoked token would stay
+valid elsewhere until its entry expired, so lookups then go to the
+database every time.
+"""
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from .cache_utils import LocalLRUCache, is_shared_cache
+from .models import ApiToken
+
+_local_tokens = LocalLRUCache(getattr(settings, 'API_TOKEN_LOCAL_ENTRIES', 1024))
+
+
+def _lifetime():
+    return timedelta(days=getattr(settings, 'API_TOKEN_LIFETIME_DAYS', 30))
+
+
+def _token_cache():
+    """The shared token cache, or None if API_TOKEN_CACHE_ALIAS is per-process."""
+    cache = caches[getattr(settings, 'API_TOKEN_CACHE_ALIAS', 'default')]
+    return cache if is_shared_cache(cache) else None
+
+
+def _load_token(key_hash):
+    return (
+        ApiToken.objects.filter(key_hash=key_hash, revoked_at__isnull=True)
+        .values('id', 'user_id', 'expires_at')
+        .first()
+    )
+
+
+def _cache_key(key_hash):
+    return f'apitoken:{key_hash}'
+
+
+def hash_token(raw_key):
+    return hashlib.sha256(raw_key.encode()).hexdigest()
+
+
+def issue_token(user, name='', lifetime=None):
+    """
+    Create a token for a user.
+
+    Args:
+        user: User the token authenticates as
+        name: Label shown when listing tokens (e.g. the device)
+        lifetime: timedelta until expiry (default API_TOKEN_LIFETIME_DAYS)
+
+    Returns:
+        tuple: (raw_key, ApiToken). The raw key is not stored and cannot be
+        shown again.
+    """
+    raw_key = secrets.token_urlsafe(32)
+    token = ApiToken.objects.create(
+        user=user,
+        name=name,
+        key_prefix=raw_key[:8],
+        key_hash=hash_token(raw_key),
+        expires_at=timezone.now() + (lifetime or _lifetime()),
+    )
+    return raw_key, token
+
+
+def lookup_token(raw_key):
+    """
+    Resolve a raw key to its token entry.
+
+    Returns:
+        dict or None: {'id', 'user_id', 'expires_at'} (expiry as a Unix
+        timestamp) for an active token, None for unknown, revoked or
+        expired keys
+    """
+    key_hash = hash_token(raw_key)
+    now = time.time()
+    cache = _token_cache()
+
+    if cache is None:
+        # Nothing to invalidate across processes; revocation applies at once
+        token = _load_token(key_hash)
+        entry = token and dict(token, expires_at=token['expires_at'].timestamp())
+    else:
+        local = _local_tokens.get(key_hash)
+        if local is not None and local[0] > now:
+            entry = local[1]
+        else:
+            entry = cache.get(_cache_key(key_hash), False)
+            if entry is False:
+                token = _load_token(key_hash)
+                entry = None
+                timeout = getattr(settings, 'API_TOKEN_NEGATIVE_CACHE_SECONDS', 60)
+                if token is not None:
+                    entry = dict(token, expires_at=token['expires_at'].timestamp())
+                    timeout = max(1, min(getattr(settings, 'API_TOKEN_CACHE_SECONDS', 300),
+                                         int(entry['expires_at'] - now)))
+                cache.set(_cache_key(key_hash), entry, timeout)
+            local_ttl = getattr(settings, 'API_TOKEN_LOCAL_TTL', 30)
+            _local_tokens.set(key_hash, (now + local_ttl, entry))
+
+    if entry is None or entry['expires_at'] <= now:
+        return None
+    return entry
+
+
+def _forget(key_hashes):
+    cache = _token_cache()
+    if cache is not None:
+        cache.delete_many([_cache_key(key_hash) for key_hash in key_hashes])
+    for key_hash in key_hashes:
+        _local_tokens.delete(key_hash)
+
+
+def revoke_token(token):
+    """Revoke one token and drop its cached lookups."""
+    if token.revoked_at is None:
+        token.revoked_at = timezone.now()
+        token.save(update_fields=['revoked_at'])
+    _forget([token.key_hash])
+
+
+def revoke_user_tokens(user):
+    """Revoke every active token of a user (e.g. after a password change)."""
+    tokens = ApiToken.objects.filter(user=user, revoked_at__isnull=True)
+    key_hashes = list(tokens.values_list('key_hash', flat=True))
+    tokens.update(revoked_at=timezone.now())
+    _forget(key_hashes)
+    return len(key_hashes)
@@ -4,20 +4,32 @@ Handles posting tweets when stores and products are created.
 """
 import tweepy
 import logging
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+from types import SimpleNamespace
 from django.conf import settings
+from django.utils import timezone
+from .models import TweetOutbox, Store, Product
+from .async_utils import run_blocking_concurrently
+from .outbox_utils import claim_batch, mark_complete, schedule_retry
 
 logger = logging.getLogger(__name__)
 
 
-def get_twitter_client():
+def twitter_configured():
+    """Return True if Twitter API credentials have been filled in."""
+    return getattr(settings, 'TWITTER_API_KEY', 'your_api_key_here') != 'your_api_key_here'
+
+
+def _build_twitter_client():
     """
     Initialize and return Twitter API v2 client.
     Returns None if credentials are not configured.
     """
     try:
         # Check if credentials are configured
-        if (settings.TWITTER_API_KEY == 'your_api_key_here' or 
-            not hasattr(settings, 'TWITTER_API_KEY')):
+        if not twitter_configured():
             logger.warning("Twitter API credentials not configured. Tweets will not be posted.")
             return None
         
@@ -45,144 +57,378 @@ def get_twitter_client():
         return None
 
 
-def tweet_new_store(store):
+class TwitterClientPool:
+    """
+    Process-wide, lazily built Twitter client.
+    
+    The tweepy clients each hold a requests.Session, so reusing them keeps
+    HTTP connections alive between tweets. The client is only rebuilt after
+    a failed health check, and hit/miss counters show how often it is reused.
+    Missing credentials are remembered too, so an unconfigured setup does not
+    rebuild (and warn) on every call; reset() picks up new settings.
+    """
+    def __init__(self, factory=_build_twitter_client):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._twitter = None
+        self._unconfigured = False
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.failed_checks = 0
+
+    def get(self):
+        """Return the shared client dict, building it on first use."""
+        with self._lock:
+            if self._twitter is not None:
+                self.hits += 1
+                return self._twitter
+            if self._unconfigured:
+                return None
+            self.misses += 1
+            self._twitter = self._factory()
+            # Build errors are retried on the next call; missing credentials are not
+            self._unconfigured = self._twitter is None and not twitter_configured()
+            return self._twitter
+
+    def check_health(self):
+        """
+        Verify the shared client can still reach Twitter.
+        
+        Returns:
+            bool: True if healthy; on failure the client is dropped so the next
+            get() rebuilds it
+        """
+        with self._lock:
+            twitter = self._twitter
+        if twitter is None:
+            return False
+        try:
+            twitter['client'].get_me(user_auth=True)
+            return True
+        except tweepy.TooManyRequests:
+            # Rate limited, but the credentials and connection are fine
+            return True
+        except Exception as e:
+            logger.warning(f"Twitter client health check failed: {str(e)}. Rebuilding client.")
+            with self._lock:
+                if self._twitter is twitter:
+                    self._twitter = None
+                    self.rebuilds += 1
+                self.failed_checks += 1
+            return False
+
+    def report_failure(self, twitter, error):
+        """
+        Run a health check after a failed call made with the shared client.
+        
+        HTTP errors are skipped: Twitter answered, so the connection is fine.
+        """
+        if isinstance(error, tweepy.HTTPException):
+            return
+        with self._lock:
+            is_shared = twitter is not None and twitter is self._twitter
+        if is_shared:
+            self.check_health()
+
+    def reset(self):
+        """Drop the shared client and zero the counters."""
+        with self._lock:
+            self._twitter = None
+            self._unconfigured = False
+            self.hits = self.misses = self.rebuilds = self.failed_checks = 0
+
+    def stats(self):
+        """Return the pool counters as a dict."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'rebuilds': self.rebuilds,
+                'failed_checks': self.failed_checks,
+            }
+
+
+twitter_client_pool = TwitterClientPool()
+
+
+def get_twitter_client():
+    """
+    Return the shared Twitter client dict ({'client': ..., 'api': ...}).
+    Returns None if credentials are not configured.
+    """
+    return twitter_client_pool.get()
+
+
+def build_store_tweet(store):
     """
-    Post a tweet when a new store is created.
+    Build the announcement text for a new store.
     
     Args:
         store: Store model instance
         
     Returns:
-        bool: True if tweet was posted successfully, False otherwise
+        str: Tweet text no longer than 280 characters
     """
-    twitter = get_twitter_client()
-    if not twitter:
-        logger.info(f"Skipping tweet for new store '{store.name}' - Twitter not configured")
-        return False
+    description = getattr(store, 'description', '') or ''
     
-    try:
-        # Create tweet text
-        tweet_text = f"🎉 New Store Alert! 🎉\n\n"
-        tweet_text += f"📍 {store.name}\n\n"
-        tweet_text += f"{store.description}\n\n"
-        tweet_text += f"#NewStore #Ecommerce"
-        
-        # Truncate if needed (Twitter limit is 280 characters)
-        if len(tweet_text) > 280:
-            # Truncate description to fit
-            max_desc_length = 280 - len(tweet_text) + len(store.description) - 3
-            if max_desc_length > 0:
-                truncated_desc = store.description[:max_desc_length] + "..."
-                tweet_text = f"🎉 New Store Alert! 🎉\n\n"
-                tweet_text += f"📍 {store.name}\n\n"
-                tweet_text += f"{truncated_desc}\n\n"
-                tweet_text += f"#NewStore #Ecommerce"
-            else:
-                tweet_text = f"🎉 New Store: {store.name} 🎉\n#NewStore #Ecommerce"
-        
-        # Check if store has a logo
-        if store.logo:
-            try:
-                # Upload media using API v1.1
-                media = twitter['api'].media_upload(store.logo.path)
-                
-                # Post tweet with media using API v2
-                response = twitter['client'].create_tweet(
-                    text=tweet_text,
-                    media_ids=[media.media_id]
-                )
-                logger.info(f"Successfully tweeted new store '{store.name}' with logo")
-                return True
-            except Exception as media_error:
-                logger.warning(f"Error uploading store logo: {str(media_error)}. Tweeting without image.")
-                # Fallback: tweet without image
-                response = twitter['client'].create_tweet(text=tweet_text)
-                logger.info(f"Successfully tweeted new store '{store.name}' without logo")
-                return True
+    # Create tweet text
+    tweet_text = f"🎉 New Store Alert! 🎉\n\n"
+    tweet_text += f"📍 {store.name}\n\n"
+    tweet_text += f"{description}\n\n"
+    tweet_text += f"#NewStore #Ecommerce"
+    
+    # Truncate if needed (Twitter limit is 280 characters)
+    if len(tweet_text) > 280:
+        # Truncate description to fit
+        max_desc_length = 280 - len(tweet_text) + len(description) - 3
+        if max_desc_length > 0:
+            truncated_desc = description[:max_desc_length] + "..."
+            tweet_text = f"🎉 New Store Alert! 🎉\n\n"
+            tweet_text += f"📍 {store.name}\n\n"
+            tweet_text += f"{truncated_desc}\n\n"
+            tweet_text += f"#NewStore #Ecommerce"
         else:
-            # Post tweet without media
-            response = twitter['client'].create_tweet(text=tweet_text)
-            logger.info(f"Successfully tweeted new store '{store.name}' (no logo)")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Error posting tweet for store '{store.name}': {str(e)}")
-        return False
+            tweet_text = f"🎉 New Store: {store.name} 🎉\n#NewStore #Ecommerce"
+    
+    return tweet_text
 
 
-def tweet_new_product(product):
+def build_product_tweet(product):
     """
-    Post a tweet when a new product is added.
+    Build the announcement text for a new product.
     
     Args:
         product: Product model instance
         
     Returns:
-        bool: True if tweet was posted successfully, False otherwise
+        str: Tweet text no longer than 280 characters
     """
-    twitter = get_twitter_client()
-    if not twitter:
-        logger.info(f"Skipping tweet for new product '{product.name}' - Twitter not configured")
-        return False
+    # Create tweet text
+    store_name = product.store.name if product.store else "Unknown Store"
+    tweet_text = f"🆕 New Product Added! 🆕\n\n"
+    tweet_text += f"🏪 Store: {store_name}\n"
+    tweet_text += f"📦 Product: {product.name}\n\n"
+    tweet_text += f"{product.description}\n\n"
+    tweet_text += f"💰 Price: ${product.price}\n"
+    tweet_text += f"#NewProduct #Shopping"
     
-    try:
-        # Create tweet text
-        store_name = product.store.name if product.store else "Unknown Store"
-        tweet_text = f"🆕 New Product Added! 🆕\n\n"
-        tweet_text += f"🏪 Store: {store_name}\n"
-        tweet_text += f"📦 Product: {product.name}\n\n"
-        tweet_text += f"{product.description}\n\n"
-        tweet_text += f"💰 Price: ${product.price}\n"
-        tweet_text += f"#NewProduct #Shopping"
-        
-        # Truncate if needed (Twitter limit is 280 characters)
-        if len(tweet_text) > 280:
-            # Truncate description to fit
-            base_text = f"🆕 New Product Added! 🆕\n\n🏪 Store: {store_name}\n📦 Product: {product.name}\n\n"
-            base_text += f"💰 Price: ${product.price}\n#NewProduct #Shopping"
-            max_desc_length = 280 - len(base_text) - 3
-            
-            if max_desc_length > 0:
-                truncated_desc = product.description[:max_desc_length] + "..."
-                tweet_text = f"🆕 New Product Added! 🆕\n\n"
-                tweet_text += f"🏪 Store: {store_name}\n"
-                tweet_text += f"📦 Product: {product.name}\n\n"
-                tweet_text += f"{truncated_desc}\n\n"
-                tweet_text += f"💰 Price: ${product.price}\n"
-                tweet_text += f"#NewProduct #Shopping"
-            else:
-                tweet_text = f"🆕 {product.name} @ {store_name}\n💰 ${product.price}\n#NewProduct"
+    # Truncate if needed (Twitter limit is 280 characters)
+    if len(tweet_text) > 280:
+        # Truncate description to fit
+        base_text = f"🆕 New Product Added! 🆕\n\n🏪 Store: {store_name}\n📦 Product: {product.name}\n\n"
+        base_text += f"💰 Price: ${product.price}\n#NewProduct #Shopping"
+        max_desc_length = 280 - len(base_text) - 3
         
-        # Check if product has images
-        product_images = product.productimage_set.all()
+        if max_desc_length > 0:
+            truncated_desc = product.description[:max_desc_length] + "..."
+            tweet_text = f"🆕 New Product Added! 🆕\n\n"
+            tweet_text += f"🏪 Store: {store_name}\n"
+            tweet_text += f"📦 Product: {product.name}\n\n"
+            tweet_text += f"{truncated_desc}\n\n"
+            tweet_text += f"💰 Price: ${product.price}\n"
+            tweet_text += f"#NewProduct #Shopping"
+        else:
+            tweet_text = f"🆕 {product.name} @ {store_name}\n💰 ${product.price}\n#NewProduct"
+    
+    return tweet_text
+
+
+def store_media_path(store):
+    """Return the local path of the store logo, or None if it has none."""
+    logo = getattr(store, 'logo', None)
+    return logo.path if logo else None
+
+
+def product_media_path(product):
+    """
+    Return the local path of the product's first image, or None if it has none.
+
+    Uses the IMAGE_TWEET_WIDTH JPEG derivative when it has been generated,
+    so the upload is not the full-size original.
+    """
+    # Iterate .all() so a prefetched image set is used without another query
+    product_images = list(product.productimage_set.all())
+    if not product_images:
+        return None
+    image = product_images[0]
+    name = image.derivative_name('jpeg', getattr(settings, 'IMAGE_TWEET_WIDTH', 1280))
+    return image.image.storage.path(name) if name else image.image.path
+
+
+def post_tweet(twitter, tweet_text, media_path=None, label=''):
+    """
+    Post a tweet, attaching media when a path is given.
+    
+    Media upload failures fall back to a text-only tweet; errors from
+    create_tweet itself, with or without media, are raised so callers can
+    retry them.
+    
+    Args:
+        twitter: Dict with 'client' (API v2) and 'api' (API v1.1) entries
+        tweet_text: Text to post
+        media_path: Optional local file to upload and attach
+        label: Description of what is being announced, for logging
+    """
+    media = None
+    if media_path:
+        try:
+            # Upload media using API v1.1
+            media = twitter['api'].media_upload(media_path)
+        except tweepy.TooManyRequests:
+            raise
+        except Exception as media_error:
+            logger.warning(f"Error uploading media for {label}: {str(media_error)}. Tweeting without image.")
+
+    if media is not None:
+        # Post tweet with media using API v2; failures are raised, not retried
+        # without the image, since the tweet may already have been posted
+        twitter['client'].create_tweet(
+            text=tweet_text,
+            media_ids=[media.media_id]
+        )
+        logger.info(f"Successfully tweeted {label} with media")
+        return
+
+    # Post tweet without media
+    twitter['client'].create_tweet(text=tweet_text)
+    logger.info(f"Successfully tweeted {label} without media")
+
+
+# ==================== TWEET OUTBOX ====================
+
+def _should_queue():
+    # Without credentials the worker posts nothing and queued rows would pile up;
+    # TWEET_OUTBOX_QUEUE_UNCONFIGURED keeps them for process_tweet_outbox --stub
+    return twitter_configured() or getattr(settings, 'TWEET_OUTBOX_QUEUE_UNCONFIGURED', False)
+
+
+def queue_tweet_new_store(store):
+    """Queue an announcement for a new store; the outbox worker posts it. Returns None if Twitter is off."""
+    if not _should_queue():
+        return None
+    return TweetOutbox.objects.create(kind=TweetOutbox.KIND_STORE, object_id=store.id)
+
+
+def queue_tweet_new_product(product):
+    """Queue an announcement for a new product; the outbox worker posts it. Returns None if Twitter is off."""
+    if not _should_queue():
+        return None
+    return TweetOutbox.objects.create(kind=TweetOutbox.KIND_PRODUCT, object_id=product.id)
+
+
+class StubTwitterClient:
+    """
+    Local stand-in for the tweepy clients.
+    Records tweets and uploads instead of calling Twitter, for tests and development.
+    """
+    def __init__(self):
+        self.tweets = []
+        self.uploads = []
+
+    def media_upload(self, filename):
+        self.uploads.append(filename)
+        return SimpleNamespace(media_id=len(self.uploads))
+
+    def create_tweet(self, text, media_ids=None):
+        self.tweets.append({'text': text, 'media_ids': media_ids})
+        return SimpleNamespace(data={'id': str(len(self.tweets)), 'text': text})
+
+    def as_twitter(self):
+        """Return the client dict shape expected by post_tweet."""
+        return {'client': self, 'api': self}
+
+
+def _rate_limit_reset(error):
+    """Return when a rate-limited request may be retried, from the x-rate-limit-reset header."""
+    try:
+        reset = int(error.response.headers.get('x-rate-limit-reset'))
+        return datetime.fromtimestamp(reset, tz=dt_timezone.utc)
+    except (AttributeError, TypeError, ValueError):
+        return timezone.now() + timedelta(minutes=15)
+
+
+def process_tweet_outbox(twitter=None, batch_size=20):
+    """
+    Post one batch of queued announcements, TWEET_OUTBOX_CONCURRENCY at a time.
+    
+    Args:
+        twitter: Optional client dict (e.g. StubTwitterClient().as_twitter());
+            defaults to get_twitter_client()
+        batch_size: Maximum number of outbox entries to process
         
-        if product_images.exists():
-            try:
-                # Get the first image
-                first_image = product_images.first()
-                
-                # Upload media using API v1.1
-                media = twitter['api'].media_upload(first_image.image.path)
-                
-                # Post tweet with media using API v2
-                response = twitter['client'].create_tweet(
-                    text=tweet_text,
-                    media_ids=[media.media_id]
-                )
-                logger.info(f"Successfully tweeted new product '{product.name}' with image")
-                return True
-            except Exception as media_error:
-                logger.warning(f"Error uploading product image: {str(media_error)}. Tweeting without image.")
-                # Fallback: tweet without image
-                response = twitter['client'].create_tweet(text=tweet_text)
-                logger.info(f"Successfully tweeted new product '{product.name}' without image")
-                return True
+    Returns:
+        dict: Counts of 'sent', 'retried', 'failed' and 'deferred' entries
+    """
+    results = {'sent': 0, 'retried': 0, 'failed': 0, 'deferred': 0}
+
+    twitter = twitter or get_twitter_client()
+    if not twitter:
+        logger.info("Skipping tweet outbox - Twitter not configured")
+        return results
+
+    entries = claim_batch(TweetOutbox, batch_size, 'TWEET_OUTBOX')
+    if not entries:
+        return results
+
+    # Load every announced object for the batch up front
+    stores = Store.objects.in_bulk(
+        [entry.object_id for entry in entries if entry.kind == TweetOutbox.KIND_STORE]
+    )
+    products = Product.objects.select_related('store').prefetch_related('productimage_set').in_bulk(
+        [entry.object_id for entry in entries if entry.kind == TweetOutbox.KIND_PRODUCT]
+    )
+
+    tweets = []
+    for entry in entries:
+        if entry.kind == TweetOutbox.KIND_STORE:
+            store = stores.get(entry.object_id)
+            tweet = store and (build_store_tweet(store), store_media_path(store), f"new store '{store.name}'")
         else:
-            # Post tweet without media (no image available)
-            response = twitter['client'].create_tweet(text=tweet_text)
-            logger.info(f"Successfully tweeted new product '{product.name}' (no image)")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Error posting tweet for product '{product.name}': {str(e)}")
-        return False
+            product = products.get(entry.object_id)
+            tweet = product and (build_product_tweet(product), product_media_path(product), f"new product '{product.name}'")
+
+        if not tweet:
+            entry.status = TweetOutbox.STATUS_FAILED
+            entry.last_error = f"{entry.kind} {entry.object_id} no longer exists"
+            entry.save(update_fields=['status', 'last_error'])
+            results['failed'] += 1
+            continue
+        tweets.append((entry, tweet))
+
+    # Post a window of tweets at a time concurrently; the uploads and API
+    # calls are network-bound, and the outcomes are recorded afterwards
+    concurrency = max(1, getattr(settings, 'TWEET_OUTBOX_CONCURRENCY', 4))
+    for start in range(0, len(tweets), concurrency):
+        window = tweets[start:start + concurrency]
+        outcomes = run_blocking_concurrently(
+            [partial(post_tweet, twitter, text, media_path, label=label)
+             for entry, (text, media_path, label) in window]
+        )
+
+        rate_limited = []
+        for (entry, (text, media_path, label)), outcome in zip(window, outcomes):
+            if isinstance(outcome, tweepy.TooManyRequests):
+                rate_limited.append((entry, outcome))
+            elif isinstance(outcome, Exception):
+                logger.error(f"Error posting queued tweet for {label}: {str(outcome)}")
+                twitter_client_pool.report_failure(twitter, outcome)
+                results['retried' if schedule_retry(entry, outcome, 'TWEET_OUTBOX') else 'failed'] += 1
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                mark_complete(entry, TweetOutbox.STATUS_SENT, 'sent_at')
+                results['sent'] += 1
+
+        if rate_limited:
+            # Stop the batch and hold the remaining entries until the window resets
+            remaining = [entry.id for entry, error in rate_limited]
+            remaining += [entry.id for entry, tweet in tweets[start + concurrency:]]
+            TweetOutbox.objects.filter(id__in=remaining).update(
+                next_attempt_at=_rate_limit_reset(rate_limited[0][1])
+            )
+            logger.warning(f"Twitter rate limit reached; deferring {len(remaining)} queued tweets")
+            results['deferred'] += len(remaining)
+            break
+
+    return results
@@ -10,6 +10,8 @@ router = DefaultRouter()
 router.register(r'stores', api_views.StoreViewSet, basename='api-store')
 router.register(r'products', api_views.ProductViewSet, basename='api-product')
 router.register(r'reviews', api_views.ReviewViewSet, basename='api-review')
+router.register(r'exports', api_views.ExportViewSet, basename='api-export')
+router.register(r'tokens', api_views.ApiTokenViewSet, basename='api-token')
 
 urlpatterns = [
     # REST API Endpoints
@@ -6,17 +6,35 @@ from django.contrib.auth import logout
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required, user_passes_test
 from .models import Product, ResetToken, Store, Order, OrderItem, Review
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control
 from datetime import datetime, timedelta 
 from django.core.mail import EmailMessage
 import secrets
 from hashlib import sha1
 from decimal import Decimal
-from .twitter_utils import tweet_new_store, tweet_new_product 
+from .twitter_utils import queue_tweet_new_store, queue_tweet_new_product
+from .checkout_utils import place_order, EmptyCart, InsufficientStock
+from .cart_utils import ahydrate_cart, hydrate_cart
+from . import cart_utils
+from .token_utils import revoke_user_tokens
+from .db_routers import replica_reads
+from .email_utils import queue_email
+from .pagination import akeyset_paginate, keyset_paginate
+from .cache_utils import CATALOG_SCOPE, acached_read, apage_etag, product_scope
+from .fragment_utils import arender_product_cards
+from .async_utils import aget_user, arender, async_etag, async_login_required
+from .rating_utils import RATING_VALUES
+from . import role_utils
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
+LOGIN_SESSION_AGE = int(timedelta(days=1).total_seconds())
+
 # These will be set up when groups are created - removed to avoid errors at import time
 # Vendors, created = Group.objects.get_or_create(name='Vendors')
 # Buyers, created = Group.objects.get_or_create(name='Buyers')
@@ -28,6 +46,7 @@ def change_user_password(username,new_password):
     user = User.objects.get(username=username)
     user.set_password(new_password)
     user.save()
+    revoke_user_tokens(user)
     return True
 
 def login_user(request):
@@ -38,10 +57,8 @@ def login_user(request):
 
       if user is not None:
           login(request, user)
-          exp_date = datetime.now() + timedelta (days=1)
-          request.session.set_expiry (exp_date)
-          request.session['user.id'] = user.id 
-          request.session['username'] = user.username
+          # Logged-in sessions last a day; the user id is already stored by login()
+          request.session.set_expiry(LOGIN_SESSION_AGE)
           return HttpResponse ("You are logged in.")
       else:
             return HttpResponse ("Invalid login credentials, please try again.")
@@ -106,26 +123,14 @@ def add_item_to_cart(request):
     except ValueError:
         quantity =1
     
-    cart = request.session.get("cart",{})
-    if item in cart: 
-        cart[item] += quantity
-    else:
-        cart[item] = quantity
-    request.session["cart"] =cart
-    request.session.modified = True
+    product = Product.objects.filter(name=item).order_by('id').first()
+    if product is not None:
+        cart_utils.add_to_cart(request, product.id, quantity)
     return redirect ('Supadupastore/cart_page.html')
 
 def retrieve_products(request):
-    products = []
-    session = request.session 
-    if 'cart' in session:
-        for name, quantity in session['cart'].items():
-            try:
-                product = Product.objects.get(name=name)
-                products.append({'product': product, 'quantity': quantity})
-            except Product.DoesNotExist:
-                pass
-    return products
+    cart_items, total = hydrate_cart(request)
+    return cart_items
 
 def show_user_cart(request):
     cart = retrieve_products(request)
@@ -159,7 +164,7 @@ def send_password_reset_email(request):
     user = User.objects.get(email=user_email)
     url = generate_reset_url(user)
     email = build_email(user, url)
-    email.send()
+    queue_email(email)
     return render (request, 'Supadupastore/password_reset_sent.html')
 
 def reset_password(request, token):
@@ -179,6 +184,8 @@ def reset_password(request, token):
         user = reset_token.user
         user.set_password(new_password)
         user.save()
+        # A password reset also ends every API token session
+        revoke_user_tokens(user)
         reset_token.used = True
         reset_token.save()
         return render (request, 'Supadupastore/reset_password_success.html')
@@ -200,16 +207,18 @@ def alter_login(request):
         if new_password:
             user.set_password(new_password)
         user.save()
+        if new_password:
+            revoke_user_tokens(user)
         return HttpResponseRedirect(reverse("Supadupastore:welcome"))
     return render (request, 'Supadupastore/alter_login.html')
 
 # Helper function to check if user is a vendor
 def is_vendor(user):
-    return user.groups.filter(name='Vendors').exists()
+    return role_utils.is_vendor(user)
 
 # Helper function to check if user is a buyer
 def is_buyer(user):
-    return user.groups.filter(name='Buyers').exists()
+    return role_utils.is_buyer(user)
 
 # ==================== VENDOR STORE MANAGEMENT VIEWS ====================
 
@@ -236,8 +245,8 @@ def create_store(request):
             store.logo = logo
             store.save()
         
-        # Post tweet about new store
-        tweet_new_store(store)
+        # Queue tweet about new store
+        queue_tweet_new_store(store)
         
         return redirect('Supadupastore:my_stores')
     
@@ -305,8 +314,8 @@ def add_product(request):
                 stock=int(stock)
             )
             
-            # Post tweet about new product
-            tweet_new_product(product)
+            # Queue tweet about new product
+            queue_tweet_new_product(product)
             
             return redirect('Supadupastore:my_products')
         except (Store.DoesNotExist, ValueError) as e:
@@ -319,7 +328,9 @@ def add_product(request):
 @user_passes_test(is_vendor)
 def my_products(request):
     """View all products from vendor's stores"""
-    products = Product.objects.filter(store__owner=request.user)
+    products = keyset_paginate(
+        request, Product.objects.filter(store__owner=request.user).select_related('store')
+    )
     return render(request, 'Supadupastore/my_products.html', {'products': products})
 
 @login_required
@@ -352,17 +363,60 @@ def delete_product(request, product_id):
 
 # ==================== BUYER SHOPPING VIEWS ====================
 
-def browse_products(request):
+# Browsing, product pages and the cart view are async: under eComm.asgi they
+# await the cache and the async ORM instead of holding a worker thread.
+
+def _browse_cache_name(request):
+    return f"browse:{request.GET.get('cursor', '')}"
+
+async def _browse_etag(request):
+    await aget_user(request)
+    return await apage_etag(request, _browse_cache_name(request), [CATALOG_SCOPE])
+
+@replica_reads
+@async_etag(_browse_etag)
+async def browse_products(request):
     """Allow anyone to browse all products"""
-    products = Product.objects.all()
-    return render(request, 'Supadupastore/browse_products.html', {'products': products})
+    products = await acached_read(
+        _browse_cache_name(request), [CATALOG_SCOPE],
+        lambda: akeyset_paginate(
+            request, Product.objects.select_related('store').prefetch_related('productimage_set')
+        ),
+        request=request
+    )
+    cards = await arender_product_cards(products)
+    response = await arender(request, 'Supadupastore/browse_products.html',
+                             {'products': products, 'cards': cards})
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+async def _product_detail_etag(request, product_id):
+    await aget_user(request)
+    return await apage_etag(request, f'product-detail:{product_id}', [product_scope(product_id)])
 
-def product_detail(request, product_id):
+async def _load_product_detail(product_id):
+    try:
+        product = await (Product.objects.select_related('store')
+                         .prefetch_related('productimage_set').aget(id=product_id))
+    except Product.DoesNotExist:
+        raise Http404("No Product matches the given query.")
+    reviews = [review async for review in
+               Review.objects.filter(product=product).select_related('user').order_by('-created_at')]
+    return product, reviews
+
+@replica_reads
+@async_etag(_product_detail_etag)
+async def product_detail(request, product_id):
     """View details of a specific product"""
-    product = get_object_or_404(Product, id=product_id)
-    reviews = Review.objects.filter(product=product).order_by('-created_at')
-    return render(request, 'Supadupastore/product_detail.html', 
-                 {'product': product, 'reviews': reviews})
+    product, reviews = await acached_read(
+        f'product-detail:{product_id}', [product_scope(product_id)],
+        lambda: _load_product_detail(product_id),
+        request=request
+    )
+    response = await arender(request, 'Supadupastore/product_detail.html',
+                             {'product': product, 'reviews': reviews})
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 @login_required
 def add_to_cart(request, product_id):
@@ -373,54 +427,24 @@ def add_to_cart(request, product_id):
     if quantity < 1:
         quantity = 1
     
-    cart = request.session.get('cart', {})
-    product_key = str(product_id)
-    
-    if product_key in cart:
-        cart[product_key] += quantity
-    else:
-        cart[product_key] = quantity
-    
-    request.session['cart'] = cart
-    request.session.modified = True
+    cart_utils.add_to_cart(request, product.id, quantity)
     
     return redirect('Supadupastore:view_cart')
 
 @login_required
 def remove_from_cart(request, product_id):
     """Remove a product from the shopping cart"""
-    cart = request.session.get('cart', {})
-    product_key = str(product_id)
-    
-    if product_key in cart:
-        del cart[product_key]
-        request.session['cart'] = cart
-        request.session.modified = True
+    cart_utils.remove_from_cart(request, product_id)
     
     return redirect('Supadupastore:view_cart')
 
-@login_required
-def view_cart(request):
+@async_login_required
+async def view_cart(request):
     """View shopping cart contents"""
-    cart = request.session.get('cart', {})
-    cart_items = []
-    total = Decimal('0.00')
+    cart_items, total = await ahydrate_cart(request)
     
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(id=product_id)
-            subtotal = product.price * quantity
-            total += subtotal
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'subtotal': subtotal
-            })
-        except Product.DoesNotExist:
-            pass
-    
-    return render(request, 'Supadupastore/view_cart.html', 
-                 {'cart_items': cart_items, 'total': total})
+    return await arender(request, 'Supadupastore/view_cart.html',
+                         {'cart_items': cart_items, 'total': total})
 
 # ==================== CHECKOUT & INVOICE ====================
 
@@ -428,93 +452,34 @@ def view_cart(request):
 def checkout(request):
     """Process checkout and create order"""
     if request.method == 'POST':
-        cart = request.session.get('cart', {})
+        cart = cart_utils.get_cart(request)
         
-        if not cart:
+        if cart is None:
             return redirect('Supadupastore:view_cart')
         
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            total_amount=Decimal('0.00')
-        )
-        
-        total = Decimal('0.00')
-        invoice_items = []
-        
-        # Create order items
-        for product_id, quantity in cart.items():
-            try:
-                product = Product.objects.get(id=product_id)
-                
-                # Check stock
-                if product.stock < quantity:
-                    order.delete()
-                    return render(request, 'Supadupastore/checkout.html', 
-                                 {'error': f'Insufficient stock for {product.name}'})
-                
-                # Create order item
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=quantity,
-                    price=product.price
-                )
-                
-                # Update stock
-                product.stock -= quantity
-                product.save()
-                
-                subtotal = product.price * quantity
-                total += subtotal
-                
-                invoice_items.append({
-                    'name': product.name,
-                    'quantity': quantity,
-                    'price': product.price,
-                    'subtotal': subtotal
-                })
-                
-            except Product.DoesNotExist:
-                continue
-        
-        # Update order total
-        order.total_amount = total
-        order.save()
+        # Create order, order items, stock updates and empty the cart in one transaction
+        try:
+            order, invoice_items, total = place_order(request.user, cart)
+        except EmptyCart:
+            return redirect('Supadupastore:view_cart')
+        except InsufficientStock as e:
+            return render(request, 'Supadupastore/checkout.html', 
+                         {'error': str(e)})
         
         # Send invoice email
         send_invoice_email(request.user, order, invoice_items, total)
         
-        # Clear cart
-        request.session['cart'] = {}
-        request.session.modified = True
-        
         return render(request, 'Supadupastore/checkout_success.html', 
                      {'order': order})
     
     # GET request - show checkout page
-    cart = request.session.get('cart', {})
-    cart_items = []
-    total = Decimal('0.00')
-    
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(id=product_id)
-            subtotal = product.price * quantity
-            total += subtotal
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'subtotal': subtotal
-            })
-        except Product.DoesNotExist:
-            pass
+    cart_items, total = hydrate_cart(request)
     
     return render(request, 'Supadupastore/checkout.html', 
                  {'cart_items': cart_items, 'total': total})
 
 def send_invoice_email(user, order, items, total):
-    """Send invoice email to user after checkout"""
+    """Queue invoice email to user after checkout"""
     subject = f"Order Confirmation - Order #{order.id}"
     
     # Build email body
@@ -544,9 +509,9 @@ def send_invoice_email(user, order, items, total):
     )
     
     try:
-        email.send()
+        queue_email(email)
     except Exception as e:
-        print(f"Failed to send email: {e}")
+        logger.error(f"Failed to queue invoice email for order #{order.id}: {str(e)}")
 
 # ==================== REVIEW VIEWS ====================
 
@@ -559,7 +524,14 @@ def add_review(request, product_id):
     existing_review = Review.objects.filter(user=request.user, product=product).first()
     
     if request.method == 'POST':
-        rating = int(request.POST.get('rating', 5))
+        try:
+            rating = int(request.POST.get('rating', 5))
+        except ValueError:
+            rating = None
+        if rating not in RATING_VALUES:
+            return render(request, 'Supadupastore/add_review.html',
+                         {'product': product, 'existing_review': existing_review,
+                          'error': 'Rating must be a whole number from 1 to 5'})
         comment = request.POST.get('comment', '')
         
         if existing_review:
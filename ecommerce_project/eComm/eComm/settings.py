@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Supadupastore.middleware.QueryMetricsMiddleware',
+    'Supadupastore.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,6 +70,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'Supadupastore.context_processors.roles',
             ],
         },
     },
@@ -81,12 +84,17 @@ WSGI_APPLICATION = 'eComm.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        # django.db.backends.mysql with connections from a shared pool (see DB_POOL_*)
+        'ENGINE': 'Supadupastore.db_backends.mysql',
         'NAME': 'ecomm_db',
         'USER': 'root',
         'PASSWORD': 'password',
         'HOST': 'localhost',
         'PORT': '3306',
+        # Connections go back to the pool at the end of each request
+        'CONN_MAX_AGE': 0,
+        # Ping pooled connections before reuse
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -127,6 +135,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (product images and their derivatives)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -143,14 +155,18 @@ EMAIL_HOST_PASSWORD = "your_email_password"
 # Django REST Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'Supadupastore.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'Supadupastore.pagination.CatalogCursorPagination',
     'PAGE_SIZE': 10,
+    # Streaming exports (/api/exports/) read whole tables; limit how often each user pulls them
+    'DEFAULT_THROTTLE_RATES': {
+        'exports': '60/hour',
+    },
 }
 
 # Twitter API Configuration
@@ -160,3 +176,129 @@ TWITTER_API_SECRET = 'your_api_secret_here'
 TWITTER_ACCESS_TOKEN = 'your_access_token_here'
 TWITTER_ACCESS_TOKEN_SECRET = 'your_access_token_secret_here'
 TWITTER_BEARER_TOKEN = 'your_bearer_token_here'
+
+# Tweet outbox worker (python manage.py process_tweet_outbox)
+TWEET_OUTBOX_MAX_ATTEMPTS = 5
+TWEET_OUTBOX_RETRY_SECONDS = 60
+TWEET_OUTBOX_LEASE_SECONDS = 300
+# Tweets posted at once by the outbox worker
+TWEET_OUTBOX_CONCURRENCY = 4
+# Announcements are only queued once the credentials above are filled in;
+# set this to queue them anyway and drain with process_tweet_outbox --stub
+TWEET_OUTBOX_QUEUE_UNCONFIGURED = False
+
+# Email outbox worker (python manage.py process_email_outbox)
+# Set EMAIL_OUTBOX_BACKEND to e.g. 'django.core.mail.backends.locmem.EmailBackend' in tests
+EMAIL_OUTBOX_BACKEND = None
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_SECONDS = 60
+EMAIL_OUTBOX_LEASE_SECONDS = 300
+# Sent and failed entries are deleted by process_email_outbox --purge after this many days
+EMAIL_OUTBOX_RETENTION_DAYS = 7
+
+# Product/review search backend for the API `search` parameter
+# MySQLFullTextBackend queries the FULLTEXT indexes MySQL maintains itself.
+# 'Supadupastore.search_utils.InProcessSearchBackend' (SQLite/development) keeps
+# an index in each process, versioned through CATALOG_CACHE_ALIAS, and stops
+# at SEARCH_MAX_RESULTS matches; copies are (re)built in a background thread
+# unless SEARCH_INDEX_BACKGROUND_BUILD is False.
+SEARCH_BACKEND = 'Supadupastore.search_utils.MySQLFullTextBackend'
+SEARCH_MAX_RESULTS = 1000
+SEARCH_INDEX_BACKGROUND_BUILD = True
+
+# Catalog read-through cache (Supadupastore.cache_utils)
+# Point CATALOG_CACHE_ALIAS at a shared backend (Memcached/Redis) when running
+# several processes; the default local-memory cache is per process, and
+# warm_product_cards refuses to run against it. Entries expire after
+# CATALOG_CACHE_TIMEOUT seconds, including warmed product cards unless the
+# command is given a longer --timeout.
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 300
+CATALOG_CACHE_LOCAL_ENTRIES = 512
+
+# Session storage. SESSION_MODE picks the engine:
+# - 'db': one django_session read per request (Django default)
+# - 'cached_db': reads served from the 'sessions' cache, writes go through to the database
+# - 'signed_cookie': no server-side storage; suits mostly-anonymous browsing since
+#   sessions only hold a login and a cart id, but cannot be revoked server-side
+# Compare them with: python manage.py benchmark_sessions
+SESSION_MODE = 'cached_db'
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookie': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Local in-memory caches; point 'sessions' (and 'default') at Memcached or
+# Redis when running more than one process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'supadupastore-default',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'supadupastore-sessions',
+    },
+}
+
+# Request metrics (Supadupastore.middleware.QueryMetricsMiddleware)
+# Each process writes histograms to METRICS_DIR; see python manage.py metrics_report
+METRICS_ENABLED = True
+METRICS_DIR = BASE_DIR / 'metrics'
+METRICS_FLUSH_SECONDS = 10
+METRICS_SERVER_TIMING = DEBUG
+
+# Group-based roles (Supadupastore/role_utils.py) are cached across requests
+# only if this cache is shared between processes (Memcached/Redis); with a
+# local-memory cache they are read once per request so group changes apply
+# at once in every worker
+ROLE_CACHE_ALIAS = 'default'
+
+# API bearer tokens (POST /api/tokens/ with username/password to obtain one)
+API_TOKEN_LIFETIME_DAYS = 30
+# Token lookups are cached only if this cache is shared between processes
+# (Memcached/Redis); with the local-memory caches above every request reads
+# the token from the database, so revocations apply immediately
+API_TOKEN_CACHE_ALIAS = 'default'
+API_TOKEN_CACHE_SECONDS = 300
+API_TOKEN_NEGATIVE_CACHE_SECONDS = 60
+# With a shared API_TOKEN_CACHE_ALIAS: how long a process may keep accepting
+# a token revoked by another process
+API_TOKEN_LOCAL_TTL = 30
+API_TOKEN_LOCAL_ENTRIES = 1024
+
+# Read replicas: DATABASES aliases that serve catalog and export reads
+# (Supadupastore/db_routers.py). Empty sends every query to 'default'.
+# 'replica' is only used once listed in DATABASE_REPLICAS; point its HOST at
+# the replica server. Tests mirror it to 'default' to exercise the routing.
+DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['Supadupastore.db_routers.ReplicaRouter']
+# After a write, keep the client on the primary for this long (replication lag)
+REPLICA_STICKY_SECONDS = 5
+REPLICA_PIN_COOKIE = 'pin_primary'
+
+# Database connection pool, per alias and process (Supadupastore/pool_utils.py).
+# Size it to the worker threads that use the database at once; requests
+# beyond that wait up to DB_POOL_TIMEOUT seconds. 0 opens a connection per
+# request (or per thread with CONN_MAX_AGE), as the stock backends do.
+DB_POOL_SIZE = 20
+DB_POOL_TIMEOUT = 10
+# Replace pooled connections older than this (below MySQL's wait_timeout)
+DB_POOL_RECYCLE_SECONDS = 600
+
+# Product image derivatives (Supadupastore/image_utils.py): resized WebP and
+# JPEG copies written next to each upload by python manage.py process_image_outbox;
+# backfill existing images with python manage.py backfill_image_derivatives
+IMAGE_DERIVATIVE_WIDTHS = [320, 640, 1280]
+IMAGE_DERIVATIVE_FORMATS = ['webp', 'jpeg']
+IMAGE_DERIVATIVE_QUALITY = {'webp': 80, 'jpeg': 82}
+# Width used for a plain <img src> and for the image attached to tweets
+IMAGE_DISPLAY_WIDTH = 640
+IMAGE_TWEET_WIDTH = 1280
+IMAGE_OUTBOX_MAX_ATTEMPTS = 3
+IMAGE_OUTBOX_RETRY_SECONDS = 60
+IMAGE_OUTBOX_LEASE_SECONDS = 300